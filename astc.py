@@ -78,71 +78,94 @@ class NodeKind(Enum):
     OP_MINUS = 68 # -
 
 class Node(object):
+    '''
+    every node kind has a fixed slotted attribute set,
+    subclasses call Node.__init__ for the common part
+    '''
+    __slots__ = ('kind', 'ty', 'sourceloc')
 
     def __init__(self):
         self.kind = NodeKind.AST_LITERAL
         self.ty = None
-        self.sourceloc = None
+        self.sourceloc = None # token index, see Parser.location
 
 class ValueNode(Node):
+    __slots__ = ('val',)
 
     def __init__(self, val):
         '''
         char,int,long,float,double,char,string
         '''
+        Node.__init__(self)
         self.val = val
 
 class VarNode(Node):
+    __slots__ = ('name', 'lvarinit')
 
     def __init__(self, name):
+        Node.__init__(self)
         self.name = name
         self.lvarinit = []
 
 class DeclNode(Node):
+    __slots__ = ('declvar', 'declinit')
 
     def __init__(self, node, init_list):
         '''
         declaration
         '''
+        Node.__init__(self)
         self.declvar = node
         self.declinit = init_list
 
 class InitNode(Node):
+    __slots__ = ('initval', 'totype')
 
     def __init__(self, node, totype):
         '''
         initializer
         '''
+        Node.__init__(self)
         self.initval = node
         self.totype = totype
 
 class BinaryNode(Node):
+    __slots__ = ('left', 'right')
 
     def __init__(self, left, right):
+        Node.__init__(self)
         self.left = left
         self.right = right
 
 class UnaryNode(Node):
+    __slots__ = ('operand',)
 
     def __init__(self, operand):
+        Node.__init__(self)
         self.operand = operand
 
 class FuncNode(Node):
+    __slots__ = ('fname', 'params', 'localvars', 'body')
 
     def __init__(self):
+        Node.__init__(self)
         self.fname = ''
         self.params = []
         self.localvars = []
         self.body = None
 
 class CompoundStmtNode(Node):
+    __slots__ = ('stmts',)
 
     def __init__(self):
+        Node.__init__(self)
         self.stmts = []
 
 class IfStmtNode(Node):
+    __slots__ = ('cond', 'then', 'els')
 
     def __init__(self):
+        Node.__init__(self)
         self.cond = None
         self.then = None
         self.els = None
@@ -152,12 +175,16 @@ class NodeFactory(object):
     produce abstract syntax tree node
     '''
 
-    def __init__(self, sm):
+    def __init__(self, sm, ev=None):
         self.sm = sm #symbol manager
-        self.sl = None # source location
+        self.sl = None # source location, token index
+        self.ev = ev # eval.Eval folding the constant nodes as they are built, None keeps them
+        self.pin = None # called with the token index of every node, see parse.TokenRing.pin
 
     def _base_set(self, node):
         node.sourceloc = self.sl
+        if not self.pin is None:
+            self.pin(self.sl)
 
     def val_node(self, ty, val):
         node = ValueNode(val)
@@ -187,6 +214,10 @@ class NodeFactory(object):
         return node
 
     def binary_node(self, kind, ty, left, right):
+        if not self.ev is None:
+            v = self.ev.fold_binary(kind, ty, left, right)
+            if not v is None:
+                return self.val_node(ty, v)
         node = BinaryNode(left, right)
         self._base_set(node)
         node.kind = kind
@@ -194,6 +225,10 @@ class NodeFactory(object):
         return node
 
     def unary_node(self, kind, ty, node):
+        if not self.ev is None:
+            v = self.ev.fold_unary(kind, ty, node)
+            if not v is None:
+                return self.val_node(ty, v)
         n = UnaryNode(node)
         self._base_set(n)
         n.kind = kind
@@ -201,6 +236,10 @@ class NodeFactory(object):
         return n
 
     def conv_node(self, toty, node):
+        if not self.ev is None:
+            v = self.ev.fold_unary(NodeKind.AST_CONV, toty, node)
+            if not v is None:
+                return self.val_node(toty, v)
         n = UnaryNode(node)
         self._base_set(n)
         n.kind = NodeKind.AST_CONV
@@ -233,3 +272,25 @@ class NodeFactory(object):
         n.then = then
         n.els = els
         return n
+
+def iter_nodes(nodes):
+    '''
+    every node of the trees in nodes once, parents first
+    '''
+    seen = set()
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        children = []
+        for cls in type(node).__mro__[:-2]: # up to Node
+            for attr in cls.__slots__:
+                child = getattr(node, attr)
+                if isinstance(child, Node):
+                    children.append(child)
+                elif isinstance(child, list):
+                    children.extend(c for c in child if isinstance(c, Node))
+        stack.extend(reversed(children))
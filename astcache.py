@@ -0,0 +1,316 @@
+'''
+Copyright 2018 JackLiang.
+
+AST serialization and cache
+'''
+import gc
+import sys
+import struct
+from array import array
+from ctype import *
+from astc import *
+from csymbol import Coordinate
+from utils.diskcache import content_key
+
+AST_FORMAT = 1 # bump when the layout below changes
+
+# magic, format, type count, node count, root count, location count, file count,
+# string count, string bytes, int count
+HEADER = struct.Struct('<4sIIIIIIIII')
+MAGIC = b'PCCA'
+
+# fields of every node class after kind, ty and sourceloc.
+# node: a node or None, nodes: a node list or None, type: a Type or None
+NODE_FIELDS = (
+    (ValueNode, (('val', 'const'),)),
+    (VarNode, (('name', 'str'), ('lvarinit', 'nodes'))),
+    (DeclNode, (('declvar', 'node'), ('declinit', 'nodes'))),
+    (InitNode, (('initval', 'node'), ('totype', 'type'))),
+    (BinaryNode, (('left', 'node'), ('right', 'node'))),
+    (UnaryNode, (('operand', 'node'),)),
+    (FuncNode, (('fname', 'str'), ('params', 'nodes'), ('localvars', 'nodes'), ('body', 'node'))),
+    (CompoundStmtNode, (('stmts', 'nodes'),)),
+    (IfStmtNode, (('cond', 'node'), ('then', 'node'), ('els', 'node'))),
+)
+NODE_CLASSES = tuple(cls for cls, fields in NODE_FIELDS)
+NODE_TAGS = dict((cls, tag) for tag, cls in enumerate(NODE_CLASSES))
+NODE_KINDS = dict((kind.value, kind) for kind in NodeKind)
+TYPE_KINDS = dict((kind.value, kind) for kind in TypeKind)
+SCLASSES = dict((sclass.value, sclass) for sclass in SClass)
+
+class LocationTable(object):
+    '''
+    source location of the token indexes kept in node.sourceloc,
+    replaces Parser.location once the tokens are gone
+    '''
+
+    def __init__(self):
+        self.indexes = array('i')
+        self.files = array('i')
+        self.lines = array('i')
+        self.columns = array('i')
+        self.filenames = []
+        self._positions = None
+
+    def location(self, index):
+        if index is None:
+            return None
+        if self._positions is None:
+            self._positions = dict(zip(self.indexes, range(len(self.indexes))))
+        i = self._positions[index]
+        return Coordinate(self.filenames[self.files[i]], self.lines[i], self.columns[i])
+
+class _Writer(object):
+
+    def __init__(self, location):
+        self.location = location
+        self.ints = array('i')
+        self.strings = []
+        self._string_index = {}
+        self.types = []
+        self._type_index = {}
+        self.nodes = []
+        self.tags = array('b')
+        self._node_index = {}
+        self.locations = LocationTable()
+        self._locs = set()
+        self._file_index = {}
+
+    def string(self, s):
+        if s is None:
+            return -1
+        i = self._string_index.get(s, None)
+        if i is None:
+            i = self._string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def const(self, v):
+        if v is None:
+            return -1
+        if isinstance(v, bool) or isinstance(v, int):
+            return self.string('i' + repr(int(v)))
+        if isinstance(v, float):
+            return self.string('f' + repr(v))
+        return self.string('s' + v)
+
+    def type(self, ty):
+        if ty is None:
+            return -1
+        i = self._type_index.get(id(ty), None)
+        if i is None:
+            i = self._type_index[id(ty)] = len(self.types)
+            self.types.append(ty)
+        return i
+
+    def node(self, node):
+        if node is None:
+            return -1
+        i = self._node_index.get(id(node), None)
+        if i is None:
+            i = self._node_index[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+        return i
+
+    def loc(self, index):
+        if index is None:
+            return -1
+        if index in self._locs:
+            return index
+        self._locs.add(index)
+        locations = self.locations
+        c = self.location(index)
+        f = self._file_index.get(c.filename, None)
+        if f is None:
+            f = self._file_index[c.filename] = len(locations.filenames)
+            locations.filenames.append(c.filename)
+        locations.indexes.append(index)
+        locations.files.append(f)
+        locations.lines.append(c.line)
+        locations.columns.append(c.column)
+        return index
+
+    def write_node(self, node):
+        ints = self.ints
+        tag = NODE_TAGS[type(node)]
+        self.tags.append(tag)
+        ints.append(node.kind.value)
+        ints.append(self.type(node.ty))
+        ints.append(self.loc(node.sourceloc))
+        for attr, codec in NODE_FIELDS[tag][1]:
+            v = getattr(node, attr)
+            if codec == 'node':
+                ints.append(self.node(v))
+            elif codec == 'nodes':
+                if v is None:
+                    ints.append(-1)
+                else:
+                    ints.append(len(v))
+                    for n in v:
+                        ints.append(self.node(n))
+            elif codec == 'type':
+                ints.append(self.type(v))
+            elif codec == 'str':
+                ints.append(self.string(v))
+            else:
+                ints.append(self.const(v))
+
+    def write_type(self, ty):
+        ints = self.ints
+        ints.extend((ty.kind.value, ty.size, ty.align, int(ty.usig), int(ty.isstatic),
+                     ty.scalss.value, self.string(ty.varname), self.type(ty.ptr),
+                     ty.array_len, self.type(ty.ret_type), int(ty.hasva)))
+        if ty.params is None:
+            ints.append(-1)
+        else:
+            ints.append(len(ty.params))
+            for p in ty.params:
+                ints.append(self.type(p))
+
+def dump_ast(ast, location):
+    '''
+    binary form of the AST list with its Type graph and the source locations,
+    location maps node.sourceloc to a Coordinate, like Parser.location
+    '''
+    w = _Writer(location)
+    roots = array('i', [w.node(n) for n in ast])
+    i = 0
+    while i < len(w.nodes): # nodes found while writing are appended
+        w.write_node(w.nodes[i])
+        i += 1
+    node_ints = w.ints
+    w.ints = array('i')
+    i = 0
+    while i < len(w.types):
+        w.write_type(w.types[i])
+        i += 1
+    type_ints = w.ints
+
+    locations = w.locations
+    filenames = array('i', [w.string(name) for name in locations.filenames])
+    blob = ''.join(w.strings).encode('utf-8', 'surrogatepass')
+    lengths = array('i', [len(s) for s in w.strings])
+    header = HEADER.pack(MAGIC, AST_FORMAT, len(w.types), len(w.nodes), len(roots), len(locations.indexes),
+                         len(filenames), len(w.strings), len(blob), len(node_ints) + len(type_ints))
+    parts = [header]
+    for column in (roots, locations.indexes, locations.files, locations.lines, locations.columns,
+                   filenames, lengths, type_ints, node_ints):
+        if sys.byteorder == 'big':
+            column = array('i', column)
+            column.byteswap()
+        parts.append(column.tobytes())
+    parts.append(w.tags.tobytes())
+    parts.append(blob)
+    return b''.join(parts)
+
+def _const(s):
+    if s[0] == 'i':
+        return int(s[1:])
+    if s[0] == 'f':
+        return float(s[1:])
+    return s[1:]
+
+def load_ast(data):
+    '''
+    read dump_ast output, return (ast, LocationTable)
+    '''
+    # the loader only allocates, collections while it runs find nothing to free
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_ast(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _load_ast(data):
+    (magic, version, ntypes, nnodes, nroots, nlocs, nfiles,
+     nstrings, nblob, nints) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != AST_FORMAT:
+        raise ValueError('not an AST of format {}'.format(AST_FORMAT))
+    view = memoryview(data)
+    pos = HEADER.size
+
+    def column(n):
+        c = array('i')
+        c.frombytes(view[pos:pos + 4 * n])
+        if sys.byteorder == 'big':
+            c.byteswap()
+        return c
+
+    roots = column(nroots)
+    pos += 4 * nroots
+    locations = LocationTable()
+    for name in ('indexes', 'files', 'lines', 'columns'):
+        setattr(locations, name, column(nlocs))
+        pos += 4 * nlocs
+    filenames = column(nfiles)
+    pos += 4 * nfiles
+    lengths = column(nstrings)
+    pos += 4 * nstrings
+    ints = column(nints).tolist() # list slices are cheaper than array slices
+    pos += 4 * nints
+    tags = array('b')
+    tags.frombytes(view[pos:pos + nnodes])
+    pos += nnodes
+    blob = bytes(view[pos:pos + nblob]).decode('utf-8', 'surrogatepass')
+    strings = []
+    start = 0
+    for n in lengths:
+        strings.append(blob[start:start + n])
+        start += n
+    locations.filenames = [strings[i] for i in filenames]
+
+    # types are created first, so the type fields can point anywhere
+    types = [Type.__new__(Type) for _ in range(ntypes)]
+    i = 0
+    for ty in types:
+        (kind, ty.size, ty.align, usig, isstatic, sclass, varname, ptr,
+         ty.array_len, ret_type, hasva, nparams) = ints[i:i + 12]
+        i += 12
+        ty.kind = TYPE_KINDS[kind]
+        ty.usig = bool(usig)
+        ty.isstatic = bool(isstatic)
+        ty.scalss = SCLASSES[sclass]
+        ty.varname = None if varname == -1 else strings[varname]
+        ty.ptr = None if ptr == -1 else types[ptr]
+        ty.ret_type = None if ret_type == -1 else types[ret_type]
+        ty.hasva = bool(hasva)
+        if nparams == -1:
+            ty.params = None
+        else:
+            ty.params = [types[p] for p in ints[i:i + nparams]]
+            i += nparams
+
+    # node objects are allocated first, then filled from their records
+    nodes = [NODE_CLASSES[tag].__new__(NODE_CLASSES[tag]) for tag in tags]
+    for node, tag in zip(nodes, tags):
+        kind, ty, loc = ints[i:i + 3]
+        i += 3
+        node.kind = NODE_KINDS[kind]
+        node.ty = None if ty == -1 else types[ty]
+        node.sourceloc = None if loc == -1 else loc
+        for attr, codec in NODE_FIELDS[tag][1]:
+            v = ints[i]
+            i += 1
+            if codec == 'node':
+                setattr(node, attr, None if v == -1 else nodes[v])
+            elif codec == 'nodes':
+                if v == -1:
+                    setattr(node, attr, None)
+                else:
+                    setattr(node, attr, [nodes[n] for n in ints[i:i + v]])
+                    i += v
+            elif codec == 'type':
+                setattr(node, attr, None if v == -1 else types[v])
+            elif codec == 'str':
+                setattr(node, attr, None if v == -1 else strings[v])
+            else:
+                setattr(node, attr, None if v == -1 else _const(strings[v]))
+    return [nodes[r] for r in roots], locations
+
+def ast_key(source, *salts):
+    '''
+    cache key of the AST of a source
+    '''
+    return content_key(source, 'ast', AST_FORMAT, *salts)
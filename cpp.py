@@ -0,0 +1,1198 @@
+'''
+Copyright 2018 JackLiang.
+
+C preprocessor
+'''
+import os
+import re
+import time
+from array import array
+from lex import RegexLexer, TokenBuffer, Token, TokenKind, TOKEN_KINDS, KEYWORDS
+from astc import NodeKind
+from eval import Eval
+from utils.singleton import Singleton
+from utils.diskcache import content_key
+
+MAX_INCLUDE_DEPTH = 200
+
+KEYWORD_NAMES = dict((v, k) for k, v in KEYWORDS.items())
+
+CONDITIONALS = ('if', 'ifdef', 'ifndef')
+
+# header name of an #include, before any macro expansion
+HEADER_NAME_RE = re.compile(r'[ \t]*(?:<([^>\n]*)>|"([^"\n]*)")')
+
+# a directive line, unless a block comment hides it or a backslash
+# at the end of the line before splices it to that line
+HASH_LINE_RE = re.compile(br'^[ \t]*\#', re.M)
+
+# what may hide a '/*' in a line
+COMMENT_START_RE = re.compile(br'/\*|//|"(?:\\.|[^"\\\n])*"|' br"'(?:\\.|[^'\\\n])*'")
+
+# the name of a directive and its first word
+DIRECTIVE_WORDS_RE = re.compile(br'[ \t]*([A-Za-z_]\w*)?[ \t]*([A-Za-z_]\w*)?[ \t]*')
+
+EMPTY = frozenset()
+
+# an empty macro argument next to '##' in a substitution
+PLACEMARKER = ()
+
+class PPToken(Token):
+    '''
+    token with the preprocessor flags, space: whitespace before it in the source,
+    hideset: the macros whose expansion made it, they are not expanded from it again
+    '''
+    __slots__ = ('space', 'hideset')
+
+    def __init__(self, kind, filename, line, column, value, space=False, hideset=EMPTY):
+        Token.__init__(self, kind, filename, line, column, value)
+        self.space = space
+        self.hideset = hideset
+
+def spelling(t):
+    '''
+    source text of a token
+    '''
+    kind = t.kind
+    if kind == TokenKind.TKEYWORD:
+        return KEYWORD_NAMES[t.value]
+    if kind == TokenKind.TSTRING:
+        return '"' + t.value + '"'
+    if kind == TokenKind.TCHAR:
+        return '\'' + t.value + '\''
+    if kind == TokenKind.TEOF:
+        return ''
+    return t.value
+
+def _is(t, kind, value):
+    return t.kind == kind and t.value == value
+
+class Macro(object):
+    '''
+    params is None for an object-like macro,
+    the variadic parameter is the last one, named __VA_ARGS__.
+    balanced: every '(' of the body is closed in the body.
+    pasted: the body of an object-like macro with '##' applied, made
+    at its first expansion
+    '''
+    __slots__ = ('name', 'params', 'variadic', 'body', 'balanced', 'pasted')
+
+    def __init__(self, name, params, variadic, body):
+        self.name = name
+        self.params = params
+        self.variadic = variadic
+        self.body = body
+        depth = 0
+        for t in body:
+            if t.kind == TokenKind.TDELIMIT:
+                if t.value == '(':
+                    depth += 1
+                elif t.value == ')':
+                    depth -= 1
+                    if depth < 0:
+                        break
+        self.balanced = depth == 0
+        self.pasted = None
+
+class MacroStats(object):
+    '''
+    expansion counts and times to find the macro heavy code.
+    time is spent reading arguments and substituting, an expansion
+    inside another one counts in the outer one
+    '''
+
+    def __init__(self):
+        self.expansions = {} # macro name -> expansions
+        self.times = {} # macro name -> seconds
+        self.sites = {} # (filename, line) -> expansions started from the source
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    @property
+    def count(self):
+        return sum(self.expansions.values())
+
+    @property
+    def time(self):
+        return sum(self.times.values())
+
+    def report(self, n=10):
+        '''
+        lines of the n most expensive macros and the n busiest source lines
+        '''
+        lines = ['{} expansions in {:.3f}s, memo {} hits {} misses'.format(
+            self.count, self.time, self.memo_hits, self.memo_misses)]
+        times = self.times
+        for name in sorted(self.expansions, key=lambda k: (-times.get(k, 0.0), -self.expansions[k]))[:n]:
+            lines.append('  {:<24} {:>8} {:.3f}s'.format(name, self.expansions[name], times.get(name, 0.0)))
+        for site in sorted(self.sites, key=lambda k: -self.sites[k])[:n]:
+            lines.append('  {}:{:<17} {:>8}'.format(site[0], site[1], self.sites[site]))
+        return lines
+
+class SourceFile(object):
+    '''
+    a file split at its directive lines, shared by every include of it.
+    the file is a list of items, text and directive lines in turn: item
+    2k is the text before directive k, item 2k + 1 the directive line.
+    the directive lines are found by a scan of the raw text, an item is
+    lexed when it is first read, so the inactive #if regions never are.
+    the tokens of every lexed item are kept in one buffer, in the order
+    they were lexed
+    '''
+
+    def __init__(self, path, text, stamp=None):
+        self.path = path
+        self.text = text
+        self.stamp = stamp # (mtime, size) when it was read
+        self.digest = content_key(text)
+        self.tokens = TokenBuffer(path)
+        self.starts = array('i') # offset of every item
+        self.stops = array('i') # offset after every item, a directive ends before its newline
+        self.lines = array('i') # line of every item
+        self.ranges = [] # (first, stop) tokens of every lexed item, None before
+        self.directive_names = []
+        self.once = False # has #pragma once
+        self.guard = None # macro of the include guard
+        self._scan_directives()
+        self._find_guard()
+
+    def _spliced(self, begin):
+        '''
+        the line starting at begin is joined to the line before by a
+        backslash at its end
+        '''
+        text = self.text
+        back = begin - 2 # before the newline
+        if back >= 0 and text[back:back + 1] == b'\r':
+            back -= 1
+        return back >= 0 and text[back:back + 1] == b'\\'
+
+    def _line_end(self, offset):
+        '''
+        offset of the newline ending the logical line of offset
+        '''
+        text = self.text
+        while True:
+            nl = text.find(b'\n', offset)
+            if nl == -1:
+                return len(text)
+            back = nl - 1
+            if back >= 0 and text[back:nl] == b'\r':
+                back -= 1
+            if back < 0 or text[back:back + 1] != b'\\':
+                return nl
+            offset = nl + 1
+
+    def _opens_comment(self, offset, c, nl):
+        '''
+        the '/*' at c opens a block comment, its line is read from offset to nl
+        '''
+        search = COMMENT_START_RE.search
+        m = search(self.text, offset, nl)
+        while not m is None and m.start() < c:
+            if m.end() > c or m.group(0) == b'//':
+                return False # in a literal or a line comment
+            m = search(self.text, m.end(), nl)
+        return True
+
+    def _directive_end(self, offset):
+        '''
+        offset of the newline ending the directive line at offset,
+        a block comment may carry it over more lines
+        '''
+        text = self.text
+        while True:
+            nl = self._line_end(offset)
+            c = text.find(b'/*', offset, nl)
+            while c != -1 and not self._opens_comment(offset, c, nl):
+                c = text.find(b'/*', c + 2, nl)
+            if c == -1:
+                return nl
+            close = text.find(b'*/', c + 2)
+            if close == -1:
+                return len(text)
+            offset = close + 2
+
+    def _scan_directives(self):
+        '''
+        find the directive lines at raw text speed: a search for the lines
+        beginning with '#', then only the '/*' before each one are looked
+        at in case it is in a block comment
+        '''
+        text = self.text
+        size = len(text)
+        starts, stops, lines = self.starts, self.stops, self.lines
+        pos = 0 # start of the text item
+        scan = 0 # where the next directive is searched from
+        line = 1
+        words = [] # offset after the '#' of every directive
+        while True:
+            m = HASH_LINE_RE.search(text, scan)
+            begin = size if m is None else m.start()
+            after = scan
+            c = text.find(b'/*', scan, begin)
+            while c != -1:
+                if self._opens_comment(max(after, text.rfind(b'\n', 0, c) + 1), c, self._line_end(c)):
+                    after = text.find(b'*/', c + 2)
+                    after = size if after == -1 else after + 2
+                    if after > begin:
+                        break # the '#' is in the comment
+                    c = text.find(b'/*', after, begin)
+                else:
+                    c = text.find(b'/*', c + 2, begin)
+            if c != -1:
+                scan = after
+                continue
+            if m is None:
+                break
+            if self._spliced(begin):
+                scan = m.end() # the line goes on from the one before
+                continue
+            end = self._directive_end(m.end())
+            starts.append(pos)
+            stops.append(begin)
+            lines.append(line)
+            line += text.count(b'\n', pos, begin)
+            starts.append(begin)
+            stops.append(end)
+            lines.append(line)
+            words.append(m.end())
+            pos = scan = min(end + 1, size)
+            line += text.count(b'\n', begin, pos)
+        starts.append(pos)
+        stops.append(size)
+        lines.append(line)
+        self.ranges = [None] * len(starts)
+        self.directive_names = [self._directive_name(2 * k + 1, offset) for k, offset in enumerate(words)]
+
+    def _directive_name(self, n, offset):
+        m = DIRECTIVE_WORDS_RE.match(self.text, offset)
+        name, arg = m.group(1), m.group(2)
+        if self.text[m.end():m.end() + 1] in (b'/', b'\\') or not name and m.end() < self.stops[n]:
+            # a comment, a line continuation or no identifier, ask the lexer
+            first, stop = self.lex(n)
+            name = spelling(self.tokens[first + 1]) if stop > first + 1 else ''
+            arg = self.tokens.value(first + 2) if stop > first + 2 else None
+        else:
+            name = '' if name is None else name.decode('utf-8')
+            arg = None if arg is None else arg.decode('utf-8')
+        if name == 'pragma' and arg == 'once':
+            self.once = True
+        return name
+
+    def lex(self, n):
+        '''
+        (first, stop) tokens of item n, it is lexed the first time
+        '''
+        r = self.ranges[n]
+        if not r is None:
+            return r
+        tokens = self.tokens
+        first = len(tokens)
+        start = self.starts[n]
+        lexer = RegexLexer(self.path, self.text, directives=True)
+        scan = lexer._scan(start, self.lines[n], start - 1)
+        if n == len(self.starts) - 1:
+            tokens.extend(scan) # the last item ends with TEOF
+        else:
+            stop = self.stops[n]
+            append = tokens.append
+            for kind, line, column, value, offset in scan:
+                if offset >= stop:
+                    break
+                append(kind, line, column, value, offset)
+            scan.close()
+        r = self.ranges[n] = (first, len(tokens))
+        return r
+
+    def _find_guard(self):
+        '''
+        the file is "#ifndef X #define X ... #endif" with nothing outside
+        '''
+        names = self.directive_names
+        if len(names) < 3 or names[0] != 'ifndef' or names[1] != 'define':
+            return
+        first, stop = self.lex(0)
+        if stop != first:
+            return
+        first, stop = self.lex(1)
+        if stop != first + 3:
+            return
+        guard = self.tokens.value(first + 2)
+        first, stop = self.lex(2)
+        if stop != first:
+            return
+        first, stop = self.lex(3)
+        if stop < first + 3 or self.tokens.value(first + 2) != guard:
+            return
+        depth = 0
+        for k, name in enumerate(names):
+            if name in CONDITIONALS:
+                depth += 1
+            elif name == 'endif':
+                depth -= 1
+                if depth == 0:
+                    n = 2 * k + 2
+                    if n == len(self.starts) - 1:
+                        first, stop = self.lex(n)
+                        if stop == first + 1:
+                            self.guard = guard
+                    return
+
+    def token(self, i, space=None):
+        tokens = self.tokens
+        if space is None:
+            off = tokens.offsets[i]
+            space = off > 0 and (self.text[off - 1:off] in (b' ', b'\t', b'\n', b'\r') or self.text[off - 2:off] == b'*/')
+        return PPToken(TOKEN_KINDS[tokens.kinds[i]], self.path, tokens.lines[i], tokens.columns[i],
+                       tokens.value(i), space)
+
+class FileCache(Singleton):
+    '''
+    source files lexed by this process, by path.
+    a file is read again when its mtime or size changes
+    '''
+
+    def __init__(self):
+        if not hasattr(self, '_files'):
+            self._files = {}
+            self.hits = 0
+            self.misses = 0
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, path):
+        stamp = self._stamp(path)
+        f = self._files.get(path, None)
+        if not f is None and f.stamp == stamp:
+            self.hits += 1
+            return f
+        self.misses += 1
+        with open(path, 'rb') as fp:
+            text = fp.read()
+        f = self._files[path] = SourceFile(path, text, stamp)
+        return f
+
+    def digest(self, path):
+        '''
+        content hash of a file, without lexing it
+        '''
+        f = self._files.get(path, None)
+        if not f is None and f.stamp == self._stamp(path):
+            return f.digest
+        with open(path, 'rb') as fp:
+            return content_key(fp.read())
+
+    def clear(self):
+        self._files.clear()
+
+class _Cursor(object):
+    '''
+    tokens[pos:end] still to read. the tokens of an expansion get the
+    location of site and the hideset when they are read, so bodies and
+    arguments are spliced without copying them.
+    lead is the space flag of the first token, None to keep its own
+    '''
+    __slots__ = ('tokens', 'pos', 'end', 'hideset', 'site', 'lead')
+
+    def __init__(self, tokens, pos, end, hideset=EMPTY, site=None, lead=None):
+        self.tokens = tokens
+        self.pos = pos
+        self.end = end
+        self.hideset = hideset
+        self.site = site
+        self.lead = lead
+
+class _Frame(object):
+    '''
+    a file being read: tokens [pos, stop) of its item are still to read
+    '''
+    __slots__ = ('file', 'item', 'pos', 'stop', 'conds')
+
+    def __init__(self, file):
+        self.file = file
+        self.item = -1
+        self.pos = 0
+        self.stop = 0
+        self.conds = [] # [taken, seen_else] of every open #if of this file
+
+    def skip_to(self, n):
+        '''
+        go on after item n without lexing it
+        '''
+        self.item = n
+        self.pos = self.stop = 0
+
+class Preprocessor(object):
+    '''
+    runs the directives and expands the macros of a file,
+    preprocess yields the tokens for Parser
+    '''
+
+    def __init__(self, include_paths=(), files=None):
+        self.include_paths = list(include_paths)
+        self.files = FileCache() if files is None else files
+        self.macros = {}
+        self.dependencies = [] # headers read, in include order
+        self.warnings = []
+        self.stats = MacroStats()
+        self._stack = [] # _Frame of the files being read
+        self._pending = [] # _Cursor of the tokens to read before the file, last first
+        self._versions = {} # macro name -> times it was defined or undefined
+        self._unbalanced = set() # macros with a '(' closed after their body
+        self._memo = {} # object-like macro name -> (expansion, {name: version} it depends on)
+        self._recording = [] # dependencies of the memo entries being made
+        self._hidesets = {} # (hideset, hideset) -> union
+        self._timing = False
+        self._once = set()
+        self._guards = {} # path -> include guard macro of the headers seen
+        self._resolved = {}
+
+    def error(self, e, t=None):
+        if t is None and self._stack:
+            frame = self._stack[-1]
+            f = frame.file
+            if frame.pos < frame.stop:
+                line = f.tokens.lines[frame.pos]
+            else:
+                line = f.lines[max(frame.item, 0)] # a directive line
+            t = Token(None, f.path, line, 0, None)
+        if t is None:
+            raise Exception(e)
+        raise Exception('file {0} line:{1} {2}'.format(t.filename, t.line, e))
+
+    def define(self, name, value='1'):
+        '''
+        define an object-like macro, like -Dname=value
+        '''
+        lexer = RegexLexer('<command line>', value)
+        lexer.lex()
+        body = [PPToken(t.kind, t.filename, t.line, t.column, t.value, n > 0) for n, t in enumerate(lexer.tokens)]
+        self._set_macro(Macro(name, None, False, body[:-1]))
+
+    def undef(self, name):
+        if name in self.macros:
+            del self.macros[name]
+            self._unbalanced.discard(name)
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _set_macro(self, m):
+        self.macros[m.name] = m
+        if m.balanced:
+            self._unbalanced.discard(m.name)
+        else:
+            self._unbalanced.add(m.name)
+        self._versions[m.name] = self._versions.get(m.name, 0) + 1
+
+    def load_state(self, macros, once, guards):
+        '''
+        start from the macros and include state of a precompiled header
+        '''
+        for m in macros.values():
+            self._set_macro(m)
+        self._once.update(once)
+        self._guards.update(guards)
+
+    def preprocess(self, path):
+        '''
+        yield the tokens of a file after preprocessing, the last one is TEOF
+        '''
+        self._push(path)
+        TEOF = TokenKind.TEOF
+        while True:
+            t = self._expand_next()
+            yield t
+            if t.kind == TEOF:
+                return
+
+    def _push(self, path):
+        if len(self._stack) >= MAX_INCLUDE_DEPTH:
+            self.error('#include nested too deeply')
+        f = self.files.get(path)
+        if f.once:
+            self._once.add(path)
+        if not f.guard is None:
+            self._guards[path] = f.guard
+        self._stack.append(_Frame(f))
+
+    def _read(self):
+        '''
+        next token before macro expansion, directives are run on the way
+        '''
+        pending = self._pending
+        while True:
+            if pending:
+                c = pending[-1]
+                if c.pos >= c.end:
+                    pending.pop()
+                    continue
+                t = c.tokens[c.pos]
+                c.pos += 1
+                site = c.site
+                if site is None:
+                    return t
+                hideset = c.hideset
+                if t.hideset:
+                    hideset = self._union(t.hideset, hideset)
+                space = t.space
+                if not c.lead is None:
+                    space = c.lead
+                    c.lead = None
+                return PPToken(t.kind, site.filename, site.line, site.column, t.value, space, hideset)
+            frame = self._stack[-1]
+            f = frame.file
+            i = frame.pos
+            if i == frame.stop:
+                n = frame.item + 1
+                first, stop = f.lex(n)
+                frame.item = n
+                if n & 1:
+                    frame.pos = frame.stop = stop
+                    self._directive(frame, first + 1, stop)
+                else:
+                    frame.pos, frame.stop = first, stop
+                continue
+            if f.tokens.kinds[i] == TokenKind.TEOF.value:
+                if frame.conds:
+                    self.error('unterminated conditional directive')
+                if len(self._stack) > 1:
+                    self._stack.pop()
+                    continue
+                return f.token(i, True)
+            frame.pos = i + 1
+            return f.token(i)
+
+    def _unread(self, t):
+        self._pending.append(_Cursor((t,), 0, 1))
+
+    def _union(self, a, b):
+        if not a:
+            return b
+        if not b:
+            return a
+        key = (a, b)
+        u = self._hidesets.get(key, None)
+        if u is None:
+            u = self._hidesets[key] = a | b
+        return u
+
+    def _expand_next(self):
+        '''
+        next token with the macros expanded
+        '''
+        TIDENT = TokenKind.TIDENT
+        macros = self.macros
+        while True:
+            t = self._read()
+            if t.kind != TIDENT:
+                return t
+            name = t.value
+            if self._recording:
+                self._recording[-1][name] = self._versions.get(name, 0)
+            m = macros.get(name, None)
+            if m is None:
+                if name == '__LINE__' or name == '__FILE__':
+                    if self._recording:
+                        self._recording[-1][None] = -1 # depends on the site, never memoized
+                    if name == '__LINE__':
+                        return PPToken(TokenKind.TNUMBER, t.filename, t.line, t.column, str(t.line), t.space)
+                    return PPToken(TokenKind.TSTRING, t.filename, t.line, t.column, t.filename, t.space)
+                return t
+            if name in t.hideset:
+                return t
+            if m.params is None:
+                self._expand(m, t, None)
+                continue
+            n = self._read()
+            if not _is(n, TokenKind.TDELIMIT, '('):
+                self._unread(n) # a function-like macro name alone is not expanded
+                return t
+            self._expand(m, t, n)
+
+    def _expand(self, m, t, lparen):
+        '''
+        push the expansion of macro m named by token t, lparen is the
+        '(' after the name of a function-like macro
+        '''
+        stats = self.stats
+        name = m.name
+        stats.expansions[name] = stats.expansions.get(name, 0) + 1
+        timing = not self._timing
+        if timing:
+            self._timing = True
+            start = time.perf_counter()
+            if not t.hideset:
+                site = (t.filename, t.line)
+                stats.sites[site] = stats.sites.get(site, 0) + 1
+        try:
+            if lparen is None:
+                self._expand_object(m, t)
+            else:
+                args, rparen = self._read_args(m, t)
+                hideset = t.hideset & rparen.hideset if t.hideset and rparen.hideset else EMPTY
+                hideset = self._union(hideset, frozenset((name,)))
+                segments = self._substitute(m, args, t)
+                pending = self._pending
+                for tokens, pos, end, lead in reversed(segments):
+                    pending.append(_Cursor(tokens, pos, end, hideset, t, lead))
+                if segments:
+                    pending[-1].lead = t.space
+        finally:
+            if timing:
+                self._timing = False
+                stats.times[name] = stats.times.get(name, 0.0) + time.perf_counter() - start
+
+    def _expand_object(self, m, t):
+        '''
+        an object-like macro met in the source is expanded at once and the
+        result kept while no macro it used is redefined. without any
+        unbalanced macro the result can not read past the body, so it
+        does not depend on what follows
+        '''
+        name = m.name
+        hideset = self._union(t.hideset, frozenset((name,)))
+        body = self._pasted(m, t)
+        if t.hideset or self._unbalanced:
+            self._pending.append(_Cursor(body, 0, len(body), hideset, t, t.space))
+            return
+        entry = self._memo.get(name, None)
+        if not entry is None:
+            versions = self._versions
+            for dep, version in entry[1].items():
+                if versions.get(dep, 0) != version:
+                    entry = None
+                    break
+        if not entry is None:
+            self.stats.memo_hits += 1
+            tokens, deps = entry
+            if self._recording:
+                self._recording[-1].update(deps)
+            self._pending.append(_Cursor(tokens, 0, len(tokens), EMPTY, t, t.space))
+            return
+        self.stats.memo_misses += 1
+        self._recording.append({name: self._versions.get(name, 0)})
+        try:
+            tokens = self._expand_list(body, hideset, t, t.space)
+        finally:
+            deps = self._recording.pop()
+        if self._recording:
+            self._recording[-1].update(deps)
+        if not None in deps:
+            self._memo[name] = (tokens, deps)
+        self._pending.append(_Cursor(tokens, 0, len(tokens)))
+
+    def _pasted(self, m, site):
+        '''
+        body of an object-like macro with '##' applied, the tokens pasted
+        are not operators when the result is rescanned
+        '''
+        if not m.pasted is None:
+            return m.pasted
+        body = m.body
+        out = []
+        i = 0
+        while i < len(body):
+            t = body[i]
+            if _is(t, TokenKind.TOPERATE, '##'):
+                out[-1] = self._paste(out[-1], body[i + 1], site)
+                i += 2
+                continue
+            out.append(t)
+            i += 1
+        m.pasted = out
+        return out
+
+    def _expand_list(self, tokens, hideset=EMPTY, site=None, lead=None):
+        '''
+        fully expand a token list on its own, as an argument or an #if expression
+        '''
+        stop = PPToken(TokenKind.TEOF, None, 0, 0, None)
+        pending = self._pending
+        pending.append(_Cursor((stop,), 0, 1))
+        pending.append(_Cursor(tokens, 0, len(tokens), hideset, site, lead))
+        out = []
+        while True:
+            t = self._expand_next()
+            if t is stop:
+                return out
+            out.append(t)
+
+    def _read_args(self, m, site):
+        '''
+        the arguments of a function-like macro and the ')' closing them
+        '''
+        TDELIMIT = TokenKind.TDELIMIT
+        args = [[]]
+        depth = 0
+        while True:
+            t = self._read()
+            if t.kind == TokenKind.TEOF:
+                self.error('unterminated argument list invoking macro \'{}\''.format(m.name), site)
+            if t.kind == TDELIMIT:
+                if t.value == '(':
+                    depth += 1
+                elif t.value == ')':
+                    if depth == 0:
+                        break
+                    depth -= 1
+                elif t.value == ',' and depth == 0 and not (m.variadic and len(args) == len(m.params)):
+                    args.append([])
+                    continue
+            args[-1].append(t)
+        if len(m.params) == 0 and args == [[]]:
+            args = []
+        if m.variadic and len(args) == len(m.params) - 1:
+            args.append([])
+        if len(args) != len(m.params):
+            self.error('macro \'{}\' requires {} arguments, but {} given'.format(m.name, len(m.params), len(args)), site)
+        return args, t
+
+    def _substitute(self, m, args, site):
+        '''
+        body of a function-like macro with its arguments, '#' and '##' applied,
+        as (tokens, start, end, lead) slices of the body and the arguments
+        '''
+        params = dict((p, n) for n, p in enumerate(m.params))
+        TIDENT, TOPERATE = TokenKind.TIDENT, TokenKind.TOPERATE
+
+        def param(t):
+            return params.get(t.value, None) if t.kind == TIDENT else None
+
+        body = m.body
+        out = []
+
+        def append(tokens, start, end, lead=None):
+            if start < end:
+                out.append((tokens, start, end, lead))
+
+        def pop_last():
+            '''
+            the left operand of '##', None for a placemarker
+            '''
+            while out:
+                tokens, start, end, lead = out.pop()
+                if tokens is PLACEMARKER:
+                    return None
+                if start < end:
+                    append(tokens, start, end - 1, lead)
+                    return tokens[end - 1]
+            return None
+
+        i = 0
+        run = 0 # first body token not yet in out
+        while i < len(body):
+            t = body[i]
+            if _is(t, TOPERATE, '#'):
+                p = param(body[i + 1]) if i + 1 < len(body) else None
+                if p is None:
+                    self.error('\'#\' is not followed by a macro parameter', site)
+                append(body, run, i)
+                append((self._stringize(args[p], t),), 0, 1)
+                i += 2
+                run = i
+                continue
+            if _is(t, TOPERATE, '##'):
+                append(body, run, i)
+                left = pop_last()
+                rhs = body[i + 1]
+                p = param(rhs)
+                tail = (rhs,) if p is None else args[p]
+                if left is None:
+                    # a placemarker on the left, the right operand as it is
+                    if tail:
+                        append(tail, 0, len(tail))
+                    else:
+                        out.append((PLACEMARKER, 0, 0, None))
+                elif tail:
+                    append((self._paste(left, tail[0], site),), 0, 1)
+                    append(tail, 1, len(tail))
+                else:
+                    append((left,), 0, 1)
+                i += 2
+                run = i
+                continue
+            p = param(t)
+            if p is None:
+                i += 1
+                continue
+            append(body, run, i)
+            arg = args[p]
+            if i + 1 < len(body) and _is(body[i + 1], TOPERATE, '##'):
+                if arg:
+                    append(arg, 0, len(arg), t.space)
+                    i += 1
+                else:
+                    # an empty left operand, the right one is taken as it is
+                    i += 2
+                    if i < len(body):
+                        q = param(body[i])
+                        if q is None:
+                            append(body, i, i + 1)
+                        elif args[q]:
+                            append(args[q], 0, len(args[q]))
+                        else:
+                            out.append((PLACEMARKER, 0, 0, None))
+                        i += 1
+                run = i
+                continue
+            expanded = self._expand_list(arg)
+            append(expanded, 0, len(expanded), t.space)
+            i += 1
+            run = i
+        append(body, run, len(body))
+        return [seg for seg in out if not seg[0] is PLACEMARKER]
+
+    def _stringize(self, arg, site):
+        parts = []
+        for n, t in enumerate(arg):
+            if n > 0 and t.space:
+                parts.append(' ')
+            s = spelling(t)
+            if t.kind == TokenKind.TSTRING or t.kind == TokenKind.TCHAR:
+                s = s.replace('\\', '\\\\').replace('"', '\\"')
+            parts.append(s)
+        return PPToken(TokenKind.TSTRING, site.filename, site.line, site.column, ''.join(parts), site.space)
+
+    def _paste(self, left, right, site):
+        text = spelling(left) + spelling(right)
+        try:
+            lexer = RegexLexer(site.filename, text, directives=True)
+            lexer.lex()
+        except Exception:
+            lexer = None
+        if lexer is None or len(lexer.tokens) != 2:
+            self.error('pasting "{}" and "{}" does not give a valid preprocessing token'.format(
+                spelling(left), spelling(right)), site)
+        return PPToken(lexer.tokens.kind(0), left.filename, left.line, left.column, lexer.tokens.value(0), left.space)
+
+    def _directive(self, frame, i, end):
+        '''
+        run the directive whose tokens are [i, end) of the current file
+        '''
+        f = frame.file
+        if i == end:
+            return # null directive
+        name = spelling(f.tokens[i])
+        if name == 'define':
+            self._define(f, i + 1, end)
+        elif name == 'undef':
+            if i + 1 == end:
+                self.error('no macro name given in #undef directive')
+            self.undef(f.tokens.value(i + 1))
+        elif name == 'include':
+            self._include(frame, i + 1, end)
+        elif name == 'if':
+            taken = self._eval_if(f, i + 1, end)
+            frame.conds.append([taken, False])
+            if not taken:
+                self._skip_branch(frame)
+        elif name == 'ifdef' or name == 'ifndef':
+            if i + 1 == end:
+                self.error('no macro name given in #{} directive'.format(name))
+            taken = (f.tokens.value(i + 1) in self.macros) == (name == 'ifdef')
+            frame.conds.append([taken, False])
+            if not taken:
+                self._skip_branch(frame)
+        elif name == 'elif' or name == 'else':
+            if not frame.conds:
+                self.error('#{} without #if'.format(name))
+            cond = frame.conds[-1]
+            if cond[1]:
+                self.error('#{} after #else'.format(name))
+            cond[1] = name == 'else'
+            self._skip_branch(frame) # the branch before was taken
+        elif name == 'endif':
+            if not frame.conds:
+                self.error('#endif without #if')
+            frame.conds.pop()
+        elif name == 'error':
+            self.error('#error ' + self._text(f, i + 1, end))
+        elif name == 'warning':
+            self.warnings.append('file {0} line:{1} #warning {2}'.format(
+                f.path, f.tokens.lines[i], self._text(f, i + 1, end)))
+        elif name == 'pragma':
+            pass # #pragma once is found when the file is lexed, others are ignored
+        else:
+            self.error('invalid preprocessing directive #' + name)
+
+    def _text(self, f, i, end):
+        return ' '.join(spelling(f.tokens[j]) for j in range(i, end))
+
+    def _skip_branch(self, frame):
+        '''
+        skip to the #elif, #else or #endif closing the inactive branch of
+        the innermost conditional. only the directive names found by the
+        raw text scan are looked at, the text between is never lexed
+        '''
+        f = frame.file
+        names = f.directive_names
+        depth = 0
+        k = frame.item // 2 + 1 # the directive after the current one
+        while k < len(names):
+            name = names[k]
+            k += 1
+            if name in CONDITIONALS:
+                depth += 1
+            elif name == 'endif':
+                if depth == 0:
+                    frame.skip_to(2 * k - 1)
+                    frame.conds.pop()
+                    return
+                depth -= 1
+            elif depth == 0 and (name == 'else' or name == 'elif'):
+                cond = frame.conds[-1]
+                frame.skip_to(2 * k - 1)
+                if cond[1]:
+                    self.error('#{} after #else'.format(name))
+                if name == 'else':
+                    cond[1] = True
+                    if not cond[0]:
+                        cond[0] = True
+                        return
+                elif not cond[0]:
+                    first, stop = f.lex(2 * k - 1)
+                    if self._eval_if(f, first + 2, stop):
+                        cond[0] = True
+                        return
+        frame.skip_to(len(f.starts) - 2)
+        self.error('unterminated conditional directive')
+
+    def _define(self, f, i, end):
+        if i == end:
+            self.error('no macro name given in #define directive')
+        tokens = f.tokens
+        name_token = f.token(i)
+        if name_token.kind != TokenKind.TIDENT:
+            self.error('macro names must be identifiers')
+        name = name_token.value
+        i += 1
+        params = None
+        variadic = False
+        if i < end and tokens.value(i) == '(' and not f.token(i).space:
+            params = []
+            i += 1
+            while True:
+                if i >= end:
+                    self.error('missing \')\' in macro parameter list')
+                t = f.token(i)
+                i += 1
+                if _is(t, TokenKind.TDELIMIT, ')') and not params:
+                    break
+                if _is(t, TokenKind.TOPERATE, '...'):
+                    variadic = True
+                    params.append('__VA_ARGS__')
+                elif t.kind == TokenKind.TIDENT:
+                    params.append(t.value)
+                else:
+                    self.error('invalid token in macro parameter list')
+                if i >= end:
+                    self.error('missing \')\' in macro parameter list')
+                t = f.token(i)
+                i += 1
+                if _is(t, TokenKind.TDELIMIT, ')'):
+                    break
+                if variadic or not _is(t, TokenKind.TDELIMIT, ','):
+                    self.error('expected \',\' or \')\' in macro parameter list')
+        body = [f.token(j) for j in range(i, end)]
+        if body:
+            body[0].space = False
+            if _is(body[0], TokenKind.TOPERATE, '##') or _is(body[-1], TokenKind.TOPERATE, '##'):
+                self.error('\'##\' cannot appear at either end of a macro expansion')
+        self._set_macro(Macro(name, params, variadic, body))
+
+    def _include(self, frame, i, end):
+        f = frame.file
+        tokens = f.tokens
+        if i == end:
+            self.error('#include expects "FILENAME" or <FILENAME>')
+        m = HEADER_NAME_RE.match(f.text[tokens.offsets[i]:f._line_end(tokens.offsets[i])].decode('utf-8', 'replace'))
+        if not m is None:
+            angled = m.group(1) is not None
+            name = m.group(1) if angled else m.group(2)
+        else:
+            # #include MACRO
+            expanded = self._expand_list([f.token(j) for j in range(i, end)])
+            if expanded and expanded[0].kind == TokenKind.TSTRING:
+                name, angled = expanded[0].value, False
+            elif expanded and _is(expanded[0], TokenKind.TOPERATE, '<') and _is(expanded[-1], TokenKind.TOPERATE, '>'):
+                name = ''.join((' ' if t.space and n > 0 else '') + spelling(t) for n, t in enumerate(expanded[1:-1]))
+                angled = True
+            else:
+                self.error('#include expects "FILENAME" or <FILENAME>')
+        path = self._resolve(f.path, name, angled)
+        if path in self._once:
+            return
+        guard = self._guards.get(path, None)
+        if not guard is None and guard in self.macros:
+            return
+        if not path in self.dependencies:
+            self.dependencies.append(path)
+        self._push(path)
+
+    def _resolve(self, includer, name, angled):
+        directory = os.path.dirname(includer)
+        key = (directory, name, angled)
+        path = self._resolved.get(key, None)
+        if not path is None:
+            return path
+        dirs = list(self.include_paths)
+        if not angled:
+            dirs.insert(0, directory)
+        for d in dirs:
+            candidate = os.path.normpath(os.path.join(d, name))
+            if os.path.isfile(candidate):
+                self._resolved[key] = candidate
+                return candidate
+        self.error('\'{}\' file not found'.format(name))
+
+    def _eval_if(self, f, i, end):
+        '''
+        value of the #if expression [i, end) of f
+        '''
+        TIDENT = TokenKind.TIDENT
+        tokens = []
+        j = i
+        while j < end:
+            t = f.token(j)
+            j += 1
+            if t.kind == TIDENT and t.value == 'defined':
+                paren = j < end and f.tokens.value(j) == '('
+                if paren:
+                    j += 1
+                if j >= end or f.tokens.kinds[j] != TIDENT.value:
+                    self.error('macro names must be identifiers')
+                defined = f.tokens.value(j) in self.macros
+                j += 1
+                if paren:
+                    if j >= end or f.tokens.value(j) != ')':
+                        self.error('missing \')\' after "defined"')
+                    j += 1
+                t = PPToken(TokenKind.TNUMBER, t.filename, t.line, t.column, '1' if defined else '0')
+            tokens.append(t)
+        if not tokens:
+            self.error('#if with no expression')
+        tokens = self._expand_list(tokens)
+        return _IfExpr(self, tokens).value() != 0
+
+# binary operators of #if expressions by precedence
+IF_BINARY = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8,
+    '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+
+# operators of #if as AST node kinds, for eval.Eval
+IF_KINDS = {
+    '|': NodeKind.OP_BITOR, '^': NodeKind.OP_BITXOR, '&': NodeKind.OP_BITAND,
+    '==': NodeKind.OP_EQ, '!=': NodeKind.OP_NE, '<': NodeKind.OP_L, '>': NodeKind.OP_G,
+    '<=': NodeKind.OP_LE, '>=': NodeKind.OP_GE, '<<': NodeKind.OP_SAL, '>>': NodeKind.OP_SAR,
+    '+': NodeKind.OP_ADD, '-': NodeKind.OP_SUB, '*': NodeKind.OP_MUL, '/': NodeKind.OP_DIV, '%': NodeKind.OP_MOD,
+}
+
+_EVAL = Eval()
+
+class _IfExpr(object):
+    '''
+    integer constant expression of #if, identifiers left after expansion are 0
+    '''
+
+    def __init__(self, pp, tokens):
+        self._pp = pp
+        self._tokens = tokens
+        self._pos = 0
+
+    def _error(self, e):
+        t = self._tokens[min(self._pos, len(self._tokens) - 1)]
+        self._pp.error(e, t)
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return None
+
+    def _peek_op(self):
+        t = self._peek()
+        if t is None or (t.kind != TokenKind.TOPERATE and t.kind != TokenKind.TDELIMIT):
+            return None
+        return t.value
+
+    def value(self):
+        v = self._cond(True)
+        if self._pos != len(self._tokens):
+            self._error('token "{}" is not valid in preprocessor expressions'.format(spelling(self._tokens[self._pos])))
+        return v
+
+    def _cond(self, live):
+        c = self._binary(1, live)
+        if self._peek_op() != '?':
+            return c
+        self._pos += 1
+        a = self._cond(live and c != 0)
+        if self._peek_op() != ':':
+            self._error('expected \':\' in preprocessor expression')
+        self._pos += 1
+        b = self._cond(live and c == 0)
+        return a if c != 0 else b
+
+    def _binary(self, prec, live):
+        left = self._unary(live)
+        while True:
+            op = self._peek_op()
+            p = IF_BINARY.get(op, 0)
+            if p < prec:
+                return left
+            self._pos += 1
+            if op == '&&':
+                right = self._binary(p + 1, live and left != 0)
+                left = int(left != 0 and right != 0)
+            elif op == '||':
+                right = self._binary(p + 1, live and left == 0)
+                left = int(left != 0 or right != 0)
+            else:
+                right = self._binary(p + 1, live)
+                left = self._apply(op, left, right, live)
+
+    def _apply(self, op, a, b, live):
+        v = _EVAL.arith(IF_KINDS[op], a, b, 64, False) # intmax_t
+        if v is None:
+            if live:
+                if op in ('/', '%'):
+                    self._error('division by zero in preprocessor expression')
+                self._error('shift count out of range in preprocessor expression')
+            return 0
+        return v
+
+    def _unary(self, live):
+        t = self._peek()
+        if t is None:
+            self._error('expected value in preprocessor expression')
+        self._pos += 1
+        if t.kind == TokenKind.TOPERATE:
+            if t.value == '+':
+                return self._unary(live)
+            if t.value == '-':
+                return _EVAL.wrap(-self._unary(live), 64, False)
+            if t.value == '~':
+                return ~self._unary(live)
+            if t.value == '!':
+                return int(self._unary(live) == 0)
+        if _is(t, TokenKind.TDELIMIT, '~'):
+            return ~self._unary(live)
+        if _is(t, TokenKind.TDELIMIT, '('):
+            v = self._cond(live)
+            if self._peek_op() != ')':
+                self._error('missing \')\' in preprocessor expression')
+            self._pos += 1
+            return v
+        if t.kind == TokenKind.TNUMBER:
+            if not t.value.isdigit():
+                self._error('floating constant in preprocessor expression')
+            return int(t.value)
+        if t.kind == TokenKind.TCHAR:
+            return ord(t.value)
+        if t.kind == TokenKind.TIDENT or t.kind == TokenKind.TKEYWORD:
+            return 0
+        self._pos -= 1
+        self._error('token "{}" is not valid in preprocessor expressions'.format(spelling(t)))
@@ -12,6 +12,7 @@ PARAM = 4
 LOCAL = 5
 
 class Coordinate(object):
+    __slots__ = ('filename', 'line', 'column')
 
     def __init__(self, filename, line, column):
         self.filename = filename
@@ -19,6 +20,7 @@ class Coordinate(object):
         self.column = column
 
 class Symbol(object):
+    __slots__ = ('name', 'scope', 'src', 'up', 'uses', 'sclass', 'c_type')
 
     def __init__(self):
         self.name = ''
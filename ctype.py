@@ -33,6 +33,8 @@ class SClass(Enum):
     S_REGISTER = 5
 
 class Type(object):
+    __slots__ = ('kind', 'size', 'align', 'usig', 'isstatic', 'scalss', 'varname',
+                 'ptr', 'array_len', 'ret_type', 'params', 'hasva')
 
     def __init__(self):
         self.kind = TypeKind.VOID
@@ -215,6 +217,15 @@ class TypeMaker(Singleton):
             t.align = 8
         return t
 
+    def make_array_type(self, ty, length):
+        t = Type()
+        t.kind = TypeKind.ARRAY
+        t.size = ty.size * length
+        t.align = ty.align
+        t.ptr = ty
+        t.array_len = length
+        return t
+
     def make_ptr_type(self, ty):
         t = Type()
         t.kind = TypeKind.PTR
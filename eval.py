@@ -3,8 +3,156 @@ Copyright 2018 JackLiang.
 
 eval expression
 '''
+from astc import NodeKind, BinaryNode, UnaryNode, ValueNode
+from ctype import TypeKind
+
+INT_KINDS = (TypeKind.BOOL, TypeKind.CHAR, TypeKind.SHORT, TypeKind.INT,
+             TypeKind.LONG, TypeKind.LLONG, TypeKind.ENUM)
+
+COMPARES = (NodeKind.OP_EQ, NodeKind.OP_NE, NodeKind.OP_L, NodeKind.OP_LE, NodeKind.OP_G, NodeKind.OP_GE)
 
 class Eval(object):
+    '''
+    integer constant expressions with the C semantics: a value wraps to
+    the width and signedness of its type, division truncates toward zero
+    and && and || do not look at the right operand when the left decides.
+    None is the value of what is not a constant, like a division by zero
+    '''
 
     def __init__(self):
-        pass
+        self._binary = {
+            NodeKind.OP_ADD: lambda a, b: a + b,
+            NodeKind.OP_SUB: lambda a, b: a - b,
+            NodeKind.OP_MUL: lambda a, b: a * b,
+            NodeKind.OP_BITAND: lambda a, b: a & b,
+            NodeKind.OP_BITOR: lambda a, b: a | b,
+            NodeKind.OP_BITXOR: lambda a, b: a ^ b,
+            NodeKind.OP_EQ: lambda a, b: int(a == b),
+            NodeKind.OP_NE: lambda a, b: int(a != b),
+            NodeKind.OP_L: lambda a, b: int(a < b),
+            NodeKind.OP_LE: lambda a, b: int(a <= b),
+            NodeKind.OP_G: lambda a, b: int(a > b),
+            NodeKind.OP_GE: lambda a, b: int(a >= b),
+        }
+
+    def is_int(self, ty):
+        return not ty is None and ty.kind in INT_KINDS
+
+    def wrap(self, v, bits, usig):
+        '''
+        v reduced to a bits wide integer, two's complement when signed
+        '''
+        mask = (1 << bits) - 1
+        v &= mask
+        if not usig and v >> (bits - 1):
+            v -= 1 << bits
+        return v
+
+    def wrap_type(self, v, ty):
+        if ty.kind == TypeKind.BOOL:
+            return int(v != 0)
+        return self.wrap(v, ty.size * 8, ty.usig)
+
+    def common(self, lty, rty):
+        '''
+        (bits, unsigned) both operands are converted to, int at least
+        '''
+        bits = max(lty.size, rty.size, 4) * 8
+        usig = (lty.usig and lty.size * 8 == bits) or (rty.usig and rty.size * 8 == bits)
+        return bits, usig
+
+    def arith(self, kind, a, b, bits, usig):
+        '''
+        a kind b on bits wide operands, the result wraps to the same width
+        '''
+        a = self.wrap(a, bits, usig)
+        b = self.wrap(b, bits, usig)
+        if kind == NodeKind.OP_DIV or kind == NodeKind.OP_MOD:
+            if b == 0:
+                return None
+            q = abs(a) // abs(b)
+            if (a < 0) != (b < 0):
+                q = -q
+            v = q if kind == NodeKind.OP_DIV else a - b * q
+        elif kind == NodeKind.OP_SAL or kind == NodeKind.OP_SAR:
+            if b < 0 or b >= bits:
+                return None
+            v = a << b if kind == NodeKind.OP_SAL else a >> b
+        else:
+            op = self._binary.get(kind, None)
+            if op is None:
+                return None
+            v = op(a, b)
+        if kind in COMPARES:
+            return v
+        return self.wrap(v, bits, usig)
+
+    def literal(self, node):
+        '''
+        value of an integer literal node, None for any other node
+        '''
+        if not node is None and type(node) is ValueNode and type(node.val) is int and self.is_int(node.ty):
+            return node.val
+        return None
+
+    def fold_unary(self, kind, ty, operand):
+        '''
+        value of the unary node kind with a literal operand, None when it is not constant
+        '''
+        v = self.literal(operand)
+        if v is None or not self.is_int(ty):
+            return None
+        if kind == NodeKind.AST_CONV or kind == NodeKind.OP_CAST:
+            return self.wrap_type(v, ty)
+        if kind == NodeKind.OP_MINUS:
+            return self.wrap_type(-v, ty)
+        if kind == NodeKind.OP_LOGNOT:
+            return int(v == 0)
+        return None
+
+    def fold_binary(self, kind, ty, left, right):
+        '''
+        value of the binary node kind with literal operands, None when it is not constant
+        '''
+        if not self.is_int(ty):
+            return None
+        lv = self.literal(left)
+        if kind == NodeKind.OP_LOGAND or kind == NodeKind.OP_LOGOR:
+            if lv is None:
+                return None
+            if (lv != 0) == (kind == NodeKind.OP_LOGOR):
+                return int(lv != 0) # the right operand is never evaluated
+            rv = self.literal(right)
+            return None if rv is None else int(rv != 0)
+        rv = self.literal(right)
+        if lv is None or rv is None:
+            return None
+        if kind in COMPARES:
+            bits, usig = self.common(left.ty, right.ty)
+            return self.arith(kind, lv, rv, bits, usig)
+        return self.arith(kind, lv, rv, ty.size * 8, ty.usig)
+
+    def value(self, node):
+        '''
+        value of a whole constant expression tree, None when it is not constant
+        '''
+        if node is None or type(node) is ValueNode:
+            return self.literal(node)
+        if isinstance(node, UnaryNode):
+            v = self.value(node.operand)
+            if v is None:
+                return None
+            return self.fold_unary(node.kind, node.ty, _const(v, node.operand.ty))
+        if isinstance(node, BinaryNode):
+            left = self.value(node.left)
+            if left is None:
+                return None
+            right = self.value(node.right) # None is fine when the left operand decides
+            return self.fold_binary(node.kind, node.ty, _const(left, node.left.ty),
+                                    None if right is None else _const(right, node.right.ty))
+        return None
+
+def _const(v, ty):
+    n = ValueNode(v)
+    n.ty = ty
+    return n
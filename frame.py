@@ -0,0 +1,79 @@
+'''
+Copyright 2018 JackLiang.
+
+stack frame layout
+'''
+from astc import *
+
+def _nested(stmt):
+    '''
+    the blocks directly inside a statement
+    '''
+    todo = [stmt]
+    while todo:
+        s = todo.pop()
+        if isinstance(s, CompoundStmtNode):
+            yield s
+        elif isinstance(s, IfStmtNode):
+            todo.append(s.els)
+            todo.append(s.then)
+
+def _decls(block):
+    return [s.declvar for s in block.stmts if isinstance(s, DeclNode)]
+
+class FrameLayout(object):
+    '''
+    slots of the parameters and locals of a function below %rbp. the
+    variables of a block come after those of the blocks around it, and
+    blocks that are never entered together start at the same offset so
+    their variables share slots. the variables of a block are sorted by
+    alignment, the largest first, which leaves no padding between them.
+    pack False gives every variable its own slot in declaration order
+    '''
+
+    def __init__(self, func, pack=True):
+        self.pack = pack
+        self.offsets = {} # id(VarNode) -> offset from %rbp
+        scopes = self._scopes(func)
+        ends = []
+        top = 0
+        for vars, parent in scopes:
+            if not pack:
+                start = top
+            else:
+                start = 0 if parent is None else ends[parent]
+            end = self._place(vars, start)
+            ends.append(end)
+            top = max(top, end)
+        self.size = (top + 15) // 16 * 16
+
+    def _scopes(self, func):
+        '''
+        (variables, index of the enclosing scope) of the function and
+        its blocks, a scope comes before the scopes inside it
+        '''
+        root = list(func.params)
+        scopes = [(root, None)]
+        work = []
+        if not func.body is None:
+            root.extend(_decls(func.body))
+            work = [(b, 0) for s in func.body.stmts for b in _nested(s)][::-1]
+        while work:
+            block, parent = work.pop()
+            scopes.append((_decls(block), parent))
+            i = len(scopes) - 1
+            work.extend([(b, i) for s in block.stmts for b in _nested(s)][::-1])
+        seen = set(id(v) for vars, parent in scopes for v in vars)
+        # locals the walk does not reach live as long as the function
+        root.extend(v for v in func.localvars if not id(v) in seen)
+        return scopes
+
+    def _place(self, vars, offset):
+        if self.pack:
+            vars = sorted(vars, key=lambda v: -max(v.ty.align, 1))
+        for var in vars:
+            size = max(var.ty.size, 1)
+            align = max(var.ty.align, 1)
+            offset = (offset + size + align - 1) // align * align
+            self.offsets[id(var)] = -offset
+        return offset
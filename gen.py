@@ -3,8 +3,974 @@ Copyright 2018 JackLiang.
 
 gen at&t assemable
 '''
+import struct
+from ctype import TypeKind
+from astc import *
+from eval import Eval
+from ir import Op, Lower, NODE_KINDS, COMPARE_OPS, operand_type
+from opt import PassManager
+from regalloc import LinearScan
+from isel import Selector, MNEMONICS, CONDITIONS, immediates, fused_compares
+from peephole import LABEL, DIRECTIVE
+from sethi import right_first
+from frame import FrameLayout
+
+# integer argument registers of the System V AMD64 calling convention, by size
+ARG_REGS = (
+    ('%rdi', '%edi', '%di', '%dil'),
+    ('%rsi', '%esi', '%si', '%sil'),
+    ('%rdx', '%edx', '%dx', '%dl'),
+    ('%rcx', '%ecx', '%cx', '%cl'),
+    ('%r8', '%r8d', '%r8w', '%r8b'),
+    ('%r9', '%r9d', '%r9w', '%r9b'),
+)
+FLOAT_ARG_REGS = 8 # %xmm0 - %xmm7
+
+# register name index by operand size
+SIZE_INDEX = {8: 0, 4: 1, 2: 2, 1: 3}
+RAX = ('%rax', '%eax', '%ax', '%al')
+RCX = ('%rcx', '%ecx', '%cx', '%cl')
+
+# 32 bit names of the 64 bit registers
+REG32 = {
+    '%rax': '%eax', '%rcx': '%ecx', '%rdx': '%edx', '%rbx': '%ebx',
+    '%rsi': '%esi', '%rdi': '%edi', '%r8': '%r8d', '%r9': '%r9d',
+    '%r10': '%r10d', '%r11': '%r11d', '%r12': '%r12d', '%r13': '%r13d',
+    '%r14': '%r14d', '%r15': '%r15d',
+}
+
+SUFFIX = {8: 'q', 4: 'l', 2: 'w', 1: 'b'}
+
+# the condition code of the opposite test
+NEGATED_CC = {'e': 'ne', 'ne': 'e', 'l': 'ge', 'ge': 'l', 'le': 'g', 'g': 'le',
+              'b': 'ae', 'ae': 'b', 'be': 'a', 'a': 'be'}
+DATA_DIRECTIVE = {8: '.quad', 4: '.long', 2: '.short', 1: '.byte'}
+DATA_SIZE = dict((d, size) for size, d in DATA_DIRECTIVE.items())
+# values on one line of a data directive, and the zero bytes from
+# which on a run of zero values is written as .zero
+DATA_PER_LINE = 16
+ZERO_RUN = 16
+
+FLOAT_KINDS = (TypeKind.FLOAT, TypeKind.DOUBLE, TypeKind.LDOUBLE)
+
+# integer binary operators as (signed, unsigned) instructions
+INT_OPS = {
+    NodeKind.OP_ADD: ('add', 'add'),
+    NodeKind.OP_SUB: ('sub', 'sub'),
+    NodeKind.OP_MUL: ('imul', 'imul'),
+    NodeKind.OP_BITAND: ('and', 'and'),
+    NodeKind.OP_BITOR: ('or', 'or'),
+    NodeKind.OP_BITXOR: ('xor', 'xor'),
+    NodeKind.OP_SAL: ('sal', 'shl'),
+    NodeKind.OP_SAR: ('sar', 'shr'),
+}
+
+# comparisons as (signed, unsigned or floating) condition codes
+COMPARE_CC = {
+    NodeKind.OP_EQ: ('e', 'e'),
+    NodeKind.OP_NE: ('ne', 'ne'),
+    NodeKind.OP_L: ('l', 'b'),
+    NodeKind.OP_LE: ('le', 'be'),
+    NodeKind.OP_G: ('g', 'a'),
+    NodeKind.OP_GE: ('ge', 'ae'),
+}
+
+FLOAT_OPS = {
+    NodeKind.OP_ADD: 'add',
+    NodeKind.OP_SUB: 'sub',
+    NodeKind.OP_MUL: 'mul',
+    NodeKind.OP_DIV: 'div',
+}
+
+def is_float(ty):
+    return not ty is None and ty.kind in FLOAT_KINDS
+
+def float_suffix(ty):
+    return 'ss' if ty.kind == TypeKind.FLOAT else 'sd'
+
+def reg(names, size):
+    return names[SIZE_INDEX.get(size, 1)]
+
+class AsmWriter(object):
+    '''
+    buffered assembly output. lines are collected and written to out in
+    blocks with writelines, instructions are never joined into one string.
+    with a peephole.Peephole the items wait in a window for its rules
+    before they become lines
+    '''
+
+    def __init__(self, out, block=4096, peephole=None):
+        self._out = out
+        self._block = block
+        self._lines = []
+        self.count = 0 # lines written
+        self.peephole = peephole
+        self._window = []
+
+    def _line(self, line):
+        lines = self._lines
+        lines.append(line)
+        if len(lines) >= self._block:
+            self._write()
+
+    def _item(self, item):
+        window = self._window
+        self.peephole.add(window, item)
+        if len(window) > self.peephole.width:
+            n = len(window) - self.peephole.width
+            old = window[:n]
+            del window[:n] # out of the window before it becomes lines
+            for it in old:
+                self._line(_format(it))
+
+    def _write(self):
+        if self._lines:
+            self.count += len(self._lines)
+            self._out.writelines(self._lines)
+            self._lines = []
+
+    def ins(self, op, *operands):
+        if not self.peephole is None:
+            self._item((op, operands))
+        elif operands:
+            self._line('\t{0}\t{1}\n'.format(op, ', '.join(operands)))
+        else:
+            self._line('\t' + op + '\n')
+
+    def label(self, name):
+        if not self.peephole is None:
+            self._item((LABEL, (name,)))
+        else:
+            self._line(name + ':\n')
+
+    def directive(self, text):
+        if not self.peephole is None:
+            self._item((DIRECTIVE, (text,)))
+        else:
+            self._line('\t' + text + '\n')
+
+    def flush(self):
+        '''
+        write the window and the lines collected
+        '''
+        for item in self._window:
+            self._lines.append(_format(item))
+        self._window = []
+        self._write()
+
+def _kind(loc):
+    '''
+    operand kind of a location for the instruction selector
+    '''
+    if loc[0] == '$':
+        return 'i'
+    return 'm' if '(' in loc else 'r'
+
+def _format(item):
+    op, operands = item
+    if op == LABEL:
+        return operands[0] + ':\n'
+    if op == DIRECTIVE:
+        return '\t' + operands[0] + '\n'
+    if operands:
+        return '\t{0}\t{1}\n'.format(op, ', '.join(operands))
+    return '\t' + op + '\n'
 
 class Emit(object):
+    '''
+    x86-64 System V assembly of a Parser.ast, AT&T syntax.
+    expressions are evaluated stack machine style: the value ends in
+    %rax, or %xmm0 for floating types, and the left operand of a binary
+    operator waits on the stack.
+    with an optimization level the functions are lowered to the ir
+    instead, optimized and given registers by the allocator
+    '''
+
+    def __init__(self, out, peephole=None, level=None, allocator=None, selector=None, reorder=True,
+                 pack_frame=True):
+        self.w = out if isinstance(out, AsmWriter) else AsmWriter(out, peephole=peephole)
+        self.reorder = reorder # the heavier operand first, see sethi.right_first
+        self._needs = {}
+        self.pack_frame = pack_frame # slots shared by disjoint blocks, see frame.FrameLayout
+        self.passes = None if level is None else PassManager(level)
+        self.allocator = allocator
+        self.selector = selector
+        if not level is None:
+            if allocator is None:
+                self.allocator = LinearScan()
+            if selector is None:
+                self.selector = Selector()
+        self._ev = Eval()
+        self._labels = 0
+        self._floats = {} # (bits, size) -> label of a floating constant
+        self._frame = {} # id(VarNode) -> offset from %rbp
+        self._section = None
+
+    def _error(self, e):
+        raise Exception('gen: ' + e)
+
+    def _new_label(self):
+        self._labels += 1
+        return '.L{0}'.format(self._labels)
+
+    def _set_section(self, name):
+        if self._section != name:
+            self._section = name
+            self.w.directive(name)
+
+    def emit(self, ast):
+        '''
+        write the whole unit, return the count of lines written
+        '''
+        self._emit_globals([node for node in ast if isinstance(node, DeclNode)])
+        for node in ast:
+            if isinstance(node, FuncNode):
+                if self.passes is None:
+                    self._emit_func(node)
+                else:
+                    self._emit_ir_func(node)
+        self._emit_floats()
+        self.w.flush()
+        return self.w.count
+
+    # data
+
+    def _emit_globals(self, decls):
+        '''
+        initialized globals go to .data, the ones of only zero bytes to .bss.
+        in each section the largest alignment comes first, which leaves no
+        padding between the globals
+        '''
+        data, bss = [], []
+        for node in decls:
+            values = self._data_values(node)
+            if values is None:
+                bss.append((node, None))
+            else:
+                data.append((node, values))
+        for section, group in (('.data', data), ('.bss', bss)):
+            group.sort(key=lambda g: -max(g[0].declvar.ty.align, 1)) # stable
+            for node, values in group:
+                var = node.declvar
+                ty = var.ty
+                self._set_section(section)
+                self.w.directive('.globl ' + var.name)
+                self.w.directive('.align {0}'.format(max(ty.align, 1)))
+                self.w.label(var.name)
+                if values is None:
+                    self.w.directive('.zero {0}'.format(max(ty.size, 1)))
+                else:
+                    self._emit_data(values, max(ty.size, 1))
+
+    def _data_values(self, node):
+        '''
+        (directive, value) of every element the initializer of the global
+        node gives, None when all bytes of the global are zero
+        '''
+        var = node.declvar
+        ty = var.ty
+        inits = node.declinit or []
+        if ty.kind == TypeKind.ARRAY:
+            ty = ty.ptr
+            if len(inits) > var.ty.array_len:
+                self._error('excess elements in initializer of {0}'.format(var.name))
+        elif len(inits) > 1:
+            self._error('excess elements in initializer of {0}'.format(var.name))
+        values = [self._data_value(init.initval, ty, var.name) for init in inits]
+        if all(v == 0 for d, v in values):
+            return None
+        return values
+
+    def _emit_data(self, values, size):
+        '''
+        values of one directive share a line, runs of zero bytes become
+        .zero and so do the elements the initializer leaves out
+        '''
+        w = self.w
+        line = []
+        directive = None
+        used = 0
+        i, n = 0, len(values)
+        while i < n:
+            d, v = values[i]
+            j = i
+            while j < n and values[j][1] == 0:
+                j += 1
+            run = (j - i) * DATA_SIZE[d] if j < n else size - used # to the end
+            if run >= ZERO_RUN:
+                if line:
+                    w.directive('{0} {1}'.format(directive, ', '.join(line)))
+                    line = []
+                w.directive('.zero {0}'.format(run))
+                used += run
+                i = j
+                continue
+            if d != directive or len(line) == DATA_PER_LINE:
+                if line:
+                    w.directive('{0} {1}'.format(directive, ', '.join(line)))
+                directive = d
+                line = []
+            line.append(str(v))
+            used += DATA_SIZE[d]
+            i += 1
+        if line:
+            w.directive('{0} {1}'.format(directive, ', '.join(line)))
+        if used < size:
+            w.directive('.zero {0}'.format(size - used))
+
+    def _data_value(self, node, ty, name):
+        if is_float(ty):
+            v = self._float_value(node)
+            if v is None:
+                self._error('initializer element of {0} is not constant'.format(name))
+            return self._float_bits(v, ty.size)
+        v = self._ev.value(node)
+        if v is None:
+            v = self._float_value(node)
+            if v is None:
+                self._error('initializer element of {0} is not constant'.format(name))
+            v = int(v)
+        return DATA_DIRECTIVE[ty.size], self._ev.wrap_type(v, ty)
+
+    def _float_value(self, node):
+        while isinstance(node, UnaryNode) and (node.kind == NodeKind.AST_CONV or node.kind == NodeKind.OP_CAST):
+            node = node.operand
+        if isinstance(node, ValueNode) and isinstance(node.val, (int, float)):
+            return float(node.val)
+        return None
+
+    def _float_bits(self, v, size):
+        if size == 4:
+            return '.long', struct.unpack('<I', struct.pack('<f', v))[0]
+        return '.quad', struct.unpack('<Q', struct.pack('<d', v))[0]
+
+    def _float_directive(self, v, size):
+        return '{0} {1}'.format(*self._float_bits(v, size))
+
+    def _float_label(self, v, size):
+        key = (self._float_directive(v, size), size)
+        label = self._floats.get(key, None)
+        if label is None:
+            label = self._floats[key] = self._new_label()
+        return label
+
+    def _emit_floats(self):
+        if not self._floats:
+            return
+        self._set_section('.section .rodata')
+        for (directive, size), label in self._floats.items():
+            self.w.directive('.align {0}'.format(size))
+            self.w.label(label)
+            self.w.directive(directive)
+
+    # functions
+
+    def _layout_frame(self, func):
+        '''
+        give every parameter and local a slot below %rbp, return the frame size
+        '''
+        layout = FrameLayout(func, self.pack_frame)
+        self._frame = layout.offsets
+        return layout.size
+
+    def _emit_func(self, func):
+        w = self.w
+        name = func.fname
+        self._needs = {}
+        self._set_section('.text')
+        w.directive('.globl ' + name)
+        w.directive('.type {0}, @function'.format(name))
+        w.label(name)
+        w.ins('pushq', '%rbp')
+        w.ins('movq', '%rsp', '%rbp')
+        size = self._layout_frame(func)
+        if size:
+            w.ins('subq', '${0}'.format(size), '%rsp')
+        ints = floats = 0
+        for var in func.params:
+            slot = self._slot(var)
+            if is_float(var.ty):
+                if floats < FLOAT_ARG_REGS:
+                    w.ins('mov' + float_suffix(var.ty), '%xmm{0}'.format(floats), slot)
+                floats += 1
+            else:
+                if ints < len(ARG_REGS):
+                    w.ins('mov' + SUFFIX[var.ty.size], reg(ARG_REGS[ints], var.ty.size), slot)
+                ints += 1
+        self._stmt(func.body)
+        if name == 'main':
+            w.ins('xorl', '%eax', '%eax') # reaching the end of main returns 0
+        w.ins('leave')
+        w.ins('ret')
+        w.directive('.size {0}, .-{0}'.format(name))
+
+    def _slot(self, var):
+        if var.kind == NodeKind.AST_GVAR:
+            return var.name + '(%rip)'
+        offset = self._frame.get(id(var), None)
+        if offset is None:
+            self._error('no stack slot for {0}'.format(var.name))
+        return '{0}(%rbp)'.format(offset)
+
+    # statements
+
+    def _stmt(self, node):
+        if node is None:
+            return
+        if isinstance(node, CompoundStmtNode):
+            for stmt in node.stmts:
+                self._stmt(stmt)
+        elif isinstance(node, DeclNode):
+            if node.declinit:
+                var = node.declvar
+                init = node.declinit[0].initval
+                self._expr(init)
+                self._convert(init.ty, var.ty)
+                self._store(var)
+        elif isinstance(node, IfStmtNode):
+            self._if(node)
+        else:
+            self._expr(node)
+
+    def _if(self, node):
+        w = self.w
+        els = self._new_label()
+        self._test(node.cond)
+        w.ins('je', els)
+        self._stmt(node.then)
+        if node.els is None:
+            w.label(els)
+            return
+        end = self._new_label()
+        w.ins('jmp', end)
+        w.label(els)
+        self._stmt(node.els)
+        w.label(end)
+
+    def _test(self, node):
+        '''
+        set ZF when the value of node is zero
+        '''
+        self._expr(node)
+        ty = node.ty
+        if is_float(ty):
+            sfx = float_suffix(ty)
+            self.w.ins('xorp' + sfx[1], '%xmm1', '%xmm1')
+            self.w.ins('ucomi' + sfx, '%xmm1', '%xmm0')
+        else:
+            size = self._int_size(ty)
+            self.w.ins('cmp' + SUFFIX[size], '$0', reg(RAX, size))
+
+    # expressions
+
+    def _int_size(self, ty):
+        return 8 if not ty is None and ty.size == 8 else 4
+
+    def _store(self, var):
+        ty = var.ty
+        if is_float(ty):
+            self.w.ins('mov' + float_suffix(ty), '%xmm0', self._slot(var))
+        else:
+            size = max(ty.size, 1)
+            self.w.ins('mov' + SUFFIX[size], reg(RAX, size), self._slot(var))
+
+    def _load(self, var):
+        ty = var.ty
+        slot = self._slot(var)
+        if is_float(ty):
+            self.w.ins('mov' + float_suffix(ty), slot, '%xmm0')
+        elif ty.size == 8:
+            self.w.ins('movq', slot, '%rax')
+        elif ty.size == 4:
+            self.w.ins('movl', slot, '%eax')
+        else:
+            op = 'movz' if ty.usig else 'movs'
+            self.w.ins(op + SUFFIX[ty.size] + 'l', slot, '%eax')
+
+    def _expr(self, node):
+        if node is None:
+            self._error('unsupported expression')
+        if isinstance(node, ValueNode):
+            self._value(node)
+        elif isinstance(node, VarNode):
+            self._load(node)
+        elif isinstance(node, BinaryNode):
+            self._binary(node)
+        elif isinstance(node, UnaryNode):
+            self._unary(node)
+        else:
+            self._error('unsupported node {0}'.format(node.kind))
+
+    def _value(self, node):
+        ty = node.ty
+        if is_float(ty):
+            label = self._float_label(float(node.val), ty.size)
+            self.w.ins('mov' + float_suffix(ty), label + '(%rip)', '%xmm0')
+            return
+        v = self._ev.wrap_type(int(node.val), ty)
+        if self._int_size(ty) == 4:
+            self.w.ins('movl', '${0}'.format(v), '%eax')
+        elif -2 ** 31 <= v < 2 ** 31:
+            self.w.ins('movq', '${0}'.format(v), '%rax')
+        else:
+            self.w.ins('movabsq', '${0}'.format(v), '%rax')
+
+    def _convert(self, src, dst):
+        '''
+        convert the value of type src in %rax or %xmm0 to type dst
+        '''
+        if src is None or dst is None:
+            return
+        w = self.w
+        if is_float(src):
+            if is_float(dst):
+                if src.size != dst.size:
+                    w.ins('cvtss2sd' if src.size == 4 else 'cvtsd2ss', '%xmm0', '%xmm0')
+                return
+            size = self._int_size(dst)
+            w.ins('cvtt' + float_suffix(src) + '2si' + SUFFIX[size], '%xmm0', reg(RAX, size))
+            self._narrow(dst)
+            return
+        if is_float(dst):
+            if src.size == 8 or src.usig and src.size == 4:
+                if src.size == 4:
+                    w.ins('movl', '%eax', '%eax') # zero extend
+                w.ins('cvtsi2' + float_suffix(dst) + 'q', '%rax', '%xmm0')
+            else:
+                w.ins('cvtsi2' + float_suffix(dst) + 'l', '%eax', '%xmm0')
+            return
+        if dst.kind == TypeKind.BOOL:
+            size = self._int_size(src)
+            w.ins('cmp' + SUFFIX[size], '$0', reg(RAX, size))
+            w.ins('setne', '%al')
+            w.ins('movzbl', '%al', '%eax')
+            return
+        if dst.size == 8 and src.size < 8:
+            if src.usig:
+                w.ins('movl', '%eax', '%eax')
+            else:
+                w.ins('movslq', '%eax', '%rax')
+            return
+        if dst.size < src.size or dst.size < 4:
+            self._narrow(dst)
+
+    def _narrow(self, ty):
+        if ty.size == 1 or ty.size == 2:
+            op = 'movz' if ty.usig else 'movs'
+            self.w.ins(op + SUFFIX[ty.size] + 'l', reg(RAX, ty.size), '%eax')
+
+    def _binary(self, node):
+        kind = node.kind
+        if kind == NodeKind.OP_LOGAND or kind == NodeKind.OP_LOGOR:
+            self._logical(node)
+            return
+        if node.left is None or node.right is None:
+            self._error('unsupported expression')
+        w = self.w
+        ty = operand_type(node)
+        first, second = node.left, node.right
+        swapped = self.reorder and right_first(node, self._needs)
+        if swapped:
+            first, second = second, first
+        self._expr(first)
+        self._convert(first.ty, ty)
+        if is_float(ty):
+            sfx = float_suffix(ty)
+            w.ins('subq', '$8', '%rsp')
+            w.ins('movsd', '%xmm0', '(%rsp)')
+            self._expr(second)
+            self._convert(second.ty, ty)
+            if swapped:
+                w.ins('movsd', '(%rsp)', '%xmm1')
+            else:
+                w.ins('mov' + sfx, '%xmm0', '%xmm1')
+                w.ins('movsd', '(%rsp)', '%xmm0')
+            w.ins('addq', '$8', '%rsp')
+            self._float_binary(kind, sfx)
+            return
+        w.ins('pushq', '%rax')
+        self._expr(second)
+        self._convert(second.ty, ty)
+        if swapped:
+            w.ins('popq', '%rcx')
+        else:
+            w.ins('movq', '%rax', '%rcx')
+            w.ins('popq', '%rax')
+        self._int_binary(kind, ty)
+
+    def _int_binary(self, kind, ty):
+        w = self.w
+        size = self._int_size(ty)
+        usig = not ty is None and (ty.usig or ty.kind == TypeKind.PTR)
+        sfx = SUFFIX[size]
+        acc, src = reg(RAX, size), reg(RCX, size)
+        if kind in COMPARE_CC:
+            w.ins('cmp' + sfx, src, acc)
+            w.ins('set' + COMPARE_CC[kind][1 if usig else 0], '%al')
+            w.ins('movzbl', '%al', '%eax')
+        elif kind == NodeKind.OP_DIV or kind == NodeKind.OP_MOD:
+            if usig:
+                w.ins('xorl', '%edx', '%edx')
+                w.ins('div' + sfx, src)
+            else:
+                w.ins('cqto' if size == 8 else 'cltd')
+                w.ins('idiv' + sfx, src)
+            if kind == NodeKind.OP_MOD:
+                w.ins('mov' + sfx, '%rdx' if size == 8 else '%edx', acc)
+        elif kind == NodeKind.OP_SAL or kind == NodeKind.OP_SAR:
+            w.ins(INT_OPS[kind][1 if usig else 0] + sfx, '%cl', acc)
+        elif kind in INT_OPS:
+            w.ins(INT_OPS[kind][0] + sfx, src, acc)
+        else:
+            self._error('unsupported operator {0}'.format(kind))
+
+    def _float_binary(self, kind, sfx):
+        w = self.w
+        if kind in COMPARE_CC:
+            if kind == NodeKind.OP_L or kind == NodeKind.OP_LE:
+                # a < b is b > a, ucomis sets the flags of an unsigned compare
+                w.ins('ucomi' + sfx, '%xmm0', '%xmm1')
+                cc = 'a' if kind == NodeKind.OP_L else 'ae'
+            else:
+                w.ins('ucomi' + sfx, '%xmm1', '%xmm0')
+                cc = COMPARE_CC[kind][1]
+            w.ins('set' + cc, '%al')
+            if kind == NodeKind.OP_EQ or kind == NodeKind.OP_NE:
+                # unordered (NaN) compares are not equal
+                w.ins('set' + ('np' if kind == NodeKind.OP_EQ else 'p'), '%cl')
+                w.ins('andb' if kind == NodeKind.OP_EQ else 'orb', '%cl', '%al')
+            w.ins('movzbl', '%al', '%eax')
+        elif kind in FLOAT_OPS:
+            w.ins(FLOAT_OPS[kind] + sfx, '%xmm1', '%xmm0')
+        else:
+            self._error('unsupported operator {0}'.format(kind))
+
+    def _logical(self, node):
+        w = self.w
+        short = self._new_label()
+        end = self._new_label()
+        stop = 'je' if node.kind == NodeKind.OP_LOGAND else 'jne'
+        self._test(node.left)
+        w.ins(stop, short)
+        self._test(node.right)
+        w.ins(stop, short)
+        w.ins('movl', '$1' if node.kind == NodeKind.OP_LOGAND else '$0', '%eax')
+        w.ins('jmp', end)
+        w.label(short)
+        w.ins('movl', '$0' if node.kind == NodeKind.OP_LOGAND else '$1', '%eax')
+        w.label(end)
+
+    def _unary(self, node):
+        kind = node.kind
+        w = self.w
+        operand = node.operand
+        if kind == NodeKind.AST_CONV or kind == NodeKind.OP_CAST:
+            self._expr(operand)
+            self._convert(operand.ty, node.ty)
+        elif kind == NodeKind.OP_MINUS:
+            self._expr(operand)
+            if is_float(node.ty):
+                sfx = float_suffix(node.ty)
+                w.ins('mov' + sfx, '%xmm0', '%xmm1')
+                w.ins('xorp' + sfx[1], '%xmm0', '%xmm0')
+                w.ins('sub' + sfx, '%xmm1', '%xmm0')
+            else:
+                size = self._int_size(node.ty)
+                w.ins('neg' + SUFFIX[size], reg(RAX, size))
+        elif kind == NodeKind.OP_LOGNOT:
+            self._test(operand)
+            w.ins('sete', '%al')
+            w.ins('movzbl', '%al', '%eax')
+        elif kind == NodeKind.OP_POST_INC or kind == NodeKind.OP_POST_DEC:
+            if not isinstance(operand, VarNode) or is_float(operand.ty):
+                self._error('unsupported operand of {0}'.format(kind))
+            self._load(operand)
+            size = max(operand.ty.size, 1)
+            op = 'add' if kind == NodeKind.OP_POST_INC else 'sub'
+            w.ins(op + SUFFIX[size], '$1', self._slot(operand))
+        else:
+            self._error('unsupported operator {0}'.format(kind))
+
+    # functions through the ir
+
+    def _emit_ir_func(self, node):
+        func = Lower(self.reorder).lower(node)
+        self.passes.run(func)
+        self.emit_ir(func)
+
+    def emit_ir(self, func):
+        '''
+        write the code of an optimized ir function
+        '''
+        w = self.w
+        self._imms = immediates(func)
+        self._fused = fused_compares(func)
+        self._cc = None # (register, condition code) of a compare feeding the next branch
+        alloc = self._alloc = self.allocator.allocate(func, self._imms)
+        self._func = func
+        self._set_section('.text')
+        w.directive('.globl ' + func.name)
+        w.directive('.type {0}, @function'.format(func.name))
+        w.label(func.name)
+        w.ins('pushq', '%rbp')
+        w.ins('movq', '%rsp', '%rbp')
+        saved = len(alloc.callee_saved)
+        size = (8 * (saved + alloc.nslots) + 15) // 16 * 16
+        if size:
+            w.ins('subq', '${0}'.format(size), '%rsp')
+        for i, r in enumerate(alloc.callee_saved):
+            w.ins('movq', r, '{0}(%rbp)'.format(-8 * (i + 1)))
+        self._ir_params(func)
+        labels = [self._new_label() for b in func.blocks]
+        self._exit = self._new_label()
+        for b in func.blocks:
+            if b.id:
+                w.label(labels[b.id])
+            nxt = b.id + 1
+            for ins in b.ins:
+                self._ir_ins(ins, labels, nxt)
+        w.label(self._exit)
+        for i, r in enumerate(alloc.callee_saved):
+            w.ins('movq', '{0}(%rbp)'.format(-8 * (i + 1)), r)
+        w.ins('leave')
+        w.ins('ret')
+        w.directive('.size {0}, .-{0}'.format(func.name))
+
+    def _loc(self, r):
+        '''
+        machine register or spill slot of the ir register r
+        '''
+        m = self._alloc.regs.get(r, None)
+        if not m is None:
+            return m
+        slot = self._alloc.slots.get(r, None)
+        if slot is None:
+            return None # never live
+        return '{0}(%rbp)'.format(-8 * (len(self._alloc.callee_saved) + slot + 1))
+
+    def _src(self, r):
+        '''
+        the immediate or the location of r as an operand
+        '''
+        v = self._imms.get(r, None)
+        if v is None:
+            return self._loc(r)
+        return '${0}'.format(v)
+
+    def _operand(self, loc, ty):
+        if is_float(ty) or self._int_size(ty) == 8 or not loc in REG32:
+            return loc
+        return REG32[loc]
+
+    def _move(self, src, dst, ty):
+        '''
+        copy between two locations, a memory to memory copy goes through a scratch register
+        '''
+        if src == dst or dst is None:
+            return
+        if is_float(ty):
+            op = 'mov' + float_suffix(ty)
+            if '(' in src and '(' in dst:
+                self.w.ins(op, src, '%xmm0')
+                src = '%xmm0'
+            self.w.ins(op, src, dst)
+            return
+        size = self._int_size(ty)
+        op = 'mov' + SUFFIX[size]
+        if '(' in src and '(' in dst:
+            self.w.ins(op, src, reg(RAX, size))
+            src = '%rax'
+        self.w.ins(op, self._operand(src, ty), self._operand(dst, ty))
+
+    def _ir_load(self, r, scratch):
+        '''
+        value of r in %rax or %rcx, %xmm0 or %xmm1 when scratch is 1
+        '''
+        ty = self._func.types[r]
+        if is_float(ty):
+            target = '%xmm{0}'.format(scratch)
+        else:
+            target = '%rcx' if scratch else '%rax'
+        self._move(self._src(r), target, ty)
+
+    def _ir_store(self, r):
+        ty = self._func.types[r]
+        self._move('%xmm0' if is_float(ty) else '%rax', self._loc(r), ty)
+
+    def _ir_params(self, func):
+        '''
+        move the arguments to the locations of the parameters. the integer
+        registers may be taken by other parameters: a move waits while its
+        destination is still to be read, a cycle is broken through %rax
+        '''
+        moves = []
+        stack = []
+        ints = floats = 0
+        for r in func.params:
+            ty = func.types[r]
+            dst = self._loc(r)
+            if is_float(ty):
+                if floats < FLOAT_ARG_REGS:
+                    self._move('%xmm{0}'.format(floats), dst, ty)
+                else:
+                    stack.append(('{0}(%rbp)'.format(16 + 8 * len(stack)), dst, ty))
+                floats += 1
+            else:
+                if ints < len(ARG_REGS):
+                    if not dst is None:
+                        moves.append([ARG_REGS[ints][0], dst, ty])
+                else:
+                    stack.append(('{0}(%rbp)'.format(16 + 8 * len(stack)), dst, ty))
+                ints += 1
+        moves = [m for m in moves if m[0] != m[1]]
+        while moves:
+            for m in moves:
+                if not any(o[0] == m[1] for o in moves if not o is m):
+                    moves.remove(m)
+                    self._move(m[0], m[1], m[2])
+                    break
+            else:
+                m = moves[0]
+                self.w.ins('movq', m[0], '%rax')
+                for o in moves:
+                    if o[0] == m[0]:
+                        o[0] = '%rax'
+        for src, dst, ty in stack:
+            self._move(src, dst, ty)
+
+    def _ir_ins(self, ins, labels, nxt):
+        w = self.w
+        op = ins.op
+        types = self._func.types
+        if op == Op.ARG:
+            return
+        if op == Op.JMP:
+            if ins.a != nxt:
+                w.ins('jmp', labels[ins.a])
+        elif op == Op.BR:
+            if ins.a in self._imms:
+                target = ins.b if self._imms[ins.a] else ins.c
+                if target != nxt:
+                    w.ins('jmp', labels[target])
+                return
+            if not self._cc is None and self._cc[0] == ins.a:
+                cc = self._cc[1]
+            else:
+                ty = types[ins.a]
+                w.ins('cmp' + SUFFIX[self._int_size(ty)], '$0', self._operand(self._loc(ins.a), ty))
+                cc = 'ne'
+            self._cc = None
+            if ins.b == nxt:
+                w.ins('j' + NEGATED_CC[cc], labels[ins.c])
+            else:
+                w.ins('j' + cc, labels[ins.b])
+                if ins.c != nxt:
+                    w.ins('jmp', labels[ins.c])
+        elif op == Op.RET:
+            if not ins.a is None:
+                self._ir_load(ins.a, 0)
+            if nxt != len(self._func.blocks):
+                w.ins('jmp', self._exit)
+        elif self._loc(ins.dst) is None and not id(ins) in self._fused:
+            return # the result is never read or is an immediate
+        elif op == Op.CONST:
+            self._ir_const(ins)
+        elif op == Op.COPY:
+            self._move(self._src(ins.a), self._loc(ins.dst), types[ins.dst])
+        elif op == Op.CONV:
+            self._ir_load(ins.a, 0)
+            self._convert(types[ins.a], types[ins.dst])
+            self._ir_store(ins.dst)
+        elif op == Op.NEG:
+            ty = types[ins.dst]
+            self._ir_load(ins.a, 0)
+            if is_float(ty):
+                sfx = float_suffix(ty)
+                w.ins('mov' + sfx, '%xmm0', '%xmm1')
+                w.ins('xorp' + sfx[1], '%xmm0', '%xmm0')
+                w.ins('sub' + sfx, '%xmm1', '%xmm0')
+            else:
+                size = self._int_size(ty)
+                w.ins('neg' + SUFFIX[size], reg(RAX, size))
+            self._ir_store(ins.dst)
+        elif op == Op.NOT:
+            ty = types[ins.a]
+            src = self._src(ins.a)
+            if src[0] == '$':
+                self._ir_load(ins.a, 0)
+                src = '%rax'
+            w.ins('cmp' + SUFFIX[self._int_size(ty)], '$0', self._operand(src, ty))
+            w.ins('sete', '%al')
+            w.ins('movzbl', '%al', '%eax')
+            self._ir_store(ins.dst)
+        else:
+            ty = types[ins.a]
+            if not is_float(ty) and self._select(ins, ty):
+                return
+            self._ir_load(ins.a, 0)
+            self._ir_load(ins.b, 1)
+            if is_float(ty):
+                self._float_binary(NODE_KINDS[op], float_suffix(ty))
+            else:
+                self._int_binary(NODE_KINDS[op], ty if op in COMPARE_OPS else types[ins.dst])
+            self._ir_store(ins.dst)
+
+    def _select(self, ins, ty):
+        '''
+        emit the integer binary ins by the pattern the selector picks,
+        False leaves it to the generic code
+        '''
+        op = ins.op
+        a, b = self._src(ins.a), self._src(ins.b)
+        fused = id(ins) in self._fused
+        d = None if fused else self._loc(ins.dst)
+        tie = 'a' if d == a else 'b' if d == b else 'n'
+        p = self.selector.select(op, _kind(a), _kind(b), 'j' if fused else _kind(d), tie)
+        if p is None or p.code is None:
+            return False
+        size = self._int_size(ty)
+        usig = ty.usig or ty.kind == TypeKind.PTR
+        fields = {
+            's': SUFFIX[size],
+            'a': self._operand(a, ty),
+            'b': self._operand(b, ty),
+            'A': a,
+            'B': b,
+            'bv': b[1:],
+            'acc': reg(RAX, size),
+            'rcx': reg(RCX, size),
+        }
+        if op in COMPARE_OPS:
+            fields['cc'] = CONDITIONS[op][1 if usig else 0]
+            if fused:
+                self._cc = (ins.dst, fields['cc'])
+            else:
+                fields['d'] = self._operand(d, self._func.types[ins.dst])
+        else:
+            fields['op'] = MNEMONICS[op][1 if usig else 0]
+            fields['d'] = self._operand(d, ty)
+        for code in p.code:
+            mnemonic, _, operands = code.format(**fields).partition(' ')
+            operands = operands.split(', ')
+            if mnemonic.startswith('mov') and operands[0] == operands[1]:
+                continue
+            self.w.ins(mnemonic, *operands)
+        return True
 
-    def __init__(self):
-        pass
+    def _ir_const(self, ins):
+        ty = self._func.types[ins.dst]
+        dst = self._loc(ins.dst)
+        if is_float(ty):
+            label = self._float_label(float(ins.a), ty.size)
+            self._move(label + '(%rip)', dst, ty)
+            return
+        v = self._ev.wrap_type(int(ins.a), ty)
+        if self._int_size(ty) == 4:
+            self.w.ins('movl', '${0}'.format(v), self._operand(dst, ty))
+        elif -2 ** 31 <= v < 2 ** 31:
+            self.w.ins('movq', '${0}'.format(v), dst)
+        elif '(' in dst:
+            self.w.ins('movabsq', '${0}'.format(v), '%rax')
+            self.w.ins('movq', '%rax', dst)
+        else:
+            self.w.ins('movabsq', '${0}'.format(v), dst)
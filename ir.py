@@ -0,0 +1,458 @@
+'''
+Copyright 2018 JackLiang.
+
+three-address intermediate representation
+'''
+from enum import Enum, unique
+from ctype import TypeKind, TypeMaker
+from astc import *
+from sethi import right_first
+
+@unique
+class Op(Enum):
+    ARG = 0 # dst = parameter a
+    CONST = 1 # dst = immediate a
+    COPY = 2 # dst = a
+    CONV = 3 # dst = a converted to the type of dst
+    NEG = 4
+    NOT = 5 # logical not
+    ADD = 10
+    SUB = 11
+    MUL = 12
+    DIV = 13
+    MOD = 14
+    AND = 15
+    OR = 16
+    XOR = 17
+    SHL = 18
+    SHR = 19 # arithmetic when the type is signed
+    EQ = 20
+    NE = 21
+    LT = 22
+    LE = 23
+    GT = 24
+    GE = 25
+    JMP = 30 # goto block a
+    BR = 31 # a != 0 ? block b : block c
+    RET = 32 # return a, None for no value
+
+BINARY_OPS = {
+    NodeKind.OP_ADD: Op.ADD,
+    NodeKind.OP_SUB: Op.SUB,
+    NodeKind.OP_MUL: Op.MUL,
+    NodeKind.OP_DIV: Op.DIV,
+    NodeKind.OP_MOD: Op.MOD,
+    NodeKind.OP_BITAND: Op.AND,
+    NodeKind.OP_BITOR: Op.OR,
+    NodeKind.OP_BITXOR: Op.XOR,
+    NodeKind.OP_SAL: Op.SHL,
+    NodeKind.OP_SAR: Op.SHR,
+    NodeKind.OP_EQ: Op.EQ,
+    NodeKind.OP_NE: Op.NE,
+    NodeKind.OP_L: Op.LT,
+    NodeKind.OP_LE: Op.LE,
+    NodeKind.OP_G: Op.GT,
+    NodeKind.OP_GE: Op.GE,
+}
+# the ast operator of a binary instruction, eval.Eval works on these
+NODE_KINDS = dict((op, kind) for kind, op in BINARY_OPS.items())
+
+COMPARE_OPS = frozenset((Op.EQ, Op.NE, Op.LT, Op.LE, Op.GT, Op.GE))
+BINARY = frozenset(BINARY_OPS.values())
+UNARY = frozenset((Op.COPY, Op.CONV, Op.NEG, Op.NOT))
+TERMINATORS = frozenset((Op.JMP, Op.BR, Op.RET))
+
+FLOAT_KINDS = (TypeKind.FLOAT, TypeKind.DOUBLE, TypeKind.LDOUBLE)
+
+def is_float(ty):
+    return not ty is None and ty.kind in FLOAT_KINDS
+
+def operand_type(node):
+    '''
+    type the operands of a binary node are computed in: the node type for
+    arithmetic, the wider operand type for comparisons
+    '''
+    lty, rty = node.left.ty, node.right.ty
+    if node.kind in (NodeKind.OP_EQ, NodeKind.OP_NE, NodeKind.OP_L, NodeKind.OP_LE, NodeKind.OP_G, NodeKind.OP_GE):
+        if is_float(lty) or is_float(rty):
+            return lty if is_float(lty) and (not is_float(rty) or lty.size >= rty.size) else rty
+        return lty if lty.size > rty.size or lty.size == rty.size and lty.usig else rty
+    return node.ty
+
+class Ins(object):
+    '''
+    dst = op a, b. dst, a and b are register numbers, except the
+    immediate of CONST, the parameter index of ARG and the block
+    numbers of JMP and BR
+    '''
+    __slots__ = ('op', 'dst', 'a', 'b', 'c')
+
+    def __init__(self, op, dst=None, a=None, b=None, c=None):
+        self.op = op
+        self.dst = dst
+        self.a = a
+        self.b = b
+        self.c = c
+
+    def uses(self):
+        '''
+        registers read by the instruction
+        '''
+        op = self.op
+        if op in BINARY:
+            return (self.a, self.b)
+        if op in UNARY or op == Op.BR or op == Op.RET and not self.a is None:
+            return (self.a,)
+        return ()
+
+    def targets(self):
+        if self.op == Op.JMP:
+            return (self.a,)
+        if self.op == Op.BR:
+            return (self.b, self.c)
+        return ()
+
+class Block(object):
+    __slots__ = ('id', 'ins', 'succs', 'preds')
+
+    def __init__(self, id):
+        self.id = id
+        self.ins = []
+        self.succs = []
+        self.preds = []
+
+    def terminated(self):
+        return len(self.ins) > 0 and self.ins[-1].op in TERMINATORS
+
+class Func(object):
+    '''
+    a lowered function. registers are numbered, types and names are
+    lists indexed by the register, the name is None for a temporary
+    '''
+    __slots__ = ('name', 'blocks', 'types', 'names', 'params', 'vars')
+
+    def __init__(self, name):
+        self.name = name
+        self.blocks = [] # blocks[0] is the entry
+        self.types = []
+        self.names = []
+        self.params = [] # registers of the parameters
+        self.vars = {} # id(VarNode) -> register
+
+    def new_reg(self, ty, name=None):
+        self.types.append(ty)
+        self.names.append(name)
+        return len(self.types) - 1
+
+    def new_block(self):
+        block = Block(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def size(self):
+        return sum(len(b.ins) for b in self.blocks)
+
+    def link(self):
+        '''
+        fill succs and preds from the terminators
+        '''
+        for b in self.blocks:
+            b.succs = []
+            b.preds = []
+        for b in self.blocks:
+            if b.terminated():
+                for t in b.ins[-1].targets():
+                    succ = self.blocks[t]
+                    if not succ in b.succs:
+                        b.succs.append(succ)
+                        succ.preds.append(b)
+
+    def rpo(self):
+        '''
+        blocks reachable from the entry in reverse postorder, the first
+        successor of a branch comes first
+        '''
+        order = []
+        seen = set([0])
+        stack = [(self.blocks[0], 0)]
+        while stack:
+            block, i = stack.pop()
+            if i < len(block.succs):
+                stack.append((block, i + 1))
+                succ = block.succs[-1 - i]
+                if not succ.id in seen:
+                    seen.add(succ.id)
+                    stack.append((succ, 0))
+            else:
+                order.append(block)
+        order.reverse()
+        return order
+
+    def renumber(self):
+        '''
+        drop blocks unreachable from the entry and number the rest in order
+        '''
+        self.link()
+        live = self.rpo()
+        mapping = dict((b.id, i) for i, b in enumerate(live))
+        for b in live:
+            term = b.ins[-1]
+            if term.op == Op.JMP:
+                term.a = mapping[term.a]
+            elif term.op == Op.BR:
+                term.b = mapping[term.b]
+                term.c = mapping[term.c]
+        for i, b in enumerate(live):
+            b.id = i
+        self.blocks = live
+        self.link()
+
+    def reg_name(self, r):
+        name = self.names[r]
+        return '%{0}'.format(r) if name is None else '%{0}.{1}'.format(name, r)
+
+    def dump(self):
+        '''
+        text of the function, one instruction per line
+        '''
+        reg = self.reg_name
+        lines = ['func {0}({1}) {{'.format(self.name, ', '.join(reg(r) for r in self.params))]
+        for b in self.blocks:
+            lines.append('.B{0}:'.format(b.id))
+            for ins in b.ins:
+                lines.append('    ' + self._dump_ins(ins, reg))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _dump_ins(self, ins, reg):
+        op = ins.op
+        if op == Op.JMP:
+            return 'jmp .B{0}'.format(ins.a)
+        if op == Op.BR:
+            return 'br {0}, .B{1}, .B{2}'.format(reg(ins.a), ins.b, ins.c)
+        if op == Op.RET:
+            return 'ret' if ins.a is None else 'ret {0}'.format(reg(ins.a))
+        if op == Op.CONST or op == Op.ARG:
+            operands = repr(ins.a)
+        else:
+            operands = ', '.join(reg(r) for r in ins.uses())
+        return '{0} = {1} {2} {3}'.format(reg(ins.dst), op.name.lower(), operands, type_name(self.types[ins.dst]))
+
+def type_name(ty):
+    if ty.kind == TypeKind.PTR:
+        return 'ptr'
+    return ('u' if ty.usig and ty.kind != TypeKind.BOOL else '') + ty.kind.name.lower()
+
+def verify(func):
+    '''
+    raise an Exception for a malformed function: a block without exactly
+    one terminator at its end, a bad target or register, a cfg out of date
+    or a temporary read before any definition of it
+    '''
+    nregs = len(func.types)
+    defined = set(func.params)
+    def error(b, e):
+        raise Exception('ir: {0} .B{1} {2}'.format(func.name, b.id, e))
+    for i, b in enumerate(func.blocks):
+        if b.id != i:
+            error(b, 'numbered {0}'.format(i))
+        if not b.terminated():
+            error(b, 'has no terminator')
+        targets = []
+        for n, ins in enumerate(b.ins):
+            if ins.op in TERMINATORS and n != len(b.ins) - 1:
+                error(b, 'terminator {0} in the middle'.format(ins.op.name.lower()))
+            for r in ins.uses():
+                if not type(r) is int or r < 0 or r >= nregs:
+                    error(b, 'bad register {0}'.format(r))
+            if not ins.op in TERMINATORS:
+                if not type(ins.dst) is int or ins.dst < 0 or ins.dst >= nregs:
+                    error(b, 'bad destination {0}'.format(ins.dst))
+                defined.add(ins.dst)
+            for t in ins.targets():
+                if not type(t) is int or t < 0 or t >= len(func.blocks):
+                    error(b, 'bad target {0}'.format(t))
+                if not func.blocks[t] in targets:
+                    targets.append(func.blocks[t])
+        if [s.id for s in b.succs] != [s.id for s in targets]:
+            error(b, 'successors out of date')
+        for s in b.succs:
+            if not b in s.preds:
+                error(b, 'missing from the predecessors of .B{0}'.format(s.id))
+    for b in func.blocks:
+        for ins in b.ins:
+            for r in ins.uses():
+                if func.names[r] is None and not r in defined:
+                    error(b, 'temporary {0} is never defined'.format(func.reg_name(r)))
+
+class Lower(object):
+    '''
+    FuncNode to Func, every ast node is visited once
+    '''
+
+    def __init__(self, reorder=True):
+        self._tm = TypeMaker()
+        self._int = self._tm.type_int()
+        self.reorder = reorder # the heavier operand first, see sethi.right_first
+
+    def lower(self, node):
+        f = self._f = Func(node.fname)
+        self._needs = {}
+        self._block = f.new_block()
+        for i, var in enumerate(node.params):
+            r = self._var(var)
+            f.params.append(r)
+            self._ins(Op.ARG, r, i)
+        self._stmt(node.body)
+        if not self._block.terminated():
+            if node.fname == 'main':
+                # reaching the end of main returns 0
+                self._ins(Op.RET, None, self._const(0, self._int))
+            else:
+                self._ins(Op.RET)
+        f.renumber()
+        return f
+
+    def _var(self, var):
+        r = self._f.vars.get(id(var), None)
+        if r is None:
+            r = self._f.vars[id(var)] = self._f.new_reg(var.ty, var.name)
+        return r
+
+    def _ins(self, op, dst=None, a=None, b=None, c=None):
+        self._block.ins.append(Ins(op, dst, a, b, c))
+        return dst
+
+    def _temp(self, ty):
+        return self._f.new_reg(ty)
+
+    def _const(self, v, ty):
+        return self._ins(Op.CONST, self._temp(ty), v)
+
+    def _jump(self, block):
+        if not self._block.terminated():
+            self._ins(Op.JMP, None, block.id)
+
+    def _stmt(self, node):
+        if node is None:
+            return
+        if isinstance(node, CompoundStmtNode):
+            for stmt in node.stmts:
+                self._stmt(stmt)
+        elif isinstance(node, DeclNode):
+            var = node.declvar
+            if node.declinit:
+                if var.kind == NodeKind.AST_GVAR:
+                    raise Exception('ir: global {0} in a function'.format(var.name))
+                init = node.declinit[0].initval
+                r = self._convert(self._expr(init), init.ty, var.ty)
+                self._ins(Op.COPY, self._var(var), r)
+            else:
+                self._var(var)
+        elif isinstance(node, IfStmtNode):
+            f = self._f
+            then = f.new_block()
+            els = None if node.els is None else f.new_block()
+            join = f.new_block()
+            if els is None:
+                els = join
+            self._ins(Op.BR, None, self._truth(node.cond), then.id, els.id)
+            self._block = then
+            self._stmt(node.then)
+            self._jump(join)
+            if els != join:
+                self._block = els
+                self._stmt(node.els)
+                self._jump(join)
+            self._block = join
+        else:
+            self._expr(node)
+
+    def _truth(self, node):
+        '''
+        register that is not zero when node is true
+        '''
+        r = self._expr(node)
+        if is_float(node.ty):
+            zero = self._const(0.0, node.ty)
+            return self._ins(Op.NE, self._temp(self._int), r, zero)
+        return r
+
+    def _convert(self, r, src, dst):
+        if src is None or dst is None or src is dst:
+            return r
+        if src.kind == dst.kind and src.size == dst.size and src.usig == dst.usig:
+            return r
+        return self._ins(Op.CONV, self._temp(dst), r)
+
+    def _expr(self, node):
+        if node is None:
+            raise Exception('ir: unsupported expression')
+        if isinstance(node, ValueNode):
+            return self._const(node.val, node.ty)
+        if isinstance(node, VarNode):
+            if node.kind == NodeKind.AST_GVAR:
+                raise Exception('ir: global {0} in an expression'.format(node.name))
+            return self._var(node)
+        if isinstance(node, BinaryNode):
+            kind = node.kind
+            if kind == NodeKind.OP_LOGAND or kind == NodeKind.OP_LOGOR:
+                return self._logical(node)
+            op = BINARY_OPS.get(kind, None)
+            if op is None or node.left is None or node.right is None:
+                raise Exception('ir: unsupported operator {0}'.format(kind))
+            ty = operand_type(node)
+            if self.reorder and right_first(node, self._needs):
+                b = self._convert(self._expr(node.right), node.right.ty, ty)
+                a = self._convert(self._expr(node.left), node.left.ty, ty)
+            else:
+                a = self._convert(self._expr(node.left), node.left.ty, ty)
+                b = self._convert(self._expr(node.right), node.right.ty, ty)
+            return self._ins(op, self._temp(self._int if op in COMPARE_OPS else ty), a, b)
+        if isinstance(node, UnaryNode):
+            return self._unary(node)
+        raise Exception('ir: unsupported node {0}'.format(node.kind))
+
+    def _unary(self, node):
+        kind = node.kind
+        operand = node.operand
+        if kind == NodeKind.AST_CONV or kind == NodeKind.OP_CAST:
+            return self._convert(self._expr(operand), operand.ty, node.ty)
+        if kind == NodeKind.OP_MINUS:
+            return self._ins(Op.NEG, self._temp(node.ty), self._convert(self._expr(operand), operand.ty, node.ty))
+        if kind == NodeKind.OP_LOGNOT:
+            return self._ins(Op.NOT, self._temp(self._int), self._truth(operand))
+        if kind == NodeKind.OP_POST_INC or kind == NodeKind.OP_POST_DEC:
+            if not isinstance(operand, VarNode) or operand.kind != NodeKind.AST_LVAR:
+                raise Exception('ir: unsupported operand of {0}'.format(kind))
+            var = self._var(operand)
+            old = self._ins(Op.COPY, self._temp(operand.ty), var)
+            one = self._const(1, operand.ty)
+            self._ins(Op.ADD if kind == NodeKind.OP_POST_INC else Op.SUB, var, var, one)
+            return old
+        raise Exception('ir: unsupported operator {0}'.format(kind))
+
+    def _logical(self, node):
+        f = self._f
+        r = self._temp(self._int)
+        right, short, join = f.new_block(), f.new_block(), f.new_block()
+        left = self._truth(node.left)
+        if node.kind == NodeKind.OP_LOGAND:
+            self._ins(Op.BR, None, left, right.id, short.id)
+        else:
+            self._ins(Op.BR, None, left, short.id, right.id)
+        self._block = right
+        self._ins(Op.NE, r, self._truth(node.right), self._const(0, self._int))
+        self._jump(join)
+        self._block = short
+        self._ins(Op.CONST, r, 0 if node.kind == NodeKind.OP_LOGAND else 1)
+        self._jump(join)
+        self._block = join
+        return r
+
+def lower(ast):
+    '''
+    Func of every function definition in ast
+    '''
+    lw = Lower()
+    return [lw.lower(node) for node in ast if isinstance(node, FuncNode)]
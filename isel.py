@@ -0,0 +1,169 @@
+'''
+Copyright 2018 JackLiang.
+
+tree pattern instruction selection
+'''
+from ir import *
+
+ARITH = (Op.ADD, Op.SUB, Op.AND, Op.OR, Op.XOR)
+COMMUTATIVE = (Op.ADD, Op.AND, Op.OR, Op.XOR, Op.MUL)
+SHIFTS = (Op.SHL, Op.SHR)
+COMPARES = tuple(COMPARE_OPS)
+
+# mnemonics by (op, unsigned)
+MNEMONICS = {
+    Op.ADD: ('add', 'add'),
+    Op.SUB: ('sub', 'sub'),
+    Op.AND: ('and', 'and'),
+    Op.OR: ('or', 'or'),
+    Op.XOR: ('xor', 'xor'),
+    Op.MUL: ('imul', 'imul'),
+    Op.SHL: ('sal', 'shl'),
+    Op.SHR: ('sar', 'shr'),
+}
+
+# condition codes by (op, unsigned)
+CONDITIONS = {
+    Op.EQ: ('e', 'e'),
+    Op.NE: ('ne', 'ne'),
+    Op.LT: ('l', 'b'),
+    Op.LE: ('le', 'be'),
+    Op.GT: ('g', 'a'),
+    Op.GE: ('ge', 'ae'),
+}
+
+class Pattern(object):
+    '''
+    a tree of a binary instruction and its operands: the operands and the
+    destination are of the kinds r register, m memory, i immediate,
+    j for a compare that feeds a branch. tie says how the destination
+    may share the location of an operand: n it does not, a or b it is
+    that operand. code is a list of instruction templates, None leaves
+    the instruction to the generic code of the generator
+    '''
+    __slots__ = ('name', 'ops', 'a', 'b', 'dst', 'tie', 'cost', 'code')
+
+    def __init__(self, name, ops, a, b, dst, tie, cost, code):
+        self.name = name
+        self.ops = ops
+        self.a = a
+        self.b = b
+        self.dst = dst
+        self.tie = tie
+        self.cost = cost
+        self.code = code
+
+ANY = 'nab'
+
+PATTERNS = [
+    Pattern('op_tied', ARITH, 'rm', 'ri', 'rm', 'a', 1, ('{op}{s} {b}, {d}',)),
+    Pattern('op_tied_load', ARITH, 'r', 'm', 'r', 'a', 1, ('{op}{s} {b}, {d}',)),
+    Pattern('op_swapped', COMMUTATIVE, 'rmi', 'r', 'r', 'b', 1, ('{op}{s} {a}, {d}',)),
+    Pattern('op_swapped_store', (Op.ADD, Op.AND, Op.OR, Op.XOR), 'ri', 'm', 'm', 'b', 1, ('{op}{s} {a}, {d}',)),
+    Pattern('op_reg', ARITH + (Op.MUL,), 'rmi', 'rmi', 'r', 'n', 2, ('mov{s} {a}, {d}', '{op}{s} {b}, {d}')),
+    Pattern('add_lea_imm', (Op.ADD,), 'r', 'i', 'r', 'n', 1, ('lea{s} {bv}({A}), {d}',)),
+    Pattern('add_lea', (Op.ADD,), 'r', 'r', 'r', 'n', 1, ('lea{s} ({A},{B}), {d}',)),
+    Pattern('mul_tied', (Op.MUL,), 'r', 'rmi', 'r', 'a', 1, ('imul{s} {b}, {d}',)),
+    Pattern('mul_imm', (Op.MUL,), 'rm', 'i', 'r', ANY, 1, ('imul{s} {b}, {a}, {d}',)),
+    Pattern('op_acc', ARITH + (Op.MUL,), 'rmi', 'rmi', 'rm', ANY, 3,
+            ('mov{s} {a}, {acc}', '{op}{s} {b}, {acc}', 'mov{s} {acc}, {d}')),
+    Pattern('shift_tied', SHIFTS, 'rm', 'i', 'rm', 'a', 1, ('{op}{s} {b}, {d}',)),
+    Pattern('shift_reg', SHIFTS, 'rmi', 'i', 'r', 'n', 2, ('mov{s} {a}, {d}', '{op}{s} {b}, {d}')),
+    Pattern('shift_acc', SHIFTS, 'rmi', 'i', 'rm', ANY, 3,
+            ('mov{s} {a}, {acc}', '{op}{s} {b}, {acc}', 'mov{s} {acc}, {d}')),
+    Pattern('shift_cl', SHIFTS, 'rmi', 'rm', 'rm', ANY, 4,
+            ('mov{s} {b}, {rcx}', 'mov{s} {a}, {acc}', '{op}{s} %cl, {acc}', 'mov{s} {acc}, {d}')),
+    Pattern('cmp_set', COMPARES, 'rm', 'ri', 'r', ANY, 3, ('cmp{s} {b}, {a}', 'set{cc} %al', 'movzbl %al, {d}')),
+    Pattern('cmp_set_load', COMPARES, 'r', 'm', 'r', ANY, 3, ('cmp{s} {b}, {a}', 'set{cc} %al', 'movzbl %al, {d}')),
+    Pattern('cmp_set_acc', COMPARES, 'rmi', 'rmi', 'rm', ANY, 5,
+            ('mov{s} {a}, {acc}', 'cmp{s} {b}, {acc}', 'set{cc} %al', 'movzbl %al, %eax', 'movl %eax, {d}')),
+    Pattern('cmp_jump', COMPARES, 'rm', 'ri', 'j', 'n', 1, ('cmp{s} {b}, {a}',)),
+    Pattern('cmp_jump_load', COMPARES, 'r', 'm', 'j', 'n', 1, ('cmp{s} {b}, {a}',)),
+    Pattern('cmp_jump_acc', COMPARES, 'rmi', 'rmi', 'j', 'n', 2, ('mov{s} {a}, {acc}', 'cmp{s} {b}, {acc}')),
+    Pattern('generic', (Op.DIV, Op.MOD), 'rmi', 'rmi', 'rm', ANY, 5, None),
+]
+
+def compile_patterns(patterns):
+    '''
+    dispatch table of the cheapest pattern by (op, a, b, destination, tie)
+    '''
+    table = {}
+    for p in patterns:
+        for op in p.ops:
+            for a in p.a:
+                for b in p.b:
+                    for dst in p.dst:
+                        for tie in p.tie:
+                            key = (op, a, b, dst, tie)
+                            old = table.get(key, None)
+                            if old is None or p.cost < old.cost:
+                                table[key] = p
+    return table
+
+TABLE = compile_patterns(PATTERNS)
+
+def _fits(v):
+    return -2 ** 31 <= v < 2 ** 31
+
+def immediates(func):
+    '''
+    register -> value of the integer registers whose only definition is
+    a constant that fits an immediate operand
+    '''
+    defs = {}
+    for b in func.blocks:
+        for ins in b.ins:
+            if not ins.op in TERMINATORS:
+                defs[ins.dst] = None if ins.dst in defs else ins
+    imms = {}
+    for r, ins in defs.items():
+        if not ins is None and ins.op == Op.CONST and not is_float(func.types[r]) and not r in func.params:
+            v = int(ins.a)
+            if _fits(v):
+                imms[r] = v
+    return imms
+
+def fused_compares(func):
+    '''
+    compares read only by the branch right after them, the branch
+    tests the flags of the compare
+    '''
+    uses = {}
+    for b in func.blocks:
+        for ins in b.ins:
+            for r in ins.uses():
+                uses[r] = uses.get(r, 0) + 1
+    fused = set()
+    for b in func.blocks:
+        if len(b.ins) < 2:
+            continue
+        cmp, br = b.ins[-2], b.ins[-1]
+        if (br.op == Op.BR and cmp.op in COMPARE_OPS and cmp.dst == br.a and uses[cmp.dst] == 1
+                and func.names[cmp.dst] is None and not is_float(func.types[cmp.a])):
+            fused.add(id(cmp))
+    return fused
+
+class Selector(object):
+    '''
+    picks the pattern of an instruction by one lookup in the compiled
+    table, counts keeps how often each pattern was chosen
+    '''
+
+    def __init__(self, patterns=None):
+        self.table = TABLE if patterns is None else compile_patterns(patterns)
+        self.counts = {}
+        self.cost = 0
+
+    def select(self, op, a, b, dst, tie):
+        p = self.table.get((op, a, b, dst, tie), None)
+        if p is None:
+            return None
+        self.counts[p.name] = self.counts.get(p.name, 0) + 1
+        self.cost += p.cost
+        return p
+
+    def report(self):
+        lines = ['cost {}'.format(self.cost)]
+        for name in sorted(self.counts, key=lambda k: -self.counts[k]):
+            lines.append('  {:<24} {:>8}'.format(name, self.counts[name]))
+        return lines
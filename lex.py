@@ -3,7 +3,18 @@ Copyright 2018 JackLiang.
 
 generate tokenizer
 '''
+import re
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
 from enum import Enum, unique
+from utils.diskcache import content_key
+
+LEXER_VERSION = 1 # bump when the tokens of a source change
+CHUNK_SIZE = 64 * 1024 # characters read at a time from a file object
+RELEX_BACK = 2 # tokens re-lexed in front of an edit, the longest operator may join them
 
 KEYWORDS = {
     '_Alignas': 'K__ALIGNAS',
@@ -66,6 +77,7 @@ class TokenKind(Enum):
     TINVALID = 8
 
 class Token(object):
+    __slots__ = ('kind', 'filename', 'line', 'column', 'value')
 
     def __init__(self, kind, filename, line, column, value):
         self.kind = kind
@@ -81,14 +93,173 @@ class Token(object):
                                                   self.column,
                                                   self.value)
 
-class Lexer(object):
+TOKEN_KINDS = tuple(TokenKind) # TokenKind by value
+
+class TokenBuffer(object):
+    '''
+    struct of arrays token storage.
+    kind, line and column are int columns, values are indexes into
+    an interned string table and the filename is stored once
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.kinds = array('i')
+        self.lines = array('i')
+        self.columns = array('i')
+        self.values = array('i') # index of self.strings, -1 for None
+        self.offsets = array('i') # start offset of every token in the source
+        self.strings = []
+        self._interned = {}
+
+    def _intern(self, value):
+        if value is None:
+            return -1
+        i = self._interned.get(value, None)
+        if i is None:
+            i = len(self.strings)
+            self._interned[value] = i
+            self.strings.append(value)
+        return i
+
+    def append(self, kind, line, column, value, offset=-1):
+        self.kinds.append(kind.value)
+        self.lines.append(line)
+        self.columns.append(column)
+        self.values.append(self._intern(value))
+        self.offsets.append(offset)
+
+    def extend(self, tokens):
+        '''
+        tokens is an iterable of (kind, line, column, value, offset)
+        '''
+        kinds, lines, columns, values = self.kinds.append, self.lines.append, self.columns.append, self.values.append
+        offsets = self.offsets.append
+        interned = self._interned
+        strings = self.strings
+        for kind, line, column, value, offset in tokens:
+            kinds(kind.value)
+            lines(line)
+            columns(column)
+            offsets(offset)
+            if value is None:
+                values(-1)
+            else:
+                i = interned.get(value, None)
+                if i is None:
+                    i = interned[value] = len(strings)
+                    strings.append(value)
+                values(i)
+
+    def splice(self, start, stop, tokens):
+        '''
+        replace the tokens [start, stop) by tokens
+        '''
+        buf = TokenBuffer(self.filename)
+        buf.strings = self.strings
+        buf._interned = self._interned
+        buf.extend(tokens)
+        self.kinds[start:stop] = buf.kinds
+        self.lines[start:stop] = buf.lines
+        self.columns[start:stop] = buf.columns
+        self.values[start:stop] = buf.values
+        self.offsets[start:stop] = buf.offsets
+
+    # magic, lexer version, token count, string count, filename bytes, string bytes
+    HEADER = struct.Struct('<4sIIIII')
+    MAGIC = b'PCCT'
+
+    def to_bytes(self):
+        '''
+        compact binary form, the int columns are written as they are
+        '''
+        filename = self.filename.encode('utf-8', 'surrogatepass')
+        blob = ''.join(self.strings).encode('utf-8', 'surrogatepass')
+        lengths = array('i', [len(v) for v in self.strings])
+        parts = [TokenBuffer.HEADER.pack(TokenBuffer.MAGIC, LEXER_VERSION, len(self), len(self.strings), len(filename), len(blob)),
+                 filename]
+        for column in (self.kinds, self.lines, self.columns, self.values, self.offsets, lengths):
+            if sys.byteorder == 'big':
+                column = array('i', column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(blob)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, filename=None):
+        '''
+        load to_bytes output, filename replaces the stored one
+        '''
+        header = TokenBuffer.HEADER
+        magic, version, count, nstrings, nfilename, nblob = header.unpack_from(data, 0)
+        if magic != TokenBuffer.MAGIC or version != LEXER_VERSION:
+            raise ValueError('not a token buffer of lexer version {}'.format(LEXER_VERSION))
+        if len(data) != header.size + nfilename + 4 * (5 * count + nstrings) + nblob:
+            raise ValueError('token buffer of {} bytes does not match its header'.format(len(data)))
+        view = memoryview(data)
+        pos = header.size
+        stored = bytes(view[pos:pos + nfilename]).decode('utf-8', 'surrogatepass')
+        pos += nfilename
+        buf = cls(stored if filename is None else filename)
+        columns = []
+        for n in (count, count, count, count, count, nstrings):
+            column = array('i')
+            column.frombytes(view[pos:pos + 4 * n])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+            pos += 4 * n
+        buf.kinds, buf.lines, buf.columns, buf.values, buf.offsets, lengths = columns
+        blob = bytes(view[pos:pos + nblob]).decode('utf-8', 'surrogatepass')
+        strings = buf.strings
+        start = 0
+        for n in lengths:
+            strings.append(blob[start:start + n])
+            start += n
+        buf._interned = dict(zip(strings, range(nstrings)))
+        return buf
+
+    def kind(self, i):
+        return TOKEN_KINDS[self.kinds[i]]
+
+    def value(self, i):
+        v = self.values[i]
+        return None if v == -1 else self.strings[v]
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        '''
+        materialize one Token
+        '''
+        return Token(TOKEN_KINDS[self.kinds[i]], self.filename, self.lines[i], self.columns[i], self.value(i))
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
 
-    def __init__(self, finename, content):
+class ScanLexer(object):
+    '''
+    character by character lexer
+    '''
+
+    def __init__(self, finename, content, chunk_size=CHUNK_SIZE):
+        '''
+        content is the source string or a file object,
+        a file object is read chunk by chunk and only the unread window is kept
+        '''
         self.tokens = []
         self._pos = -1
         self._filename = finename
         self._line = 1
         self._column = 1
+        self._reader = None
+        self._chunk_size = chunk_size
+        if content is not None and hasattr(content, 'read'):
+            self._reader = content
+            content = ''
         self._content = content
         if content is None:
             self._current_char = None
@@ -99,9 +270,23 @@ class Lexer(object):
         s = 'position [{0}:{1}]: {2}'.format(self._line, self._column,e)
         raise Exception(s)
 
+    def _fill(self):
+        '''
+        drop the consumed part of the window and read the next chunk
+        '''
+        if self._reader is None:
+            return False
+        chunk = self._reader.read(self._chunk_size)
+        if not chunk:
+            self._reader = None
+            return False
+        self._content = self._content[self._pos:] + chunk
+        self._pos = 0
+        return True
+
     def _advance(self):
         self._pos += 1
-        if self._pos > len(self._content) - 1:
+        if self._pos > len(self._content) - 1 and not self._fill():
             self._current_char = None
         else:
             self._current_char = self._content[self._pos]
@@ -112,18 +297,16 @@ class Lexer(object):
                 self._column += 1
 
     def _peek(self):
-        peek_pos = self._pos + 1
-        if peek_pos > len(self._content) - 1:
+        if self._pos + 1 > len(self._content) - 1 and not self._fill():
             return None
         else:
-            return self._content[peek_pos]
+            return self._content[self._pos + 1]
 
     def _next_c(self, c):
-        peek_pos = self._pos + 1
-        if peek_pos > len(self._content) - 1:
+        if self._pos + 1 > len(self._content) - 1 and not self._fill():
             return False
         else:
-            if self._content[peek_pos] == c:
+            if self._content[self._pos + 1] == c:
                 self._advance()
                 return True
             else:
@@ -148,11 +331,12 @@ class Lexer(object):
         return False
 
     def _skip_line(self):
-        while self._current_char != '\n':
+        while self._current_char is not None and self._current_char != '\n':
             self._advance()
         self._advance()
 
     def _skip_block_comment(self):
+        self._advance() # the '*' of '/*' can not close the comment
         while True:
             if self._current_char is None:
                 self.error('premature end of block comment')
@@ -204,9 +388,11 @@ class Lexer(object):
 
     def _read_number(self):
         n = self._current_char
-        while self._peek().isdigit() or self._peek() == '.':
+        p = self._peek()
+        while not p is None and (p.isdigit() or p == '.'):
             self._advance()
             n += self._current_char
+            p = self._peek()
 
         if n.isdigit():
             self._make_token(TokenKind.TNUMBER, n)
@@ -218,9 +404,11 @@ class Lexer(object):
 
     def _read_ident(self):
         ident = self._current_char
-        while self._peek().isalnum() or self._peek() == '_' or self._peek() == '$':
+        p = self._peek()
+        while not p is None and (p.isalnum() or p == '_' or p == '$'):
             self._advance()
             ident += self._current_char
+            p = self._peek()
 
         keyword = KEYWORDS.get(ident, None)
         if keyword is None:
@@ -228,81 +416,102 @@ class Lexer(object):
         else:
             self._make_token(TokenKind.TKEYWORD, keyword)
 
+    def _lex_token(self):
+        '''
+        read the next token into self.tokens
+        '''
+        self._skip_blank()
+        if self._skip_comment():
+            return
+
+        if self._current_char is None or self._is_blank():
+            return
+
+        if self._current_char == '\\' and self._next_c('\n'):
+            return # line continuation
+        elif self._current_char == '#':
+            self.error('preprocessor directive, run the source through cpp.Preprocessor first')
+        elif self._current_char == ':':
+            self._make_token(TokenKind.TDELIMIT, ':')
+        elif self._current_char == '+':
+            self._read_rep2('+', '++', '=', '+=', '+')
+        elif self._current_char == '-':
+            if self._next_c('-'):
+                self._make_token(TokenKind.TOPERATE, '--')
+            elif self._next_c('>'):
+                self._make_token(TokenKind.TOPERATE, '->')
+            elif self._next_c('='):
+                self._make_token(TokenKind.TOPERATE, '-=')
+            else:
+                self._make_token(TokenKind.TOPERATE, '-')
+        elif self._current_char == '<':
+            if self._next_c('<'):
+                self._read_rep('=', '<<=', '<<')
+            else:
+                self._read_rep('=', '<=', '<')
+        elif self._current_char == '>':
+            if self._next_c('>'):
+                self._read_rep('=', '>>=', '>>')
+            else:
+                self._read_rep('=', '>=', '>')
+        elif self._current_char == '*':
+            self._read_rep('=', '*=' , '*')
+        elif self._current_char == '=':
+            self._read_rep('=', '==', '=')
+        elif self._current_char == '!':
+            self._read_rep('=', '!=', '!')
+        elif self._current_char == '&':
+            self._read_rep2('&', '&&', '=', '&=', '&')
+        elif self._current_char == '|':
+            self._read_rep2('|', '||', '=', '|=', '|')
+        elif self._current_char == '^':
+            self._read_rep('=', '^=', '^')
+        elif self._current_char == '%':
+            self._make_token(TokenKind.TOPERATE, '%')
+        elif self._current_char == '/':
+            self._read_rep('=', '/=', '/')
+        elif self._current_char == '\'':
+            self._read_char()
+        elif self._current_char == '"':
+            self._read_string()
+        elif self._current_char.isalpha() or self._current_char == '_' or self._current_char == '$':
+            self._read_ident()
+        elif self._current_char.isdigit():
+            self._read_number()
+        elif self._current_char == '.':
+            p = self._peek()
+            if not p is None and p.isdigit():
+                self._read_number()
+            elif self._next_c('.'):
+                self._read_rep('.', '...', '..')
+            else:
+                self._make_token(TokenKind.TOPERATE, '.')
+        elif self._current_char == '(' or self._current_char == ')' or self._current_char == '[' or self._current_char == ']' or self._current_char == '{' or self._current_char == '}' or self._current_char == ',' or self._current_char == ';' or self._current_char == '?' or self._current_char == '~':
+            self._make_token(TokenKind.TDELIMIT, self._current_char)
+        else:
+            self._make_token(TokenKind.TINVALID, None)
+            self.error('\'' + self._current_char + '\' ' + 'invalid character')
+
     def lex(self):
         while self._current_char is not None:
+            self._lex_token()
 
-            self._skip_blank()
-            if self._skip_comment():
-                continue
-
-            if self._current_char is None or self._is_blank():
-                continue
+        self._make_token(TokenKind.TEOF, None)
 
-            if self._current_char == '#':
-                #TODO
-                pass
-            elif self._current_char == ':':
-                #TODO
-                pass
-            elif self._current_char == '+':
-                self._read_rep2('+', '++', '=', '+=', '+')
-            elif self._current_char == '-':
-                if self._next_c('-'):
-                    self._make_token(TokenKind.TOPERATE, '--')
-                elif self._next_c('>'):
-                    self._make_token(TokenKind.TOPERATE, '->')
-                elif self._next_c('='):
-                    self._make_token(TokenKind.TOPERATE, '-=')
-                else:
-                    self._make_token(TokenKind.TOPERATE, '-')
-            elif self._current_char == '<':
-                if self._next_c('<'):
-                    self._read_rep('=', '<<=', '<<')
-                else:
-                    self._read_rep('=', '<=', '<')
-            elif self._current_char == '>':
-                if self._next_c('>'):
-                    self._read_rep('=', '>>=', '>>')
-                else:
-                    self._read_rep('=', '>=', '>')
-            elif self._current_char == '*':
-                self._read_rep('=', '*=' , '*')
-            elif self._current_char == '=':
-                self._read_rep('=', '==', '=')
-            elif self._current_char == '!':
-                self._read_rep('=', '!=', '!')
-            elif self._current_char == '&':
-                self._read_rep2('&', '&&', '=', '&=', '&')
-            elif self._current_char == '|':
-                self._read_rep2('|', '||', '=', '|=', '|')
-            elif self._current_char == '^':
-                self._read_rep('=', '^=', '^')
-            elif self._current_char == '%':
-                self._make_token(TokenKind.TOPERATE, '%')
-            elif self._current_char == '/':
-                self._read_rep('=', '/=', '/')
-            elif self._current_char == '\'':
-                self._read_char()
-            elif self._current_char == '"':
-                self._read_string()
-            elif self._current_char.isalpha() or self._current_char == '_' or self._current_char == '$':
-                self._read_ident()
-            elif self._current_char.isdigit():
-                self._read_number()
-            elif self._current_char == '.':
-                if self._peek().isdigit():
-                    self._read_number()
-                else:
-                    if self._next_c('.'):
-                        self._read_rep('.', '...', '..')
-                self._make_token(TokenKind.TOPERATE, '.')
-            elif self._current_char == '(' or self._current_char == ')' or self._current_char == '[' or self._current_char == ']' or self._current_char == '{' or self._current_char == '}' or self._current_char == ',' or self._current_char == ';' or self._current_char == '?' or self._current_char == '~':
-                self._make_token(TokenKind.TDELIMIT, self._current_char)
-            else:
-                self._make_token(TokenKind.TINVALID, None)
-                self.error('\'' + self._current_char + '\' ' + 'invalid character')
+    def iter_tokens(self):
+        '''
+        streaming mode of lex, yield the tokens lazily.
+        self.tokens only holds the tokens of the current step
+        '''
+        tokens = self.tokens
+        while self._current_char is not None:
+            self._lex_token()
+            for t in tokens:
+                yield t
+            del tokens[:]
 
         self._make_token(TokenKind.TEOF, None)
+        yield tokens.pop()
 
     def see_tokens(self):
         for t in self.tokens:
@@ -310,3 +519,266 @@ class Lexer(object):
 
 
 
+
+# master pattern, blanks and comments are skipped in front of every token
+TOKEN_PATTERN = r'''
+    (?:[ \t\r\n]+|\\\r?\n|//[^\n]*|/\*.*?\*/)*
+    (?:
+        (?P<ident>IDENT)
+      | (?P<number>\.?\d[\d.]*)
+      | (?P<char>'CHAR')
+      | (?P<string>"[^"]*")
+      | (?P<badchar>')
+      | (?P<badstring>")
+      | (?P<badcomment>/\*)
+      | (?P<op><<=|>>=|\.\.\.|\+\+|\+=|--|->|-=|<<|<=|>>|>=|\*=|==|!=
+            |&&|&=|\|\||\|=|\^=|/=|\.\.|[-+<>*=!&|^%/.])
+      | (?P<delim>[()\[\]{},;?~:])
+      | (?P<hash>\#\#?)
+      | (?P<eof>\Z)
+      | (?P<invalid>.)
+    )'''
+
+TOKEN_RE = re.compile(TOKEN_PATTERN.replace('IDENT', r'(?:[^\W\d]|\$)[\w$]*').replace('CHAR', '.'), re.S | re.X)
+
+# bytes and mmap sources, bytes above 0x7f are part of utf-8 identifiers,
+# a char literal holds one whole utf-8 sequence
+TOKEN_BYTES_RE = re.compile(TOKEN_PATTERN.replace('IDENT', r'[A-Za-z_$\x80-\xff][\w$\x80-\xff]*')
+                            .replace('CHAR', r'(?:[\xc0-\xf7][\x80-\xbf]+|.)').encode('latin-1'), re.S | re.X)
+
+# groups which may be completed by the next chunk of a file object
+PARTIAL_GROUPS = ('badchar', 'badstring', 'badcomment', 'invalid') # invalid may be a split line continuation
+
+class RegexLexer(object):
+    '''
+    lexer matching one master regular expression per token,
+    produces the same tokens as ScanLexer
+    '''
+
+    def __init__(self, finename, content, chunk_size=CHUNK_SIZE, directives=False):
+        '''
+        content is the source string, utf-8 bytes, a mmap or a file object.
+        a file object is read chunk by chunk and only the unread window is kept,
+        bytes are never decoded as a whole, only the value of each token is.
+        with directives '#' and '##' are TOPERATE tokens for the preprocessor
+        '''
+        self.tokens = TokenBuffer(finename)
+        self._directives = directives
+        self._filename = finename
+        self._line = 1
+        self._column = 1
+        self._reader = None
+        self._chunk_size = chunk_size
+        if content is not None and hasattr(content, 'read'):
+            self._reader = content
+            content = ''
+        self._content = '' if content is None else content
+        self._mapped = None # mmap opened by from_file
+
+    @classmethod
+    def from_file(cls, path, finename=None):
+        '''
+        lex a file through a read only mmap of it
+        '''
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                mapped = None # empty file can not be mapped
+        lexer = cls(path if finename is None else finename, b'' if mapped is None else mapped)
+        lexer._mapped = mapped
+        return lexer
+
+    def error(self, e):
+        s = 'position [{0}:{1}]: {2}'.format(self._line, self._column,e)
+        raise Exception(s)
+
+    def _read(self):
+        if self._reader is None:
+            return ''
+        chunk = self._reader.read(self._chunk_size)
+        if not chunk:
+            self._reader = None
+        return chunk
+
+    def lex(self):
+        '''
+        lex the whole input into the compact self.tokens buffer
+        '''
+        self.tokens.extend(self._scan())
+
+    def iter_tokens(self):
+        '''
+        yield the tokens lazily, a file object is read as the tokens are consumed
+        '''
+        filename = self._filename
+        for kind, line, column, value, offset in self._scan():
+            yield Token(kind, filename, line, column, value)
+
+    def _scan(self, pos=0, line=1, nl=-1):
+        '''
+        yield (kind, line, column, value, offset) of every token.
+        scanning a string may start at pos, line is the line of pos and
+        nl the offset of the last newline before it
+        '''
+        try:
+            for t in self._scan_text(pos, line, nl):
+                yield t
+        finally:
+            if not self._mapped is None:
+                self._mapped.close()
+                self._mapped = None
+
+    def _scan_text(self, pos, line, nl):
+        keywords = KEYWORDS
+        TIDENT, TKEYWORD, TOPERATE, TDELIMIT = TokenKind.TIDENT, TokenKind.TKEYWORD, TokenKind.TOPERATE, TokenKind.TDELIMIT
+        text = self._content if self._reader is None else self._read()
+        self._content = None
+
+        binary = not isinstance(text, str)
+        if binary:
+            match = TOKEN_BYTES_RE.match
+            newline = b'\n'
+        else:
+            match = TOKEN_RE.match
+            newline = '\n'
+        count = getattr(text, 'count', None) # mmap has no count
+
+        base = 0 # source offset of text[0]
+        # nl is the index of the last newline seen, token column is counted from it
+        while True:
+            m = match(text, pos)
+            kind = m.lastgroup
+            end = m.end()
+            if not self._reader is None and (end == len(text) or kind in PARTIAL_GROUPS):
+                # the token may continue in the next chunk
+                text = text[pos:] + self._read()
+                count = text.count
+                nl -= pos
+                base += pos
+                pos = 0
+                continue
+
+            if count is None:
+                span = m.group(0)
+                n = span.count(newline)
+                if n:
+                    line += n
+                    nl = pos + span.rindex(newline)
+            else:
+                n = count(newline, pos, end)
+                if n:
+                    line += n
+                    nl = text.rindex(newline, pos, end)
+            pos = end
+
+            value = m.group(kind)
+            if binary:
+                value = value.decode('utf-8', 'replace')
+            if kind == 'ident':
+                keyword = keywords.get(value, None)
+                if keyword is None:
+                    yield (TIDENT, line, end - nl, value, base + m.start(kind))
+                else:
+                    yield (TKEYWORD, line, end - nl, keyword, base + m.start(kind))
+            elif kind == 'op':
+                yield (TOPERATE, line, end - nl, value, base + m.start(kind))
+            elif kind == 'delim':
+                yield (TDELIMIT, line, end - nl, value, base + m.start(kind))
+            elif kind == 'number':
+                if not value.isdigit() and value.count('.') != 1:
+                    self._line, self._column = line, end - nl
+                    self.error('error number format')
+                yield (TokenKind.TNUMBER, line, end - nl, value, base + m.start(kind))
+            elif kind == 'string':
+                yield (TokenKind.TSTRING, line, end - nl, value[1:-1], base + m.start(kind))
+            elif kind == 'char':
+                yield (TokenKind.TCHAR, line, end - nl, value[1], base + m.start(kind))
+            elif kind == 'eof':
+                yield (TokenKind.TEOF, line, end - nl, None, base + m.start(kind))
+                return
+            elif kind == 'hash' and self._directives:
+                yield (TOPERATE, line, end - nl, value, base + m.start(kind))
+            else:
+                self._line, self._column = line, end - nl
+                if kind == 'badchar':
+                    self.error('unterminated char')
+                elif kind == 'badstring':
+                    self.error('unterminated string')
+                elif kind == 'badcomment':
+                    self.error('premature end of block comment')
+                elif kind == 'hash':
+                    self.error('preprocessor directive, run the source through cpp.Preprocessor first')
+                self.error('\'' + value + '\' ' + 'invalid character')
+
+    def see_tokens(self):
+        for t in self.tokens:
+            print(t)
+
+# default engine, compare with test/bench_lex.py
+Lexer = RegexLexer
+
+def relex(tokens, text, offset, removed, inserted):
+    '''
+    apply an edit to text, the source of the TokenBuffer tokens, and re-lex
+    only the damaged tokens. tokens are updated in place.
+    return (new text, first, old_stop, new_stop): the old tokens
+    [first, old_stop) were replaced by the new tokens [first, new_stop)
+    '''
+    new_text = text[:offset] + inserted + text[offset + removed:]
+    delta = len(inserted) - removed
+    edit_end = offset + len(inserted)
+    offsets = tokens.offsets
+    count = len(tokens)
+
+    first = max(0, bisect_right(offsets, offset) - 1 - RELEX_BACK)
+    start = offsets[first] if count else 0
+    nl = new_text.rfind('\n', 0, start)
+    line = new_text.count('\n', 0, start) + 1
+
+    lexer = RegexLexer(tokens.filename, new_text)
+    new = []
+    j = first # the old token the new one may line up with
+    for t in lexer._scan(start, line, nl):
+        kind, line, column, value, off = t
+        if off >= edit_end:
+            old_off = off - delta
+            while j < count and offsets[j] < old_off:
+                j += 1
+            if j < count and offsets[j] == old_off and tokens.kinds[j] == kind.value and tokens.value(j) == value:
+                break
+        new.append(t)
+
+    # the old tokens from j on are unchanged, only shifted
+    lines, columns = tokens.lines, tokens.columns
+    line_delta = line - lines[j]
+    column_delta = column - columns[j]
+    edit_line = lines[j]
+    for i in range(j, count):
+        if lines[i] != edit_line:
+            break
+        columns[i] += column_delta
+    if line_delta:
+        lines[j:] = array('i', [l + line_delta for l in lines[j:]])
+    if delta:
+        offsets[j:] = array('i', [o + delta for o in offsets[j:]])
+
+    tokens.splice(first, j, new)
+    return new_text, first, j, first + len(new)
+
+def lex_cached(filename, content, cache):
+    '''
+    lex content (str or bytes) into a TokenBuffer through a DiskCache,
+    keyed by the content hash and the lexer version
+    '''
+    key = content_key(content, 'tokens', LEXER_VERSION)
+    data = cache.get(key)
+    if not data is None:
+        try:
+            return TokenBuffer.from_bytes(data, filename)
+        except (ValueError, struct.error):
+            pass # damaged entry, lex again
+    lexer = RegexLexer(filename, content)
+    lexer.lex()
+    cache.put(key, lexer.tokens.to_bytes())
+    return lexer.tokens
@@ -0,0 +1,418 @@
+'''
+Copyright 2018 JackLiang.
+
+scalar optimization passes over the ir
+'''
+import time
+import struct
+from ctype import TypeKind
+from eval import Eval
+from ir import *
+
+# lattice of a register in constant propagation: absent is not yet
+# known (top), a value is a constant, VARYING is not a constant
+VARYING = object()
+
+# passes repeat at -O2 until nothing changes, at most this often
+MAX_ROUNDS = 8
+
+FLOAT_COMPARES = {
+    Op.EQ: lambda a, b: a == b,
+    Op.NE: lambda a, b: a != b,
+    Op.LT: lambda a, b: a < b,
+    Op.LE: lambda a, b: a <= b,
+    Op.GT: lambda a, b: a > b,
+    Op.GE: lambda a, b: a >= b,
+}
+
+class ConstFolder(object):
+    '''
+    the value of an instruction from the values of its operands
+    '''
+
+    def __init__(self, func):
+        self._types = func.types
+        self._ev = Eval()
+
+    def _float(self, v, ty):
+        if ty.kind == TypeKind.FLOAT:
+            return struct.unpack('<f', struct.pack('<f', v))[0]
+        return v
+
+    def convert(self, v, src, dst):
+        ev = self._ev
+        if is_float(dst):
+            return self._float(float(v), dst)
+        if is_float(src):
+            if v != v or v in (float('inf'), float('-inf')):
+                return VARYING
+            v = int(v) # truncates toward zero
+        if dst.kind == TypeKind.BOOL:
+            return int(v != 0)
+        return ev.wrap_type(v, dst)
+
+    def fold(self, ins, values):
+        '''
+        value of ins, values are the values of its operands
+        '''
+        op = ins.op
+        types = self._types
+        ty = types[ins.dst]
+        if op == Op.COPY:
+            return values[0]
+        if op == Op.CONV:
+            return self.convert(values[0], types[ins.a], ty)
+        if op == Op.NOT:
+            return int(values[0] == 0)
+        if op == Op.NEG:
+            if is_float(ty):
+                return -values[0]
+            return self._ev.wrap_type(-values[0], ty)
+        aty = types[ins.a]
+        a, b = values
+        if is_float(aty):
+            if op in COMPARE_OPS:
+                return int(FLOAT_COMPARES[op](a, b))
+            if op == Op.ADD:
+                return self._float(a + b, ty)
+            if op == Op.SUB:
+                return self._float(a - b, ty)
+            if op == Op.MUL:
+                return self._float(a * b, ty)
+            if op == Op.DIV and b != 0:
+                return self._float(a / b, ty)
+            return VARYING
+        if op in COMPARE_OPS:
+            bits, usig = self._ev.common(aty, types[ins.b])
+        else:
+            bits, usig = max(ty.size, 4) * 8, ty.usig
+        v = self._ev.arith(NODE_KINDS[op], a, b, bits, usig)
+        return VARYING if v is None else v
+
+def _value(ins, state, folder):
+    op = ins.op
+    if op == Op.CONST:
+        return ins.a
+    if op == Op.ARG:
+        return VARYING
+    values = []
+    for r in ins.uses():
+        v = state.get(r, None)
+        if v is None:
+            return None
+        if v is VARYING:
+            return VARYING
+        values.append(v)
+    return folder.fold(ins, values)
+
+def _meet(states):
+    state = {}
+    for s in states:
+        for r, v in s.items():
+            old = state.get(r, None)
+            if old is None:
+                state[r] = v
+            elif not old is VARYING and (v is VARYING or old != v or type(old) != type(v)):
+                state[r] = VARYING
+    return state
+
+def propagate_constants(func):
+    '''
+    sparse conditional constant propagation: the blocks are visited as
+    the branches reach them, a branch on a constant reaches one side
+    only. instructions of a constant value become CONST, branches on
+    a constant become jumps
+    '''
+    folder = ConstFolder(func)
+    blocks = func.blocks
+    outs = [None] * len(blocks) # None until the block is reached
+    edges = set() # (pred, succ) taken
+    work = [0]
+    while work:
+        b = blocks[work.pop()]
+        state = _meet(outs[p.id] for p in b.preds if (p.id, b.id) in edges)
+        for ins in b.ins:
+            if not ins.op in TERMINATORS:
+                v = _value(ins, state, folder)
+                if v is None:
+                    state.pop(ins.dst, None)
+                else:
+                    state[ins.dst] = v
+        term = b.ins[-1]
+        if term.op == Op.BR:
+            cond = state.get(term.a, None)
+            if cond is None:
+                targets = ()
+            elif cond is VARYING:
+                targets = (term.b, term.c)
+            else:
+                targets = (term.b if cond else term.c,)
+        else:
+            targets = term.targets()
+        changed = outs[b.id] != state
+        outs[b.id] = state
+        for t in targets:
+            if changed or not (b.id, t) in edges:
+                edges.add((b.id, t))
+                if not t in work:
+                    work.append(t)
+    changed = False
+    for b in blocks:
+        if outs[b.id] is None:
+            continue
+        state = _meet(outs[p.id] for p in b.preds if (p.id, b.id) in edges)
+        for i, ins in enumerate(b.ins):
+            if ins.op in TERMINATORS:
+                if ins.op == Op.BR:
+                    cond = state.get(ins.a, VARYING)
+                    if not cond is VARYING:
+                        b.ins[i] = Ins(Op.JMP, None, ins.b if cond else ins.c)
+                        changed = True
+                continue
+            v = _value(ins, state, folder)
+            if v is None:
+                state.pop(ins.dst, None)
+                continue
+            state[ins.dst] = v
+            if not v is VARYING and ins.op != Op.CONST:
+                b.ins[i] = Ins(Op.CONST, ins.dst, v)
+                changed = True
+    if changed:
+        func.renumber()
+    return changed
+
+def propagate_copies(func):
+    '''
+    a read of the destination of a copy reads its source instead while
+    neither is written again, on every path to the read
+    '''
+    blocks = func.rpo()
+    outs = {}
+    def entry_state(b):
+        states = [outs[p.id] for p in b.preds if p.id in outs]
+        if not states:
+            return {}
+        state = dict(states[0])
+        for s in states[1:]:
+            for r in list(state):
+                if s.get(r, None) != state[r]:
+                    del state[r]
+        return state
+    def transfer(b, state, rewrite):
+        changed = False
+        for ins in b.ins:
+            if rewrite:
+                for attr in ('a', 'b') if ins.op in BINARY else ('a',):
+                    r = getattr(ins, attr)
+                    if r in state and r in ins.uses():
+                        setattr(ins, attr, state[r])
+                        changed = True
+            if ins.op in TERMINATORS:
+                continue
+            dst = ins.dst
+            state.pop(dst, None)
+            for r in [r for r, s in state.items() if s == dst]:
+                del state[r]
+            if ins.op == Op.COPY and ins.a != dst:
+                state[dst] = state.get(ins.a, ins.a)
+        return changed
+    done = False
+    while not done:
+        done = True
+        for b in blocks:
+            state = entry_state(b)
+            transfer(b, state, False)
+            if outs.get(b.id, None) != state:
+                outs[b.id] = state
+                done = False
+    changed = False
+    for b in blocks:
+        changed = transfer(b, entry_state(b), True) or changed
+    return changed
+
+def liveness(func):
+    '''
+    registers live at the exit of every block, by block number
+    '''
+    uses, defs = [], []
+    for b in func.blocks:
+        use, kill = set(), set()
+        for ins in b.ins:
+            for r in ins.uses():
+                if not r in kill:
+                    use.add(r)
+            if not ins.op in TERMINATORS:
+                kill.add(ins.dst)
+        uses.append(use)
+        defs.append(kill)
+    live_in = [set() for b in func.blocks]
+    live_out = [set() for b in func.blocks]
+    done = False
+    while not done:
+        done = True
+        for b in reversed(func.blocks):
+            out = set()
+            for s in b.succs:
+                out |= live_in[s.id]
+            live_out[b.id] = out
+            new = uses[b.id] | (out - defs[b.id])
+            if new != live_in[b.id]:
+                live_in[b.id] = new
+                done = False
+    return live_out
+
+def eliminate_dead_code(func):
+    '''
+    drop the instructions whose result is never read, stores to a
+    variable that is not read again are dead too
+    '''
+    changed = False
+    while True:
+        live_out = liveness(func)
+        removed = False
+        for b in func.blocks:
+            live = set(live_out[b.id])
+            kept = []
+            for ins in reversed(b.ins):
+                if not ins.op in TERMINATORS and ins.op != Op.ARG and not ins.dst in live:
+                    removed = True
+                    continue
+                if not ins.op in TERMINATORS:
+                    live.discard(ins.dst)
+                live.update(ins.uses())
+                kept.append(ins)
+            kept.reverse()
+            b.ins = kept
+        if not removed:
+            return changed
+        changed = True
+
+def simplify_cfg(func):
+    '''
+    branches to one block become jumps, jumps to a block of a single
+    jump go to its target, a block is merged into its only predecessor
+    and unreachable blocks are dropped
+    '''
+    changed = False
+    blocks = func.blocks
+    def forward(t):
+        seen = set()
+        while len(blocks[t].ins) == 1 and blocks[t].ins[0].op == Op.JMP and not t in seen:
+            seen.add(t)
+            t = blocks[t].ins[0].a
+        return t
+    for b in blocks:
+        term = b.ins[-1]
+        if term.op == Op.JMP:
+            t = forward(term.a)
+            if t != term.a:
+                term.a = t
+                changed = True
+        elif term.op == Op.BR:
+            t, f = forward(term.b), forward(term.c)
+            if t == f:
+                b.ins[-1] = Ins(Op.JMP, None, t)
+                changed = True
+            elif t != term.b or f != term.c:
+                term.b, term.c = t, f
+                changed = True
+    n = len(blocks)
+    func.renumber() # the blocks jumped over may be unreachable now
+    blocks = func.blocks
+    for b in blocks:
+        while True:
+            term = b.ins[-1]
+            if term.op != Op.JMP or term.a == b.id or term.a == 0:
+                break
+            succ = blocks[term.a]
+            if len(succ.preds) != 1:
+                break
+            b.ins.pop()
+            b.ins.extend(succ.ins)
+            b.succs = succ.succs
+            for s in succ.succs:
+                s.preds = [b if p is succ else p for p in s.preds]
+            succ.ins = [Ins(Op.JMP, None, succ.id)] # unreachable now
+            succ.preds = []
+            succ.succs = []
+            changed = True
+    func.renumber()
+    return changed or len(func.blocks) != n
+
+PASSES = {
+    'sccp': propagate_constants,
+    'copyprop': propagate_copies,
+    'dce': eliminate_dead_code,
+    'simplifycfg': simplify_cfg,
+}
+
+LEVELS = {
+    0: (),
+    1: ('sccp', 'dce', 'simplifycfg'),
+    2: ('sccp', 'copyprop', 'dce', 'simplifycfg'),
+}
+
+class PassStats(object):
+    __slots__ = ('runs', 'changes', 'time', 'removed')
+
+    def __init__(self):
+        self.runs = 0
+        self.changes = 0
+        self.time = 0.0
+        self.removed = 0 # instructions, negative when the pass adds some
+
+class PassManager(object):
+    '''
+    runs the passes of an optimization level over functions, -O2
+    repeats them until the function no longer changes. stats keep the
+    time and the change of the instruction count of every pass
+    '''
+
+    def __init__(self, level=1, verify=False):
+        if not level in LEVELS:
+            raise Exception('unknown optimization level {0}'.format(level))
+        self.level = level
+        self.passes = LEVELS[level]
+        self.verify = verify # ir.verify after every pass
+        self.stats = dict((name, PassStats()) for name in self.passes)
+
+    def run_pass(self, name, func):
+        stats = self.stats[name]
+        size = func.size()
+        start = time.perf_counter()
+        changed = PASSES[name](func)
+        stats.time += time.perf_counter() - start
+        stats.runs += 1
+        stats.removed += size - func.size()
+        if changed:
+            stats.changes += 1
+        if self.verify:
+            verify(func)
+        return changed
+
+    def run(self, func):
+        rounds = MAX_ROUNDS if self.level >= 2 else 1
+        for i in range(rounds):
+            changed = False
+            for name in self.passes:
+                changed = self.run_pass(name, func) or changed
+            if not changed:
+                break
+        return func
+
+    def report(self):
+        '''
+        lines of the time and instructions removed by every pass
+        '''
+        lines = ['-O{0}'.format(self.level)]
+        for name in self.passes:
+            s = self.stats[name]
+            lines.append('  {:<12} {:>6} runs {:>6} changed {:>8} removed {:.3f}s'.format(
+                name, s.runs, s.changes, s.removed, s.time))
+        return lines
+
+def optimize(funcs, level=1):
+    pm = PassManager(level)
+    for func in funcs:
+        pm.run(func)
+    return pm
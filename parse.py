@@ -4,10 +4,14 @@ Copyright 2018 JackLiang.
 parse grammer
 '''
 from enum import Enum, unique
-from lex import TokenKind
+from array import array
+from bisect import bisect_right
+from collections import deque
+from lex import TokenKind, TokenBuffer
 from ctype import *
 from csymbol import *
 from astc import *
+from eval import Eval
 
 @unique
 class DeclType(Enum):
@@ -16,11 +20,108 @@ class DeclType(Enum):
     PARAM_TYPE_ONLY = 3
     CAST = 4
 
+class TokenRing(object):
+    '''
+    bounded lookahead window over a token stream.
+    it indexes like the token list, tokens before the released
+    position are dropped so memory follows the lookahead depth.
+    with keep the location of every token is kept, in int columns,
+    otherwise only the locations pinned by a node.
+    locations (lines, columns, files, filenames) of tokens read before,
+    like a precompiled header, put the stream after them
+    '''
+
+    def __init__(self, stream, locations=None, keep=False):
+        self._stream = iter(stream)
+        self._window = deque()
+        self._base = 0 # index of the first token in window
+        self._eof = None
+        self.keep = keep
+
+        self.lines = array('i')
+        self.columns = array('i')
+        self.files = array('i') # index of self.filenames
+        self.filenames = []
+        self._file_index = {}
+        self._pinned = {} # token index -> (line, column, file) without keep
+        if not locations is None:
+            lines, columns, files, filenames = locations
+            self.lines.extend(lines)
+            self.columns.extend(columns)
+            self.files.extend(files)
+            self.filenames.extend(filenames)
+            self._file_index = dict((name, i) for i, name in enumerate(filenames))
+            self._base = len(lines)
+
+    def _file(self, name):
+        f = self._file_index.get(name, None)
+        if f is None:
+            f = self._file_index[name] = len(self.filenames)
+            self.filenames.append(name)
+        return f
+
+    def _pull(self, index):
+        while index - self._base >= len(self._window):
+            if not self._eof is None:
+                return False
+            t = next(self._stream)
+            if t.kind == TokenKind.TEOF:
+                self._eof = t
+            self._window.append(t)
+            if self.keep:
+                self.lines.append(t.line)
+                self.columns.append(t.column)
+                self.files.append(self._file(t.filename))
+        return True
+
+    def pin(self, index):
+        '''
+        keep the location of the token index after it is released
+        '''
+        if self.keep or index is None or index < len(self.lines) or index in self._pinned:
+            return
+        t = self[index]
+        self._pinned[index] = (t.line, t.column, self._file(t.filename))
+
+    def location(self, index):
+        if index < len(self.lines):
+            return Coordinate(self.filenames[self.files[index]], self.lines[index], self.columns[index])
+        loc = self._pinned.get(index, None)
+        if loc is None:
+            t = self[index]
+            return Coordinate(t.filename, t.line, t.column)
+        line, column, f = loc
+        return Coordinate(self.filenames[f], line, column)
+
+    def __getitem__(self, index):
+        i = index - self._base
+        if i >= 0 and i < len(self._window):
+            return self._window[i]
+        if index == -1:
+            self._pull(float('inf'))
+            return self._window[-1]
+        if index < self._base:
+            raise Exception('internal error: token {} already released'.format(index))
+        if not self._pull(index):
+            raise IndexError(index)
+        return self._window[index - self._base]
+
+    def release(self, index):
+        '''
+        drop the tokens before index
+        '''
+        window = self._window
+        while self._base < index and len(window) > 1:
+            window.popleft()
+            self._base += 1
+
 class Parser(object):
     '''
     C89 BNF
     '''
 
+    KEEP_TOKENS = 2 # tokens kept behind the position for _back
+
     TYPETOKENS = [
         'K_VOID',
         'K_SHORT',
@@ -36,21 +137,38 @@ class Parser(object):
         'K_ENUM'
     ]
 
-    def __init__(self, tokens):
-        self._tokens = tokens
-        self._pos = -1
+    def __init__(self, tokens, sm=None, ast=None, fold=True):
+        '''
+        tokens is a token list, a TokenBuffer, a TokenRing or a token stream like Lexer.iter_tokens().
+        sm and ast are the state to go on from, see pch.Snapshot.
+        with fold the constant integer expressions become a single ValueNode
+        '''
+        if isinstance(tokens, list) or isinstance(tokens, TokenBuffer):
+            self._tokens = tokens
+            self._release = None
+        else:
+            if not isinstance(tokens, TokenRing):
+                tokens = TokenRing(tokens)
+            self._tokens = tokens
+            self._release = self._tokens.release
+        self._compact = isinstance(tokens, TokenBuffer) # read kind and value without a Token
+        self._first = tokens._base if isinstance(tokens, TokenRing) else 0 # index of the first token
+        self._pos = self._first - 1
         self._is_record = False
         self._record = 0 #for rollback step
-        self._current_token = None
-        self._sourceloc = None
+        self._sourceloc = None # token index
 
         self._localvars = None # store the local variant
 
         self._tm = TypeMaker() #make type
-        self._sm = SymbolManager() #Symbol Manager
-        self._nf = NodeFactory(self._sm)
+        self._sm = SymbolManager() if sm is None else sm #Symbol Manager
+        self._nf = NodeFactory(self._sm, Eval() if fold else None)
+        if not self._release is None and not tokens.keep:
+            self._nf.pin = tokens.pin
 
-        self.ast = [] # AST
+        self.ast = [] if ast is None else ast # AST
+        self.items = array('i') # first token of every top-level declaration
+        self.item_nodes = array('i') # first AST index of every top-level declaration
 
     def _error(self, e, is_token=True):
         if is_token:
@@ -62,59 +180,98 @@ class Parser(object):
     def _warning(self):
         pass
 
-    def _advance(self):
-        if self._pos >= len(self._tokens) - 1:
-            self._pos = len(self._tokens) - 1
-        else:
+    @property
+    def _current_token(self):
+        return self._tokens[self._pos] if self._pos >= self._first else None
+
+    def _at(self, index):
+        try:
+            return self._tokens[index]
+        except IndexError:
+            return self._tokens[-1]
+
+    def _kind_at(self, index):
+        if self._compact:
+            tokens = self._tokens
+            return tokens.kind(index if index < len(tokens) else -1)
+        return self._at(index).kind
+
+    def _value_at(self, index):
+        if self._compact:
+            tokens = self._tokens
+            return tokens.value(index if index < len(tokens) else -1)
+        return self._at(index).value
+
+    def location(self, index):
+        '''
+        source location of a token index, nodes keep the index in sourceloc
+        '''
+        if index is None:
+            return None
+        tokens = self._tokens
+        if self._compact:
+            return Coordinate(tokens.filename, tokens.lines[index], tokens.columns[index])
+        if not self._release is None:
+            return tokens.location(index)
+        token = tokens[index]
+        return Coordinate(token.filename, token.line, token.column)
+
+    def _skip(self):
+        '''
+        move to the next token without materializing it, stay on the last token
+        '''
+        if self._pos < self._first or self._kind_at(self._pos) != TokenKind.TEOF:
             self._pos += 1
             if self._is_record:
                 self._record += 1
-        self._current_token = self._tokens[self._pos]
+            elif not self._release is None:
+                self._release(self._pos - Parser.KEEP_TOKENS)
 
-        self._sourceloc = Coordinate(self._current_token.filename, self._current_token.line, self._current_token.column)
-        self._nf.sl = self._sourceloc
+        self._sourceloc = self._pos
+        self._nf.sl = self._pos
 
-        return self._current_token
+    def _advance(self):
+        '''
+        move to the next token, return its (kind, value) without a Token
+        '''
+        self._skip()
+        return self._kind_at(self._pos), self._value_at(self._pos)
+
+    @property
+    def _current_value(self):
+        return self._value_at(self._pos) if self._pos >= self._first else None
 
     def _back(self):
-        if self._pos > -1:
+        if self._pos >= self._first:
             self._pos -= 1
-            self._current_token = self._tokens[self._pos]
 
 
     def _rollback(self, i=1):
         self._pos -= self._record
-        self._current_token = self._tokens[self._pos]
         self._record = 0
         self._is_record = False
 
-    def _peek(self, i=1):
-        if self._pos + i <= len(self._tokens) - 1:
-            peek_pos = self._pos + i
-            token = self._tokens[peek_pos]
-            return token
-        else:
-            return self._tokens[len(self._tokens) - 1]
+    def _peek_kind(self, i=1):
+        return self._kind_at(self._pos + i)
+
+    def _peek_value(self, i=1):
+        return self._value_at(self._pos + i)
 
     def _next_t(self, value):
-        token = self._peek()
-        if token.value == value:
-            self._advance()
+        if self._peek_value() == value:
+            self._skip()
             return True
         return False
 
     def _expect(self, c):
-        c_t = self._advance()
-        if c != c_t.value:
-            self._error('[{}] expected,but got {}'.format(c, c_t.value))
+        kind, value = self._advance()
+        if c != value:
+            self._error('[{}] expected,but got {}'.format(c, value))
 
-    def _is_type(self, token):
-        if token.kind != TokenKind.TKEYWORD:
+    def _peek_is_type(self, i=1):
+        if self._peek_kind(i) != TokenKind.TKEYWORD:
             return False
-        for value in Parser.TYPETOKENS:
-            if value == token.value:
-                return True
-        return False
+        return self._peek_value(i) in Parser.TYPETOKENS
 
     def _is_funcdef(self):
         '''
@@ -123,19 +280,21 @@ class Parser(object):
         self._is_record = True
         r = False
         while True:
-            c_t = self._advance()
-            if c_t.kind == TokenKind.TEOF:
+            self._skip()
+            kind = self._kind_at(self._pos)
+            value = self._value_at(self._pos)
+            if kind == TokenKind.TEOF:
                 self._error('premature end of input')
-            if c_t.value == ';':
+            if value == ';':
                 break
-            if self._is_type(c_t):
+            if kind == TokenKind.TKEYWORD and value in Parser.TYPETOKENS:
                 continue
-            if c_t.value == '(':
+            if value == '(':
                 self._skip_parenteses()
                 continue
-            if c_t.kind == TokenKind.TIDENT:
+            if kind == TokenKind.TIDENT:
                 continue
-            if c_t.value == '{':
+            if value == '{':
                 r = True
                 break
 
@@ -144,12 +303,13 @@ class Parser(object):
 
     def _skip_parenteses(self):
         while True:
-            c_t = self._advance()
-            if c_t.kind == TokenKind.TEOF:
+            self._skip()
+            if self._kind_at(self._pos) == TokenKind.TEOF:
                 self._error('premature end of input')
-            if c_t.value == ')':
+            value = self._value_at(self._pos)
+            if value == ')':
                 break
-            if c_t.value == '(':
+            if value == '(':
                 self._skip_parenteses()
 
     def _skip_type_qualifiers(self):
@@ -165,13 +325,13 @@ class Parser(object):
     def _ensure_arithtype(self, node):
         ty = node.ty
         if not ty.is_arithtype():
-            self._error('arithmetic type expected,but got {}'.format(self._current_token.value))
+            self._error('arithmetic type expected,but got {}'.format(self._current_value))
 
     def _ensure_lvalue(self, node):
         kind = node.kind
         if kind == NodeKind.AST_LVAR or kind == NodeKind.AST_GVAR or kind == NodeKind.AST_DEREF or kind == NodeKind.AST_STRUCT_REF:
             return
-        self._error('lvalue expected,but got {}'.format(self._current_token.value))
+        self._error('lvalue expected,but got {}'.format(self._current_value))
 
     def _conv(self, node):
         '''
@@ -208,8 +368,8 @@ class Parser(object):
         declaration specifiers
         '''
         #TODO not finish
-        if not self._is_type(self._peek()):
-            self._error('type name expected, but got {}'.format(self._current_token.value))
+        if not self._peek_is_type():
+            self._error('type name expected, but got {}'.format(self._current_value))
 
         kind = -1
         scalss = -1
@@ -217,72 +377,72 @@ class Parser(object):
         err = False
 
         while True:
-            c_t = self._advance()
-            if c_t.kind == TokenKind.TEOF:
+            kind_t, value = self._advance()
+            if kind_t == TokenKind.TEOF:
                 self._error('premature end of input')
 
-            if c_t.kind != TokenKind.TKEYWORD:
+            if kind_t != TokenKind.TKEYWORD:
                 self._back()
                 break
 
-            if c_t.value == 'K_TYPEDEF':
+            if value == 'K_TYPEDEF':
                 if scalss != -1:
                     err = True
                     break
                 scalss = SClass.S_TYPEDEF
-            elif c_t.value == 'K_EXTERN':
+            elif value == 'K_EXTERN':
                 if scalss != -1:
                     err = True
                     break
                 scalss = SClass.S_EXTERN
-            elif c_t.value == 'K_STATIC':
+            elif value == 'K_STATIC':
                 if scalss != -1:
                     err = True
                     break
                 scalss = SClass.S_STATIC
-            elif c_t.value == 'K_AUTO':
+            elif value == 'K_AUTO':
                 if scalss != -1:
                     err = True
                     break
                 scalss = SClass.S_AUTO
-            elif c_t.value == 'K_REGISTER':
+            elif value == 'K_REGISTER':
                 if scalss != -1:
                     err = True
                     break
                 scalss = SClass.S_REGISTER
-            elif c_t.value == 'K_CONST':
+            elif value == 'K_CONST':
                 pass
-            elif c_t.value == 'K_VOID':
+            elif value == 'K_VOID':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.VOID
-            elif c_t.value == 'K_CHAR':
+            elif value == 'K_CHAR':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.CHAR
-            elif c_t.value == 'K_INT':
+            elif value == 'K_INT':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.INT
-            elif c_t.value == 'K_FLOAT':
+            elif value == 'K_FLOAT':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.FLOAT
-            elif c_t.value == 'K_DOUBLE':
+            elif value == 'K_DOUBLE':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.DOUBLE
-            elif c_t.value == 'K_SHORT':
+            elif value == 'K_SHORT':
                 if kind != -1:
                     err = True
                     break
                 kind = TypeKind.SHORT
-            elif c_t.value == 'K_LONG':
+            elif value == 'K_LONG':
                 if kind == -1:
                     kind = TypeKind.LONG
                 elif kind == TypeKind.LONG:
@@ -290,21 +450,21 @@ class Parser(object):
                 else:
                     err = True
                     break
-            elif c_t.value == 'K_SIGNED':
+            elif value == 'K_SIGNED':
                 if not usig is None:
                     err = True
                     break
                 usig = False
-            elif c_t.value == 'K_UNSIGNED':
+            elif value == 'K_UNSIGNED':
                 if not usig is None:
                     err = True
                     break
                 usig = True
-            elif c_t.value == 'K_STRUCT':
+            elif value == 'K_STRUCT':
                 pass
-            elif c_t.value == 'K_UNION':
+            elif value == 'K_UNION':
                 pass
-            elif c_t.value == 'K_ENUM':
+            elif value == 'K_ENUM':
                 pass
             else:
                 self._back()
@@ -315,8 +475,10 @@ class Parser(object):
                 break
 
         if err:
-            self._error('type mismatch: {}'.format(self._current_token.value))
+            self._error('type mismatch: {}'.format(self._current_value))
         else:
+            if kind == -1:
+                kind = TypeKind.INT # plain signed or unsigned
             ty = self._tm.make_num_type(kind, False if usig is None else usig)
             ty.scalss = SClass.S_AUTO if scalss == -1 else scalss
             return ty
@@ -331,11 +493,11 @@ class Parser(object):
         if self._next_t('*'):
             self._skip_type_qualifiers()
             return self._read_declarator(self._tm.make_ptr_type(basety), params, decltype)
-        c_t = self._advance()
-        if c_t.kind == TokenKind.TIDENT:
+        kind, value = self._advance()
+        if kind == TokenKind.TIDENT:
             if decltype == DeclType.CAST:
-                self._error('identifier is not expected,but got {}'.format(c_t.value))
-            basety.varname = c_t.value
+                self._error('identifier is not expected,but got {}'.format(value))
+            basety.varname = value
             return self._read_declarator_tail(basety, params)
 
         #TODO some judgement
@@ -367,18 +529,17 @@ class Parser(object):
         '''
         only new style parameters list
         '''
-        c_t = self._advance()
-        if c_t.value == 'K_VOID' and self._next_t(')'):
+        kind, value = self._advance()
+        if value == 'K_VOID' and self._next_t(')'):
             return self._tm.make_func_type(ret_type, [], False)
 
-        if c_t.value == ')':
+        if value == ')':
             return self._tm.make_func_type(ret_type, [], False)
 
         self._back()
-        p_t = self._peek()
-        if p_t.value == '...':
+        if self._peek_value() == '...':
             self._error('at least one parameters is required before ...')
-        if self._is_type(p_t):
+        if self._peek_is_type():
             params_type = []
             isellipsis = self._read_declarator_params(params_type, param_vars)
             return self._tm.make_func_type(ret_type, params_type, isellipsis)
@@ -401,19 +562,18 @@ class Parser(object):
             params_type.append(ty)
             if not is_typeonly:
                 param_vars.append(self._var_node(ty, False))
-            c_t = self._advance()
-            if c_t.value == ')':
+            kind, value = self._advance()
+            if value == ')':
                 return False
-            if c_t.value != ',':
-                self._error('comma expected, but got {}'.format(c_t.value))
+            if value != ',':
+                self._error('comma expected, but got {}'.format(value))
 
     def _read_func_param(self, is_typeonly):
         basety = self._tm.type_int()
-        p_t = self._peek()
-        if self._is_type(p_t):
+        if self._peek_is_type():
             basety = self._read_decl_spec()
         elif is_typeonly:
-            self._error('type expected, but got {}'.format(p_t.value))
+            self._error('type expected, but got {}'.format(self._peek_value()))
         ty = self._read_declarator(basety, None, DeclType.PARAM_TYPE_ONLY if is_typeonly else DeclType.PARAM)
 
         if ty.kind == TypeKind.ARRAY:
@@ -452,10 +612,9 @@ class Parser(object):
 
     def _read_decl_or_stmt(self, stmts):
         #TODO assert keyword
-        p_t = self._peek()
-        if p_t.kind == TokenKind.TEOF:
+        if self._peek_kind() == TokenKind.TEOF:
             self._error('premature end of input')
-        if self._is_type(p_t):
+        if self._peek_is_type():
             self._read_decl(stmts, False)
         else:
             stmt = self._read_stmt()
@@ -466,36 +625,36 @@ class Parser(object):
         statement
         '''
         #TODO
-        c_t = self._advance()
+        kind, value = self._advance()
 
-        if c_t.value == '{':
+        if value == '{':
             return self._read_compound_stmt()
 
-        if c_t.kind == TokenKind.TKEYWORD:
-            if c_t.value == 'K_IF':
+        if kind == TokenKind.TKEYWORD:
+            if value == 'K_IF':
                 return self._read_if_stmt()
-            elif c_t.value == 'K_FOR':
+            elif value == 'K_FOR':
                 pass
-            elif c_t.value == 'K_WHILE':
+            elif value == 'K_WHILE':
                 pass
-            elif c_t.value == 'K_DO':
+            elif value == 'K_DO':
                 pass
-            elif c_t.value == 'K_RETURN':
+            elif value == 'K_RETURN':
                 pass
-            elif c_t.value == 'K_SWITCH':
+            elif value == 'K_SWITCH':
                 pass
-            elif c_t.value == 'K_CASE':
+            elif value == 'K_CASE':
                 pass
-            elif c_t.value == 'K_DEFAULT':
+            elif value == 'K_DEFAULT':
                 pass
-            elif c_t.value == 'K_BREAK':
+            elif value == 'K_BREAK':
                 pass
-            elif c_t.value == 'K_CONTINUE':
+            elif value == 'K_CONTINUE':
                 pass
-            elif c_t.value == 'K_GOTO':
+            elif value == 'K_GOTO':
                 pass
 
-        if c_t.kind == TokenKind.TIDENT and self._next_t(':'):
+        if kind == TokenKind.TIDENT and self._next_t(':'):
             #TODO read label
             pass
 
@@ -520,7 +679,7 @@ class Parser(object):
 
     def _read_decl_init(self, ty):
         r = []
-        if self._peek().value == '{':
+        if self._peek_value() == '{':
             #TODO read initializer list
             pass
         else:
@@ -575,7 +734,7 @@ class Parser(object):
         '''
         node = self._read_bitor_expr()
         while self._next_t('&&'):
-            node = self._nf.binary_node(NodeKind.OP_LOGAND, self._tm.type_int, node, self._read_bitor_expr())
+            node = self._nf.binary_node(NodeKind.OP_LOGAND, self._tm.type_int(), node, self._read_bitor_expr())
         return node
 
     def _read_bitor_expr(self):
@@ -643,7 +802,7 @@ class Parser(object):
             if self._next_t('<<'):
                 node = self._binop(NodeKind.OP_SAL, self._conv(node), self._conv(self._read_additive_expr()))
             elif self._next_t('>>'):
-                node = self._binop(NodeKind.OP_SAL, self._conv(node), self._conv(self._read_additive_expr()))
+                node = self._binop(NodeKind.OP_SAR, self._conv(node), self._conv(self._read_additive_expr()))
             else:
                 break
         return node
@@ -680,11 +839,11 @@ class Parser(object):
         '''
         cast operation
         '''
-        c_t = self._advance()
-        if c_t.value == '(' and self._is_type(self._peek()):
+        kind, value = self._advance()
+        if value == '(' and self._peek_is_type():
             ty = self._read_cast_type()
             self._expect(')')
-            if self._peek().value == '{':
+            if self._peek_value() == '{':
                 #TODO
                 pass
             return self._nf.unary_node(NodeKind.OP_CAST, ty, self._read_cast_expr())
@@ -700,27 +859,27 @@ class Parser(object):
         unary operation
         '''
         #TODO
-        c_t = self._advance()
-        if c_t.kind == TokenKind.TKEYWORD or c_t.kind == TokenKind.TOPERATE:
-            if c_t.value == 'K_SIZEOF':
+        kind, value = self._advance()
+        if kind == TokenKind.TKEYWORD or kind == TokenKind.TOPERATE:
+            if value == 'K_SIZEOF':
                 pass
-            elif c_t.value == 'K_ALIGNOF':
+            elif value == 'K_ALIGNOF':
                 pass
-            elif c_t.value == '++':
+            elif value == '++':
                 pass
-            elif c_t.value == '--':
+            elif value == '--':
                 pass
-            elif c_t.value == '&':
+            elif value == '&':
                 pass
-            elif c_t.value == '*':
+            elif value == '*':
                 pass
-            elif c_t.value == '+':
+            elif value == '+':
                 return self._read_cast_expr()
-            elif c_t.value == '-':
+            elif value == '-':
                 return self._read_unary_minus()
-            elif c_t.value == '~':
+            elif value == '~':
                 pass
-            elif c_t.value == '!':
+            elif value == '!':
                 return self._read_unary_lognot()
 
         self._back()
@@ -759,11 +918,11 @@ class Parser(object):
             if self._next_t('->'):
                 #TODO
                 continue
-            p_t = self._peek()
-            if p_t.value == '++' or p_t.value == '--':
+            p_v = self._peek_value()
+            if p_v == '++' or p_v == '--':
                 self._ensure_lvalue(node)
-                self._advance()
-                op = NodeKind.OP_POST_INC if p_t.value == '++' else NodeKind.OP_POST_DEC
+                self._skip()
+                op = NodeKind.OP_POST_INC if p_v == '++' else NodeKind.OP_POST_DEC
                 return self._nf.unary_node(op, node.ty, node)
             return node
 
@@ -772,41 +931,40 @@ class Parser(object):
         '''
         primary expression
         '''
-        c_t = self._advance()
-        if c_t.kind == TokenKind.TEOF:
+        kind, value = self._advance()
+        if kind == TokenKind.TEOF:
             return None
-        if c_t.value == '(':
+        if value == '(':
             #TODO
             return None
 
-        if c_t.kind == TokenKind.TIDENT:
+        if kind == TokenKind.TIDENT:
             #TODO
             return None
-        elif c_t.kind == TokenKind.TNUMBER:
-            return self._read_number(c_t)
-        elif c_t.kind == TokenKind.TCHAR:
+        elif kind == TokenKind.TNUMBER:
+            return self._read_number(value)
+        elif kind == TokenKind.TCHAR:
             #TODO
             return None
-        elif c_t.kind == TokenKind.TSTRING:
+        elif kind == TokenKind.TSTRING:
             #TODO
             return None
         else:
-            self._error('internal error: unknown token kind {}'.format(c_t.kind))
+            self._error('internal error: unknown token kind {}'.format(kind))
 
-    def _read_number(self, tok):
-        v = tok.value
+    def _read_number(self, v):
         if v.isdigit():
-            return self._read_int(tok)
+            return self._read_int(v)
         else:
-            return self._read_float(tok)
+            return self._read_float(v)
 
-    def _read_float(self, tok):
+    def _read_float(self, v):
         #TODO double float type
-        return self._nf.val_node(self._tm.type_float(), float(tok.value))
+        return self._nf.val_node(self._tm.type_float(), float(v))
 
-    def _read_int(self, tok):
+    def _read_int(self, v):
         #TODO int uint long ulong
-        return self._nf.val_node(self._tm.type_int(), int(tok.value))
+        return self._nf.val_node(self._tm.type_int(), int(v))
 
     def _read_decl(self, block, isglobal=True):
         '''
@@ -848,13 +1006,63 @@ class Parser(object):
 
         return node
 
+    def _read_toplevel(self):
+        self.items.append(self._pos + 1)
+        self.item_nodes.append(len(self.ast))
+        if self._is_funcdef():
+            #read function definition
+            self.ast.append(self._read_funcdef())
+        else:
+            self._read_decl(self.ast)
+
     def parse(self):
         while True:
-            if self._peek() is None or self._peek().kind == TokenKind.TEOF:
+            if self._peek_kind() == TokenKind.TEOF:
                 break;
-            if self._is_funcdef():
-                #read function definition
-                self.ast.append(self._read_funcdef())
-                pass
-            else:
-                self._read_decl(self.ast)
+            self._read_toplevel()
+
+    def reparse(self, first, old_stop, new_stop):
+        '''
+        parse again after the tokens [first, old_stop) were replaced
+        by [first, new_stop), see lex.relex. only the top-level items
+        touching the change are parsed, the others are reused as they are.
+        return the number of items parsed
+        '''
+        delta = new_stop - old_stop
+        a = max(0, bisect_right(self.items, first) - 1)
+        tail_items = self.items[a:]
+        tail_nodes = self.item_nodes[a:]
+        old_ast = self.ast
+        del self.items[a:]
+        del self.item_nodes[a:]
+        self.ast = old_ast[:tail_nodes[0]] if tail_nodes else old_ast
+
+        self._pos = (tail_items[0] if tail_items else 0) - 1
+        self._is_record = False
+        self._record = 0
+        self._localvars = None
+
+        b = 0 # the old item the position may line up with
+        parsed = 0
+        while True:
+            if self._peek_kind() == TokenKind.TEOF:
+                return parsed
+            start = self._pos + 1
+            if start >= new_stop:
+                while b < len(tail_items) and tail_items[b] + delta < start:
+                    b += 1
+                if b < len(tail_items) and tail_items[b] + delta == start:
+                    break
+            self._read_toplevel()
+            parsed += 1
+
+        node_delta = len(self.ast) - tail_nodes[b]
+        reused = old_ast[tail_nodes[b]:]
+        if delta:
+            for node in iter_nodes(reused):
+                if not node.sourceloc is None:
+                    node.sourceloc += delta
+        self.ast.extend(reused)
+        self.items.extend(array('i', [i + delta for i in tail_items[b:]]))
+        self.item_nodes.extend(array('i', [n + node_delta for n in tail_nodes[b:]]))
+        return parsed
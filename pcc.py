@@ -3,6 +3,315 @@ Copyright 2018 JackLiang.
 
 compiler main code
 '''
+import io
+import os
+import sys
+import struct
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from lex import LEXER_VERSION
+from cpp import Preprocessor, FileCache
+from parse import Parser
+from ctype import TypeMaker
+from gen import Emit
+from astcache import dump_ast, load_ast, ast_key
+from pch import read_pch
+from utils.diskcache import DiskCache, content_key
+
+COMPILER_VERSION = '0.1.1'
+
+# count of the headers, then for each one its path length, path and content hash
+DEPS_COUNT = struct.Struct('<I')
+DEP_HEADER = struct.Struct('<I64s')
+
+def _pack_deps(files, paths):
+    parts = [DEPS_COUNT.pack(len(paths))]
+    for path in paths:
+        name = path.encode('utf-8', 'surrogateescape')
+        parts.append(DEP_HEADER.pack(len(name), files.digest(path).encode('ascii')))
+        parts.append(name)
+    return b''.join(parts)
+
+def _check_deps(files, data, offset=0, paths=None):
+    '''
+    offset after the header list at offset of data, None when a header
+    changed. the header paths are added to paths
+    '''
+    count = DEPS_COUNT.unpack_from(data, offset)[0]
+    pos = offset + DEPS_COUNT.size
+    for _ in range(count):
+        n, digest = DEP_HEADER.unpack_from(data, pos)
+        pos += DEP_HEADER.size
+        path = bytes(data[pos:pos + n]).decode('utf-8', 'surrogateescape')
+        pos += n
+        try:
+            if files.digest(path).encode('ascii') != digest:
+                return None
+        except OSError:
+            return None
+        if not paths is None:
+            paths.append(path)
+    return pos
+
+# magic, format, compiler version length, source hash, options hash,
+# then the compiler version and the header list
+MANIFEST = struct.Struct('<4sII64s64s')
+MANIFEST_MAGIC = b'PCCM'
+MANIFEST_FORMAT = 1
+
+def options_key(include_paths=(), defines=None, pch=None, assembly=False, level=None):
+    '''
+    hash of the options an output depends on
+    '''
+    options = (list(include_paths), sorted((defines or {}).items()),
+               None if pch is None else (pch.digest, list(pch.deps)), assembly, level)
+    return content_key(repr(options), LEXER_VERSION)
+
+def pack_manifest(source_digest, options, files, paths):
+    '''
+    the dependency manifest of an output: the hash of its source, of the
+    options and of every header, with the compiler version
+    '''
+    version = COMPILER_VERSION.encode('utf-8')
+    return b''.join((MANIFEST.pack(MANIFEST_MAGIC, MANIFEST_FORMAT, len(version),
+                                   source_digest.encode('ascii'), options.encode('ascii')),
+                     version, _pack_deps(files, paths)))
+
+def check_manifest(data, source_digest, options, files):
+    '''
+    the output of the manifest data is up to date
+    '''
+    try:
+        magic, fmt, n, digest, key = MANIFEST.unpack_from(data, 0)
+        if magic != MANIFEST_MAGIC or fmt != MANIFEST_FORMAT:
+            return False
+        version = data[MANIFEST.size:MANIFEST.size + n].decode('utf-8')
+        if (version != COMPILER_VERSION or digest != source_digest.encode('ascii')
+                or key != options.encode('ascii')):
+            return False
+        return _check_deps(files, data, MANIFEST.size + n) == len(data)
+    except (struct.error, UnicodeDecodeError):
+        return False
+
+def frontend(path, cache=None, include_paths=(), defines=None, pch=None, warnings=None, dependencies=None):
+    '''
+    preprocess and parse a source file, return (ast, location) where
+    location maps node.sourceloc to a Coordinate.
+    pch is a pch.Snapshot the unit goes on from, its declarations lead the AST.
+    with a DiskCache the AST of an unchanged source is loaded instead,
+    keyed by the source hash, its path, the options and the compiler version.
+    the entry keeps the hash of every header, a changed header is a miss.
+    the #warning messages are added to the warnings list and the
+    headers read to the dependencies list
+    '''
+    defines = sorted((defines or {}).items())
+    if pch is None:
+        pp = Preprocessor(include_paths)
+    else:
+        pp = pch.preprocessor()
+        pp.include_paths = list(include_paths) + pp.include_paths
+    for name, value in defines:
+        pp.define(name, value)
+    if not cache is None:
+        with open(path, 'rb') as f:
+            source = f.read()
+        key = ast_key(source, path, COMPILER_VERSION, LEXER_VERSION, list(include_paths), defines,
+                      None if pch is None else pch.digest)
+        data = cache.get(key)
+        if not data is None:
+            try:
+                paths = []
+                pos = _check_deps(pp.files, data, 0, paths)
+                if not pos is None:
+                    ast, locations = load_ast(memoryview(data)[pos:])
+                    if not dependencies is None:
+                        dependencies.extend(paths)
+                    return ast, locations.location
+            except (ValueError, struct.error, IndexError, KeyError, UnicodeDecodeError):
+                pass # damaged entry, parse again
+    if pch is None:
+        parser = Parser(pp.preprocess(path))
+    else:
+        parser = pch.parser(pp.preprocess(path))
+    parser.parse()
+    if not warnings is None:
+        warnings.extend(pp.warnings)
+    if not dependencies is None:
+        dependencies.extend(pp.dependencies)
+    if not cache is None:
+        cache.put(key, _pack_deps(pp.files, pp.dependencies) + dump_ast(parser.ast, parser.location))
+    return parser.ast, parser.location
+
+def assemble(ast, level=None):
+    '''
+    the assembly text of an AST, with an optimization level through the ir
+    '''
+    out = io.StringIO()
+    Emit(out, level=level).emit(ast)
+    return out.getvalue()
+
+def output_path(path, output_dir=None, suffix='.ast'):
+    '''
+    the output of a source file, next to it or in output_dir
+    '''
+    base = os.path.splitext(path)[0] + suffix
+    if output_dir is None:
+        return base
+    return os.path.join(output_dir, os.path.basename(base))
+
+def _write(path, data):
+    # a reader never sees a half written output
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def manifest_path(output):
+    return output + '.dep'
+
+# build results of a unit
+REBUILT = 'rebuilt'
+REUSED = 'reused'
+FAILED = 'failed'
+
+class _Worker(object):
+    '''
+    the state a process keeps between the files it compiles: the
+    options, the loaded precompiled header and the AST cache. the type
+    and file caches are process singletons, warmed up once
+    '''
+
+    def __init__(self, options):
+        self.options = options
+        self.include_paths = options.include_paths
+        self.defines = options.defines
+        self.files = FileCache()
+        self.pch = None if options.pch is None else read_pch(options.pch)
+        self.stale = None # error of a precompiled header whose headers changed
+        if not self.pch is None and not self.pch.is_fresh(COMPILER_VERSION, self.files):
+            self.stale = '{0}: error: precompiled header is out of date, build it again'.format(options.pch)
+        self.cache = None if options.cache is None else DiskCache(options.cache)
+        self.key = options_key(self.include_paths, self.defines, self.pch, options.assembly, options.level)
+        TypeMaker()
+
+    def _up_to_date(self, output, manifest, digest):
+        if not os.path.exists(output):
+            return False
+        try:
+            with open(manifest, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        return check_manifest(data, digest, self.key, self.files)
+
+    def compile(self, path, output):
+        '''
+        compile one file unless its manifest shows no input changed,
+        return (REBUILT, REUSED or FAILED, diagnostics)
+        '''
+        warnings = []
+        if not self.stale is None:
+            return FAILED, [self.stale]
+        try:
+            manifest = manifest_path(output)
+            digest = self.files.digest(path)
+            if not self.options.rebuild and self._up_to_date(output, manifest, digest):
+                return REUSED, warnings
+            dependencies = []
+            ast, location = frontend(path, self.cache, self.include_paths, self.defines, self.pch,
+                                     warnings, dependencies)
+            if self.options.assembly:
+                _write(output, assemble(ast, self.options.level).encode('utf-8'))
+            else:
+                _write(output, dump_ast(ast, location))
+            if not self.pch is None:
+                # the unit skips the headers of the pch, their guards are set
+                dependencies.extend(p for p, d in self.pch.deps if not p in dependencies)
+            _write(manifest, pack_manifest(digest, self.key, self.files, dependencies))
+        except Exception as e:
+            return FAILED, warnings + ['{0}: error: {1}'.format(path, e)]
+        return REBUILT, warnings
+
+_worker = None
+
+def _init_worker(options):
+    global _worker
+    _worker = _Worker(options)
+
+def _compile_job(job):
+    return _worker.compile(*job)
+
+def build(options):
+    '''
+    compile options.files with options.jobs processes, yield
+    (path, result, diagnostics) in input order
+    '''
+    suffix = '.s' if options.assembly else '.ast'
+    jobs = [(path, output_path(path, options.output_dir, suffix)) for path in options.files]
+    if options.jobs <= 1 or len(jobs) <= 1:
+        _init_worker(options)
+        for job in jobs:
+            result, diagnostics = _compile_job(job)
+            yield job[0], result, diagnostics
+        return
+    workers = min(options.jobs, len(jobs))
+    # a few jobs at a time, a worker keeps its warm state for all of them
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for job, (result, diagnostics) in zip(jobs, pool.map(_compile_job, jobs, chunksize=chunksize)):
+            yield job[0], result, diagnostics
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='pcc', description='python c compiler')
+    parser.add_argument('files', nargs='+', help='C source files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes, all cores by default')
+    parser.add_argument('-I', dest='include_paths', action='append', default=[], help='add an include directory')
+    parser.add_argument('-D', dest='defines', action='append', default=[], help='define a macro, name or name=value')
+    parser.add_argument('-o', '--output-dir', default=None, help='directory of the outputs, next to the sources by default')
+    parser.add_argument('--pch', default=None, help='precompiled header every file goes on from')
+    parser.add_argument('--cache', default=None, help='AST cache directory')
+    parser.add_argument('-S', dest='assembly', action='store_true',
+                        help='write the assembly of each file, .s instead of the .ast')
+    parser.add_argument('-O', dest='level', type=int, choices=(0, 1, 2), default=None,
+                        help='optimization level of -S, through the ir; stack machine code by default')
+    parser.add_argument('-B', '--rebuild', action='store_true',
+                        help='compile every file, even when its manifest shows no change')
+    options = parser.parse_args(argv)
+    defines = {}
+    for define in options.defines:
+        name, _, value = define.partition('=')
+        defines[name] = value or '1'
+    options.defines = defines
+    if not options.level is None and not options.assembly:
+        parser.error('-O needs -S')
+    if not options.output_dir is None:
+        names = [os.path.basename(output_path(path)) for path in options.files]
+        if len(set(names)) != len(names):
+            parser.error('two sources have the same output name in ' + options.output_dir)
+        os.makedirs(options.output_dir, exist_ok=True)
+    return options
+
+def main(argv=None, out=None):
+    '''
+    the command line driver, diagnostics are written in the order of the
+    files, then the count of units rebuilt, reused and failed
+    '''
+    out = sys.stderr if out is None else out
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    counts = {REBUILT: 0, REUSED: 0, FAILED: 0}
+    for path, result, diagnostics in build(options):
+        for line in diagnostics:
+            out.write(line + '\n')
+        counts[result] += 1
+    out.write('{0} rebuilt, {1} reused, {2} failed\n'.format(counts[REBUILT], counts[REUSED], counts[FAILED]))
+    return 1 if counts[FAILED] else 0
 
 if __name__ == '__main__':
-    pass
+    sys.exit(main())
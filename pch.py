@@ -0,0 +1,342 @@
+'''
+Copyright 2018 JackLiang.
+
+precompiled header snapshots
+'''
+import gc
+import os
+import sys
+import struct
+from array import array
+from lex import TOKEN_KINDS
+from cpp import Preprocessor, PPToken, Macro, FileCache, EMPTY
+from parse import Parser, TokenRing
+from csymbol import SymbolManager, SymbolTable, Coordinate
+from astcache import dump_ast, load_ast
+from utils.diskcache import content_key
+
+PCH_FORMAT = 2 # bump when the layout below changes
+
+# magic, format, compiler version length, int count, string count, string bytes, AST bytes
+HEADER = struct.Struct('<4sIIIIII')
+MAGIC = b'PCCH'
+
+SYMBOL_TABLES = ('constants', 'externals', 'identifiers', 'types')
+
+class Snapshot(object):
+    '''
+    preprocessor and parser state after a header: the macros, the
+    include state, the symbol tables and the declarations parsed.
+    a unit compiled with it goes on as if it began by including the header
+    '''
+
+    def __init__(self):
+        self.header = None
+        self.version = None # compiler version which built it
+        self.include_paths = []
+        self.defines = [] # (name, value) of the command line
+        self.deps = [] # (path, content hash) of the header and every file it includes
+        self.macros = {}
+        self.once = set()
+        self.guards = {}
+        self.tables = {} # table name -> [(level, [(name, scope, sclass)])], outer table first
+        self.ident_level = 0
+        self.ast = []
+        # location columns of the header tokens, see TokenRing
+        self.lines = array('i')
+        self.columns = array('i')
+        self.files = array('i')
+        self.filenames = []
+        self.digest = None
+
+    def location(self, index):
+        return Coordinate(self.filenames[self.files[index]], self.lines[index], self.columns[index])
+
+    def is_fresh(self, version, files=None):
+        '''
+        the snapshot was built by this compiler version and no input changed
+        '''
+        if self.version != version:
+            return False
+        files = FileCache() if files is None else files
+        for path, digest in self.deps:
+            try:
+                if files.digest(path) != digest:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def preprocessor(self, files=None):
+        '''
+        a Preprocessor in the state after the header
+        '''
+        pp = Preprocessor(self.include_paths, files)
+        pp.load_state(self.macros, self.once, self.guards)
+        return pp
+
+    def symbols(self):
+        '''
+        a SymbolManager in the state after the header, the tables are
+        filled again since the buckets follow the string hash of the process
+        '''
+        sm = SymbolManager()
+        for name in SYMBOL_TABLES:
+            tp = None
+            for level, symbols in self.tables.get(name, []):
+                tp = SymbolTable(tp, level)
+                for sym_name, scope, sclass in symbols:
+                    s, t = tp.install(sym_name, level)
+                    s.scope = scope
+                    s.sclass = sclass
+            if not tp is None:
+                setattr(sm, name, tp)
+        sm.ident_level = self.ident_level
+        return sm
+
+    def parser(self, stream):
+        '''
+        a Parser of the unit tokens going on from the header, the AST nodes
+        of the header are shared by every parser made from the snapshot
+        '''
+        ring = TokenRing(stream, (self.lines, self.columns, self.files, self.filenames))
+        return Parser(ring, self.symbols(), list(self.ast))
+
+def build_pch(header, version, include_paths=(), defines=None):
+    '''
+    preprocess and parse a header into a Snapshot
+    '''
+    header = os.path.normpath(header)
+    snap = Snapshot()
+    snap.header = header
+    snap.version = version
+    snap.include_paths = list(include_paths)
+    snap.defines = sorted((defines or {}).items())
+    pp = Preprocessor(include_paths)
+    for name, value in snap.defines:
+        pp.define(name, value)
+    ring = TokenRing(pp.preprocess(header), keep=True) # the unit goes on from every location
+    parser = Parser(ring)
+    parser.parse()
+
+    files = pp.files
+    snap.deps = [(path, files.digest(path)) for path in [header] + pp.dependencies]
+    snap.macros = dict(pp.macros)
+    snap.once = set(pp._once)
+    snap.once.add(header) # an include of the header itself in the unit is done
+    snap.guards = dict(pp._guards)
+    sm = parser._sm
+    for name in SYMBOL_TABLES:
+        chain = []
+        tp = getattr(sm, name)
+        while not tp is None:
+            symbols = []
+            s = tp.head
+            while not s is None:
+                symbols.append((s.name, s.scope, s.sclass))
+                s = s.up
+            symbols.reverse()
+            chain.append((tp.level, symbols))
+            tp = tp.pre
+        chain.reverse()
+        snap.tables[name] = chain
+    snap.ident_level = sm.ident_level
+    snap.ast = parser.ast
+    count = len(ring.lines) - 1 # the header EOF is not part of the unit
+    snap.lines = ring.lines[:count]
+    snap.columns = ring.columns[:count]
+    snap.files = ring.files[:count]
+    snap.filenames = list(ring.filenames)
+    return snap
+
+class _Writer(object):
+
+    def __init__(self):
+        self.ints = array('i')
+        self.strings = []
+        self._string_index = {}
+
+    def string(self, s):
+        if s is None:
+            return -1
+        i = self._string_index.get(s, None)
+        if i is None:
+            i = self._string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def strs(self, items):
+        self.ints.append(len(items))
+        self.ints.extend(self.string(s) for s in items)
+
+class _Reader(object):
+
+    def __init__(self, ints, strings):
+        self.ints = ints
+        self.strings = strings
+        self.pos = 0
+
+    def int(self):
+        self.pos += 1
+        return self.ints[self.pos - 1]
+
+    def string(self):
+        i = self.int()
+        return None if i == -1 else self.strings[i]
+
+    def strs(self):
+        return [self.string() for _ in range(self.int())]
+
+    def column(self, n):
+        c = array('i', self.ints[self.pos:self.pos + n])
+        self.pos += n
+        return c
+
+def dump_pch(snap):
+    '''
+    binary form of a Snapshot
+    '''
+    w = _Writer()
+    ints = w.ints
+    ints.append(w.string(snap.header))
+    w.strs(snap.include_paths)
+    w.strs([v for pair in snap.defines for v in pair])
+    w.strs([v for pair in snap.deps for v in pair])
+    w.strs(sorted(snap.once))
+    w.strs([v for pair in sorted(snap.guards.items()) for v in pair])
+
+    ints.append(len(snap.macros))
+    for m in snap.macros.values():
+        ints.append(w.string(m.name))
+        if m.params is None:
+            ints.append(-1)
+        else:
+            w.strs(m.params)
+        ints.append(int(m.variadic))
+        ints.append(len(m.body))
+        for t in m.body:
+            ints.extend((t.kind.value, w.string(t.filename), t.line, t.column,
+                         w.string(t.value), int(t.space)))
+            w.strs(sorted(t.hideset))
+
+    for name in SYMBOL_TABLES:
+        chain = snap.tables.get(name, [])
+        ints.append(len(chain))
+        for level, symbols in chain:
+            ints.append(level)
+            ints.append(len(symbols))
+            for sym_name, scope, sclass in symbols:
+                ints.extend((w.string(sym_name), scope, sclass))
+    ints.append(snap.ident_level)
+
+    w.strs(snap.filenames)
+    ints.append(len(snap.lines))
+    for column in (snap.lines, snap.columns, snap.files):
+        ints.extend(column)
+
+    ast = dump_ast(snap.ast, snap.location)
+    version = snap.version.encode('utf-8')
+    blob = ''.join(w.strings).encode('utf-8', 'surrogatepass')
+    lengths = array('i', [len(s) for s in w.strings])
+    if sys.byteorder == 'big':
+        ints.byteswap()
+        lengths.byteswap()
+    return b''.join((HEADER.pack(MAGIC, PCH_FORMAT, len(version), len(ints), len(lengths), len(blob), len(ast)),
+                     version, ints.tobytes(), lengths.tobytes(), blob, ast))
+
+def load_pch(data):
+    '''
+    read dump_pch output into a Snapshot
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_pch(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _load_pch(data):
+    magic, version, nversion, nints, nstrings, nblob, nast = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != PCH_FORMAT:
+        raise ValueError('not a precompiled header of format {}'.format(PCH_FORMAT))
+    view = memoryview(data)
+    pos = HEADER.size
+    snap = Snapshot()
+    snap.version = bytes(view[pos:pos + nversion]).decode('utf-8')
+    pos += nversion
+    ints = array('i')
+    ints.frombytes(view[pos:pos + 4 * nints])
+    pos += 4 * nints
+    lengths = array('i')
+    lengths.frombytes(view[pos:pos + 4 * nstrings])
+    pos += 4 * nstrings
+    if sys.byteorder == 'big':
+        ints.byteswap()
+        lengths.byteswap()
+    blob = bytes(view[pos:pos + nblob]).decode('utf-8', 'surrogatepass')
+    pos += nblob
+    strings = []
+    start = 0
+    for n in lengths:
+        strings.append(blob[start:start + n])
+        start += n
+    r = _Reader(ints.tolist(), strings)
+
+    snap.header = r.string()
+    snap.include_paths = r.strs()
+    values = r.strs()
+    snap.defines = list(zip(values[0::2], values[1::2]))
+    values = r.strs()
+    snap.deps = list(zip(values[0::2], values[1::2]))
+    snap.once = set(r.strs())
+    values = r.strs()
+    snap.guards = dict(zip(values[0::2], values[1::2]))
+
+    for _ in range(r.int()):
+        name = r.string()
+        n = r.int()
+        params = None if n == -1 else [r.string() for _ in range(n)]
+        variadic = bool(r.int())
+        body = []
+        for _ in range(r.int()):
+            kind, filename, line, column, value, space = r.ints[r.pos:r.pos + 6]
+            r.pos += 6
+            hideset = r.strs()
+            body.append(PPToken(TOKEN_KINDS[kind], strings[filename], line, column,
+                                None if value == -1 else strings[value], bool(space),
+                                frozenset(hideset) if hideset else EMPTY))
+        snap.macros[name] = Macro(name, params, variadic, body)
+
+    for name in SYMBOL_TABLES:
+        chain = []
+        for _ in range(r.int()):
+            level = r.int()
+            symbols = []
+            for _ in range(r.int()):
+                sym_name, scope, sclass = r.ints[r.pos:r.pos + 3]
+                r.pos += 3
+                symbols.append((strings[sym_name], scope, sclass))
+            chain.append((level, symbols))
+        snap.tables[name] = chain
+    snap.ident_level = r.int()
+
+    snap.filenames = r.strs()
+    count = r.int()
+    snap.lines = r.column(count)
+    snap.columns = r.column(count)
+    snap.files = r.column(count)
+
+    snap.ast, locations = load_ast(view[pos:pos + nast])
+    snap.digest = content_key(data)
+    return snap
+
+def save_pch(snap, path):
+    data = dump_pch(snap)
+    with open(path, 'wb') as f:
+        f.write(data)
+    snap.digest = content_key(data)
+
+def read_pch(path):
+    with open(path, 'rb') as f:
+        return load_pch(f.read())
@@ -0,0 +1,150 @@
+'''
+Copyright 2018 JackLiang.
+
+peephole optimization of the assembly instructions
+'''
+
+# ops of the window items that are not instructions
+LABEL = ':'
+DIRECTIVE = '.'
+
+MOVES = frozenset(('movb', 'movw', 'movl', 'movq', 'movss', 'movsd'))
+
+def _register(v):
+    return v.startswith('%')
+
+def _memory(v):
+    return '(' in v
+
+def _not_rax(v):
+    return not 'ax' in v
+
+class Rule(object):
+    '''
+    a pattern of consecutive window items and what replaces them.
+    an item is (op, operand, ...), a '?name' op or operand matches any
+    string and the same name matches the same string again. where is
+    the test of the names bound by a match, None when there is none
+    '''
+
+    def __init__(self, name, pattern, replacement, where=None):
+        self.name = name
+        self.pattern = [(p[0], tuple(p[1:])) for p in pattern]
+        self.replacement = [(r[0], tuple(r[1:])) for r in replacement]
+        self.where = where
+        self.width = len(pattern)
+
+    def match(self, items):
+        env = {}
+        for (pop, poperands), (op, operands) in zip(self.pattern, items):
+            if len(poperands) != len(operands) or not _bind(env, pop, op):
+                return None
+            for p, v in zip(poperands, operands):
+                if not _bind(env, p, v):
+                    return None
+        if not self.where is None and not self.where(env):
+            return None
+        return env
+
+    def rewrite(self, env):
+        return [(_subst(env, op), tuple(_subst(env, v) for v in operands)) for op, operands in self.replacement]
+
+def _bind(env, p, v):
+    if p[0] != '?':
+        return p == v
+    old = env.get(p, None)
+    if old is None:
+        env[p] = v
+        return True
+    return old == v
+
+def _subst(env, p):
+    return env[p] if p[0] == '?' else p
+
+RULES = [
+    # a value saved and restored in place
+    Rule('push_pop', [('pushq', '?a'), ('popq', '?a')], []),
+    Rule('push_pop_move', [('pushq', '?a'), ('popq', '?b')], [('movq', '?a', '?b')]),
+    # the right operand of a binary operator loaded straight into %ecx
+    # instead of through %eax and the stack
+    Rule('operand_to_rcx',
+         [('pushq', '%rax'), ('movl', '?s', '%eax'), ('movq', '%rax', '%rcx'), ('popq', '%rax')],
+         [('movl', '?s', '%ecx')],
+         lambda env: _not_rax(env['?s'])),
+    Rule('operand_to_rcx_q',
+         [('pushq', '%rax'), ('movq', '?s', '%rax'), ('movq', '%rax', '%rcx'), ('popq', '%rax')],
+         [('movq', '?s', '%rcx')],
+         lambda env: _not_rax(env['?s'])),
+    # the load of a value just stored from the same register
+    Rule('store_load', [('?op', '?r', '?m'), ('?op', '?m', '?r')], [('?op', '?r', '?m')],
+         lambda env: env['?op'] in MOVES and _register(env['?r']) and _memory(env['?m'])),
+    Rule('jump_next', [('jmp', '?l'), (LABEL, '?l')], [(LABEL, '?l')]),
+    Rule('move_self', [('movq', '?r', '?r')], []),
+]
+
+class Peephole(object):
+    '''
+    rules applied at the end of a window of items as they are added.
+    the rules are indexed by the op of their last item, a rule of
+    a '?' op is tried on every item. fired counts the matches of
+    every rule
+    '''
+
+    def __init__(self, rules=None):
+        self.rules = RULES if rules is None else rules
+        self.width = max(r.width for r in self.rules)
+        self._by_op = {}
+        self._any = []
+        for r in self.rules:
+            op = r.pattern[-1][0]
+            if op[0] == '?':
+                self._any.append(r)
+            else:
+                self._by_op.setdefault(op, []).append(r)
+        self.fired = dict((r.name, 0) for r in self.rules)
+        self.seen = 0 # instructions added
+        self.removed = 0
+
+    def add(self, window, item):
+        '''
+        append item to window and rewrite the end of window while a rule matches
+        '''
+        if item[0] != LABEL and item[0] != DIRECTIVE:
+            self.seen += 1
+        window.append(item)
+        while window:
+            rules = self._by_op.get(window[-1][0], None)
+            rule = self._match(window, rules) if rules else None
+            if rule is None and self._any:
+                rule = self._match(window, self._any)
+            if rule is None:
+                return
+
+    def _match(self, window, rules):
+        n = len(window)
+        for rule in rules:
+            width = rule.width
+            if width > n:
+                continue
+            items = window[n - width:]
+            env = rule.match(items)
+            if env is None:
+                continue
+            new = rule.rewrite(env)
+            self.fired[rule.name] += 1
+            self.removed += _count(items) - _count(new)
+            window[n - width:] = new
+            return rule
+        return None
+
+    def report(self):
+        '''
+        lines of the instructions removed and the matches of every rule
+        '''
+        lines = ['{} instructions, {} removed'.format(self.seen, self.removed)]
+        for name in sorted(self.fired, key=lambda k: -self.fired[k]):
+            lines.append('  {:<24} {:>8}'.format(name, self.fired[name]))
+        return lines
+
+def _count(items):
+    return sum(1 for op, operands in items if op != LABEL and op != DIRECTIVE)
@@ -0,0 +1,170 @@
+'''
+Copyright 2018 JackLiang.
+
+linear scan register allocation
+'''
+from ir import TERMINATORS, is_float
+from opt import liveness
+
+# %rax, %rcx and %rdx are the scratch registers of the code generator,
+# %xmm0 and %xmm1 for floating values. the caller saved registers come
+# first, a callee saved one costs a save and a restore
+INT_REGS = ('%rsi', '%rdi', '%r8', '%r9', '%r10', '%r11', '%rbx', '%r12', '%r13', '%r14', '%r15')
+CALLEE_SAVED = frozenset(('%rbx', '%r12', '%r13', '%r14', '%r15'))
+# %xmm0 - %xmm7 carry the arguments, none of them is allocated so the
+# floating parameters can be moved in any order
+FLOAT_REGS = tuple('%xmm{0}'.format(i) for i in range(8, 16))
+ARG_REGS = ('%rdi', '%rsi', '%rdx', '%rcx', '%r8', '%r9')
+
+class Interval(object):
+    '''
+    the instructions from start to end a register is live in
+    '''
+    __slots__ = ('reg', 'start', 'end', 'hint')
+
+    def __init__(self, reg, pos):
+        self.reg = reg
+        self.start = pos
+        self.end = pos
+        self.hint = None # machine register preferred
+
+def live_intervals(func):
+    '''
+    one interval of every register, the instructions are numbered in the
+    order of the blocks
+    '''
+    live_out = liveness(func)
+    intervals = {}
+    def touch(r, pos):
+        iv = intervals.get(r, None)
+        if iv is None:
+            intervals[r] = Interval(r, pos)
+        elif pos < iv.start:
+            iv.start = pos
+        elif pos > iv.end:
+            iv.end = pos
+    pos = 0
+    for b in func.blocks:
+        first = pos
+        last = pos + len(b.ins) - 1
+        live = set(live_out[b.id])
+        for r in live:
+            touch(r, last)
+        p = last
+        for ins in reversed(b.ins):
+            if not ins.op in TERMINATORS:
+                touch(ins.dst, p)
+                live.discard(ins.dst)
+            for r in ins.uses():
+                touch(r, p)
+                live.add(r)
+            p -= 1
+        for r in live:
+            touch(r, first)
+        pos = last + 1
+    # the arguments arrive together, no two parameters share a register
+    for r in func.params:
+        touch(r, 0)
+        touch(r, len(func.params) - 1)
+    return intervals
+
+class Allocation(object):
+    '''
+    where every register of a function lives: a machine register, or
+    a spill slot number
+    '''
+    __slots__ = ('regs', 'slots', 'nslots', 'spills', 'callee_saved')
+
+    def __init__(self):
+        self.regs = {} # ir register -> machine register
+        self.slots = {} # ir register -> spill slot
+        self.nslots = 0
+        self.spills = 0
+        self.callee_saved = [] # used callee saved registers
+
+class LinearScan(object):
+    '''
+    linear scan allocation of Poletto and Sarkar: the intervals are taken
+    by their start, when no register is free the interval that ends last
+    is spilled. a spilled interval takes a slot of spilled intervals that
+    ended before it starts. spills keeps the spill count of every function
+    '''
+
+    def __init__(self, int_regs=INT_REGS, float_regs=FLOAT_REGS):
+        self.int_regs = int_regs
+        self.float_regs = float_regs
+        self.spills = {} # function name -> spilled registers
+
+    def allocate(self, func, exclude=()):
+        '''
+        Allocation of func, the registers in exclude need no location
+        '''
+        intervals = live_intervals(func)
+        for r in exclude:
+            intervals.pop(r, None)
+        for i, r in enumerate(func.params):
+            if r in intervals and not is_float(func.types[r]) and i < len(ARG_REGS):
+                intervals[r].hint = ARG_REGS[i]
+        alloc = Allocation()
+        self._slot_ends = [] # by slot, the last end of its intervals
+        ints = [iv for iv in intervals.values() if not is_float(func.types[iv.reg])]
+        floats = [iv for iv in intervals.values() if is_float(func.types[iv.reg])]
+        self._scan(ints, self.int_regs, alloc)
+        self._scan(floats, self.float_regs, alloc)
+        used = set(alloc.regs.values())
+        alloc.callee_saved = [r for r in self.int_regs if r in CALLEE_SAVED and r in used]
+        self.spills[func.name] = alloc.spills
+        return alloc
+
+    def _scan(self, intervals, regs, alloc):
+        intervals.sort(key=lambda iv: (iv.start, iv.reg))
+        order = dict((r, i) for i, r in enumerate(regs))
+        free = list(regs)
+        active = [] # sorted by end
+        for iv in intervals:
+            while active and active[0].end < iv.start:
+                r = alloc.regs[active.pop(0).reg]
+                free.append(r)
+                free.sort(key=order.get)
+            if free:
+                r = iv.hint if iv.hint in free else free[0]
+                free.remove(r)
+                alloc.regs[iv.reg] = r
+                self._activate(active, iv)
+                continue
+            last = active[-1]
+            if last.end > iv.end:
+                alloc.regs[iv.reg] = alloc.regs.pop(last.reg)
+                self._spill(last, alloc)
+                active.pop()
+                self._activate(active, iv)
+            else:
+                self._spill(iv, alloc)
+
+    def _activate(self, active, iv):
+        i = len(active)
+        while i > 0 and active[i - 1].end > iv.end:
+            i -= 1
+        active.insert(i, iv)
+
+    def _spill(self, iv, alloc):
+        ends = self._slot_ends
+        slot = 0
+        while slot < len(ends) and ends[slot] >= iv.start:
+            slot += 1
+        if slot == len(ends):
+            ends.append(iv.end)
+            alloc.nslots += 1
+        else:
+            ends[slot] = iv.end
+        alloc.slots[iv.reg] = slot
+        alloc.spills += 1
+
+    def report(self):
+        '''
+        lines of the spill count of every function
+        '''
+        lines = ['{} spills'.format(sum(self.spills.values()))]
+        for name in sorted(self.spills, key=lambda k: -self.spills[k]):
+            lines.append('  {:<24} {:>8}'.format(name, self.spills[name]))
+        return lines
@@ -0,0 +1,51 @@
+'''
+Copyright 2018 JackLiang.
+
+sethi-ullman numbering of expression trees
+'''
+from astc import *
+
+# operators whose left operand is evaluated first
+SEQUENCED = (NodeKind.OP_LOGAND, NodeKind.OP_LOGOR)
+
+def label(root, needs):
+    '''
+    fill needs, id(node) -> registers the evaluation of the subtree
+    needs, for root and the nodes below it that have no number yet.
+    a leaf needs one, a binary node one more than its operands when
+    they need the same and what the heavier needs otherwise
+    '''
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        if node is None or id(node) in needs:
+            continue
+        if isinstance(node, BinaryNode):
+            if not done:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+                continue
+            l = needs.get(id(node.left), 0) if not node.left is None else 0
+            r = needs.get(id(node.right), 0) if not node.right is None else 0
+            needs[id(node)] = l + 1 if l == r else max(l, r)
+        elif isinstance(node, UnaryNode):
+            if not done:
+                stack.append((node, True))
+                stack.append((node.operand, False))
+                continue
+            needs[id(node)] = max(needs.get(id(node.operand), 0) if not node.operand is None else 0, 1)
+        else:
+            needs[id(node)] = 1
+    return needs
+
+def right_first(node, needs):
+    '''
+    whether the right operand of the binary node is evaluated first:
+    it needs more registers and C leaves the order to the compiler
+    '''
+    if node.kind in SEQUENCED or node.left is None or node.right is None:
+        return False
+    if not id(node) in needs:
+        label(node, needs)
+    return needs[id(node.right)] > needs[id(node.left)]
@@ -0,0 +1,64 @@
+import sys
+import time
+import tracemalloc
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from astc import *
+
+# only constructs the parser already handles
+UNIT = '''int table_{0} = 2|3*6;
+int func_{0}(){{
+  int b = 6/2+{0};
+  if (1){{
+    int c = 7 << 2;
+  }}else{{
+    int d = !{0} - 111 % 4;
+  }}
+}}
+'''
+
+def synthetic(units):
+    return ''.join(UNIT.format(i) for i in range(units))
+
+CHILDREN = ('declvar', 'declinit', 'initval', 'left', 'right', 'operand',
+            'params', 'localvars', 'body', 'stmts', 'cond', 'then', 'els')
+
+def walk(nodes, seen):
+    for node in nodes:
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        for attr in CHILDREN:
+            child = getattr(node, attr, None)
+            if isinstance(child, list):
+                walk(child, seen)
+            elif isinstance(child, Node):
+                walk([child], seen)
+    return seen
+
+def shallow_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lexer = Lexer('bench.c', synthetic(units))
+    lexer.lex()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    p = Parser(lexer.tokens)
+    p.parse()
+    elapsed = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    nodes = walk(p.ast, set())
+    print('parse: {:.2f}s, {} nodes'.format(elapsed, len(nodes)))
+    print('retained by the parse: {} bytes, {:.1f} bytes/node'.format(retained, retained / len(nodes)))
+    node = p.ast[0]
+    print('DeclNode object: {} bytes, ValueNode object: {} bytes'.format(
+        shallow_size(node), shallow_size(node.declinit[0].initval.operand)))
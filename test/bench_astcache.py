@@ -0,0 +1,29 @@
+import sys
+import os
+import time
+import tempfile
+sys.path.append("..")
+from utils.diskcache import DiskCache
+from bench_ast import synthetic
+import pcc
+
+def timed(run):
+    start = time.perf_counter()
+    r = run()
+    return r, time.perf_counter() - start
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'bench.c')
+        with open(path, 'w') as f:
+            f.write(synthetic(units))
+        cache = DiskCache(os.path.join(d, 'cache'))
+        parsed = min(timed(lambda: pcc.frontend(path))[1] for _ in range(3))
+        (ast, location), miss = timed(lambda: pcc.frontend(path, cache))
+        hit = min(timed(lambda: pcc.frontend(path, cache))[1] for _ in range(5))
+    print('{} top-level items'.format(len(ast)))
+    print('lex + parse:         {:.3f}s'.format(parsed))
+    print('miss (parse + dump): {:.3f}s'.format(miss))
+    print('hit  (hash + load):  {:.3f}s'.format(hit))
+    print('speedup: {:.1f}x'.format(parsed / hit))
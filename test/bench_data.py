@@ -0,0 +1,31 @@
+import sys
+import io
+sys.path.append("..")
+from gen import Emit
+from bench_gen import timed
+from test_data import glob, sparse, tm
+
+def emit(decls):
+    out = io.StringIO()
+    Emit(out).emit(decls)
+    return out.getvalue()
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    # a table of small constants and a buffer that is zero but for a few
+    # elements
+    table = glob('table', tm.type_int(), [i % 7 for i in range(n)], n)
+    buf = [0] * n
+    for i in range(0, n, 4096):
+        buf[i] = 1
+    buffer = glob('buffer', tm.type_char(), buf, n)
+    zero = glob('zero', tm.type_long(), [0], n)
+    print('{} elements'.format(n))
+    for name, decls in (('table', [table]), ('buffer', [buffer]), ('zero', [zero])):
+        asm, t = timed(lambda: emit(decls), 1)
+        print('{:<8} {:>10} bytes {:>8} lines {:.3f}s'.format(name, len(asm), asm.count('\n'), t))
+    # the time grows with the count of elements, not faster
+    for count in (20000, 80000):
+        decls = [sparse(count)]
+        asm, t = timed(lambda: emit(decls))
+        print('sparse {:>8} elements {:>6} bytes {:.4f}s'.format(count, len(asm), t))
@@ -0,0 +1,20 @@
+import sys
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from frame import FrameLayout
+from bench_gen import FUNC, timed
+
+def frames(ast, pack):
+    return sum(FrameLayout(f, pack).size for f in ast if hasattr(f, 'localvars'))
+
+if __name__ == '__main__':
+    funcs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lexer = Lexer('bench.c', ''.join(FUNC.format(i) for i in range(funcs)))
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    print('{} functions'.format(funcs))
+    for name, pack in (('declaration order', False), ('packed', True)):
+        size, t = timed(lambda: frames(p.ast, pack))
+        print('{:<20} {:>10} frame bytes {:.3f}s'.format(name, size, t))
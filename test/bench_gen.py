@@ -0,0 +1,48 @@
+import sys
+import os
+import tempfile
+import time
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from gen import Emit
+
+# only constructs the parser already handles, folding is off so the
+# expressions reach the code generator
+FUNC = '''int table_{0} = {0} * 4 + 1;
+int func_{0}(int a, char b, long c){{
+  int x = 1 + 2 * {0} - 6 / 3 % 5;
+  long y = {0} << 3 | 7 & 12 ^ 1;
+  char z = {0} == 3 && 4 < 5 || !{0};
+  if (1 < {0}){{
+    int d = -{0} * 7 >> 2;
+  }}else{{
+    double e = 2.5;
+    int f = 3.75;
+  }}
+}}
+'''
+
+def timed(run, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        r = run()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return r, best
+
+def emit(ast, path):
+    with open(path, 'w') as out:
+        return Emit(out).emit(ast)
+
+if __name__ == '__main__':
+    funcs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lexer = Lexer('bench.c', ''.join(FUNC.format(i) for i in range(funcs)))
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    with tempfile.TemporaryDirectory() as d:
+        lines, t = timed(lambda: emit(p.ast, os.path.join(d, 'bench.s')))
+    print('{} functions, {} lines of assembly'.format(funcs, lines))
+    print('emit: {:.3f}s, {:.0f} lines/s'.format(t, lines / t))
@@ -0,0 +1,41 @@
+import sys
+import time
+sys.path.append("..")
+from lex import ScanLexer, RegexLexer
+
+UNIT = '''/* generated unit {0} */
+int table_{0} = 2|3*6;
+// helper
+int func_{0}(int a, int b){{
+  int b = 6/2 + {0}.5;
+  if (a <= b && b != 1){{
+    int c = a << 2;
+  }}else{{
+    int d = "name_{0}";
+  }}
+}}
+'''
+
+def synthetic(units):
+    return ''.join(UNIT.format(i) for i in range(units))
+
+def bench(engine, text, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lexer = engine('bench.c', text)
+        lexer.lex()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best, len(lexer.tokens)
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = synthetic(units)
+    print('source: {} chars'.format(len(text)))
+    results = {}
+    for engine in (ScanLexer, RegexLexer):
+        t, n = bench(engine, text)
+        results[engine.__name__] = t
+        print('{:12} {:8.3f}s {:9d} tokens {:10.0f} tokens/s'.format(engine.__name__, t, n, n / t))
+    print('speedup: {:.2f}x'.format(results['ScanLexer'] / results['RegexLexer']))
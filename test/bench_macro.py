@@ -0,0 +1,35 @@
+import sys
+import os
+import time
+import tempfile
+sys.path.append("..")
+from cpp import Preprocessor
+
+# a tower of object-like macros, each level used twice by the one above
+LEVEL = '#define L{0} L{1} + L{1}\n'
+USE = 'int v_{0} = ADD(L{1}, {0}) * L{1};\n'
+
+def run(path, memo):
+    pp = Preprocessor()
+    if not memo:
+        pp.define('UNBALANCED', '(') # an unbalanced macro turns the memo off
+    start = time.perf_counter()
+    count = sum(1 for _ in pp.preprocess(path))
+    return count, time.perf_counter() - start, pp.stats
+
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    uses = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'macros.c')
+        with open(path, 'w') as f:
+            f.write('#define L0 1\n#define ADD(a, b) a + b\n')
+            f.write(''.join(LEVEL.format(i + 1, i) for i in range(depth)))
+            f.write(''.join(USE.format(i, depth) for i in range(uses)))
+        run(path, True) # lex the file once, see cpp.FileCache
+        without = min((run(path, False) for _ in range(3)), key=lambda r: r[1])
+        memo = min((run(path, True) for _ in range(3)), key=lambda r: r[1])
+    print('{} levels, {} uses, {} tokens'.format(depth, uses, memo[0]))
+    print('without memo:  {:.3f}s'.format(without[1]))
+    print('with memo:     {:.3f}s ({:.1f}x)'.format(memo[1], without[1] / memo[1]))
+    print('\n'.join(memo[2].report(5)))
@@ -0,0 +1,38 @@
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+sys.path.append("..")
+from lex import RegexLexer
+from bench_lex import synthetic
+
+def read_lex(path):
+    with open(path, 'r') as f:
+        lexer = RegexLexer(path, f.read())
+    lexer.lex()
+    return lexer.tokens
+
+def mmap_lex(path):
+    lexer = RegexLexer.from_file(path)
+    lexer.lex()
+    return lexer.tokens
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    fd, path = tempfile.mkstemp(suffix='.c')
+    with os.fdopen(fd, 'w') as f:
+        f.write(synthetic(units))
+    print('source: {} bytes'.format(os.path.getsize(path)))
+    try:
+        for name, run in (('read+decode', read_lex), ('mmap', mmap_lex)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            tokens = run(path)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{:12} {:6.2f}s peak {:11d} bytes ({} tokens)'.format(name, elapsed, peak, len(tokens)))
+            del tokens
+    finally:
+        os.remove(path)
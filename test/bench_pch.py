@@ -0,0 +1,56 @@
+import sys
+import os
+import time
+import tempfile
+sys.path.append("..")
+from pch import build_pch, save_pch, read_pch
+import pcc
+
+# only constructs the parser already handles
+DECL = '''#define LIMIT_{0} {0}
+#define PICK_{0}(a, b) a + b * LIMIT_{0}
+int table_{0} = PICK_{0}(2, 3);
+int func_{0}(int a, int b){{
+  int c = 6 / 2 + {0};
+  if (1){{
+    int d = 7 << 2;
+  }}
+}}
+'''
+
+UNIT = '''#include "prologue.h"
+int unit_{0} = PICK_1({0}, 2);
+int unit_func_{0}(){{ int x = LIMIT_2 * {0}; }}
+'''
+
+def timed(run):
+    start = time.perf_counter()
+    r = run()
+    return r, time.perf_counter() - start
+
+if __name__ == '__main__':
+    decls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    units = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as d:
+        header = os.path.join(d, 'prologue.h')
+        with open(header, 'w') as f:
+            f.write('#pragma once\n' + ''.join(DECL.format(i) for i in range(decls)))
+        paths = []
+        for i in range(units):
+            paths.append(os.path.join(d, 'unit{}.c'.format(i)))
+            with open(paths[-1], 'w') as f:
+                f.write(UNIT.format(i))
+        pch_path = os.path.join(d, 'prologue.pch')
+        snap, build = timed(lambda: save_pch(build_pch(header, pcc.COMPILER_VERSION), pch_path))
+        snap, load = timed(lambda: read_pch(pch_path))
+        # the header is lexed once either way, see cpp.FileCache
+        plain = [timed(lambda: pcc.frontend(p))[1] for p in paths]
+        with_pch = [timed(lambda: pcc.frontend(p, pch=snap))[1] for p in paths]
+    plain = sorted(plain)[len(plain) // 2]
+    with_pch = sorted(with_pch)[len(with_pch) // 2]
+    print('{} header declarations, {} units'.format(decls, units))
+    print('build pch:              {:.3f}s'.format(build))
+    print('load pch (once):        {:.3f}s'.format(load))
+    print('per unit, header:       {:.3f}s'.format(plain))
+    print('per unit, pch:          {:.3f}s'.format(with_pch))
+    print('saved per unit:         {:.3f}s ({:.1f}x)'.format(plain - with_pch, plain / with_pch))
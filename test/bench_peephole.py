@@ -0,0 +1,29 @@
+import sys
+import io
+import time
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from gen import Emit
+from peephole import Peephole
+from bench_gen import FUNC, timed
+
+def emit(ast, ph):
+    out = io.StringIO()
+    Emit(out, ph).emit(ast)
+    return out.getvalue()
+
+if __name__ == '__main__':
+    funcs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lexer = Lexer('bench.c', ''.join(FUNC.format(i) for i in range(funcs)))
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    plain, t_plain = timed(lambda: emit(p.ast, None))
+    ph = Peephole()
+    emit(p.ast, ph)
+    print('{} functions'.format(funcs))
+    print('\n'.join(ph.report()))
+    print('reduction: {:.1f}%'.format(100.0 * ph.removed / ph.seen))
+    optimized, t_opt = timed(lambda: emit(p.ast, Peephole()))
+    print('emit: {:.3f}s, with peephole {:.3f}s'.format(t_plain, t_opt))
@@ -0,0 +1,43 @@
+import sys
+import io
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from gen import Emit
+from regalloc import LinearScan
+from bench_gen import FUNC, timed
+
+def traffic(asm):
+    '''
+    (instructions, instructions that read or write memory)
+    '''
+    n = mem = 0
+    for line in asm.splitlines():
+        if not line.startswith('\t') or line.startswith('\t.'):
+            continue
+        n += 1
+        op = line.split()[0]
+        if '(%r' in line and not '(%rip)' in line or op.startswith('push') or op.startswith('pop'):
+            mem += 1
+    return n, mem
+
+def emit(ast, **options):
+    out = io.StringIO()
+    Emit(out, **options).emit(ast)
+    return out.getvalue()
+
+if __name__ == '__main__':
+    funcs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lexer = Lexer('bench.c', ''.join(FUNC.format(i) for i in range(funcs)))
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    print('{} functions, -O0'.format(funcs))
+    runs = [('stack machine', {}),
+            ('linear scan', {'level': 0, 'allocator': LinearScan()}),
+            ('linear scan, 3 registers', {'level': 0, 'allocator': LinearScan(('%rsi', '%rdi', '%rbx'), ('%xmm8',))})]
+    for name, options in runs:
+        asm, t = timed(lambda: emit(p.ast, **options), 1)
+        n, mem = traffic(asm)
+        spills = sum(options['allocator'].spills.values()) if 'allocator' in options else '-'
+        print('{:<26} {:>8} instructions {:>8} memory {:>6} spills {:.3f}s'.format(name, n, mem, spills, t))
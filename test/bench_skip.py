@@ -0,0 +1,56 @@
+import sys
+import os
+import time
+import tempfile
+sys.path.append("..")
+from lex import RegexLexer
+from cpp import Preprocessor, FileCache
+
+ACTIVE = '''int active_{0} = {0} * 2;
+int active_func_{0}(int a){{ int b = a + {0}; }}
+'''
+
+# platform branches which are never taken, 9 of them for every active block
+INACTIVE = '''#ifdef PLATFORM_{0}_{1}
+/* the {1} implementation, "#endif" in a comment */
+typedef struct platform_{0}_{1} {{ int handle; char name[32]; }} platform_{0}_{1};
+static int platform_{0}_{1}_open(const char *path, int flags) {{
+    return path[0] == '/' ? flags | 0x{1} : -1;
+}}
+#if PLATFORM_{0}_{1}_VERSION > 2
+#define PLATFORM_{0}_{1}_FAST 1
+#endif
+#endif
+'''
+
+def timed(run, repeat=5):
+    best = None
+    for _ in range(repeat):
+        FileCache().clear()
+        start = time.perf_counter()
+        run()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+def lex_all(path):
+    # what the preprocessor did before: lex the whole file
+    with open(path, 'rb') as f:
+        RegexLexer(path, f.read(), directives=True).lex()
+
+if __name__ == '__main__':
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'platform.h')
+        with open(path, 'w') as f:
+            for i in range(blocks):
+                f.write(ACTIVE.format(i))
+                f.write(''.join(INACTIVE.format(i, j) for j in range(9)))
+        size = os.path.getsize(path)
+        lexed = timed(lambda: lex_all(path))
+        scanned = timed(lambda: FileCache().get(path))
+        preprocessed = timed(lambda: list(Preprocessor().preprocess(path)))
+    print('{} blocks, {} bytes, 90% inactive'.format(blocks, size))
+    print('lex the whole file:      {:.3f}s'.format(lexed))
+    print('scan for directives:     {:.3f}s'.format(scanned))
+    print('preprocess:              {:.3f}s ({:.1f}x faster than lexing it all)'.format(preprocessed, lexed / preprocessed))
@@ -0,0 +1,25 @@
+import sys
+import time
+import tempfile
+sys.path.append("..")
+from lex import lex_cached
+from utils.diskcache import DiskCache
+from bench_lex import synthetic
+
+def timed(run):
+    start = time.perf_counter()
+    r = run()
+    return r, time.perf_counter() - start
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    text = synthetic(units)
+    with tempfile.TemporaryDirectory() as d:
+        cache = DiskCache(d)
+        tokens, miss = timed(lambda: lex_cached('bench.c', text, cache))
+        hits = [timed(lambda: lex_cached('bench.c', text, cache))[1] for _ in range(5)]
+    hit = min(hits)
+    print('source: {} chars, {} tokens'.format(len(text), len(tokens)))
+    print('miss (lex + store): {:.3f}s'.format(miss))
+    print('hit  (hash + load): {:.3f}s'.format(hit))
+    print('speedup: {:.1f}x'.format(miss / hit))
@@ -0,0 +1,34 @@
+import sys
+import time
+import tracemalloc
+sys.path.append("..")
+from lex import Lexer, TokenBuffer
+from bench_lex import synthetic
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tokens = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tokens, size, elapsed
+
+def token_list(text):
+    return list(Lexer('bench.c', text).iter_tokens())
+
+def token_buffer(text):
+    lexer = Lexer('bench.c', text)
+    lexer.lex()
+    return lexer.tokens
+
+if __name__ == '__main__':
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 18000 # about 1M tokens
+    text = synthetic(units)
+    results = []
+    for name, build in (('Token list', token_list), ('TokenBuffer', token_buffer)):
+        tokens, size, elapsed = measure(lambda: build(text))
+        results.append(size)
+        print('{:12} {:9d} tokens {:12d} bytes {:6.1f} bytes/token {:6.2f}s'.format(name, len(tokens), size, size / len(tokens), elapsed))
+        del tokens
+    print('reduction: {:.2f}x'.format(results[0] / results[1]))
@@ -0,0 +1,97 @@
+import sys
+import os
+import tempfile
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from astc import *
+from astcache import dump_ast, load_ast
+from utils.diskcache import DiskCache
+import pcc
+
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
+
+def type_shape(ty):
+    if ty is None:
+        return None
+    return (ty.kind, ty.size, ty.align, ty.usig, ty.isstatic, ty.scalss, ty.varname,
+            type_shape(ty.ptr), ty.array_len, type_shape(ty.ret_type),
+            None if ty.params is None else [type_shape(p) for p in ty.params], ty.hasva)
+
+def full_shape(node, location):
+    '''
+    ast shape with the types and the source location of every node
+    '''
+    if isinstance(node, list):
+        return [full_shape(n, location) for n in node]
+    if not isinstance(node, Node):
+        return node
+    shape = [type(node).__name__, node.kind, type_shape(node.ty), location(node.sourceloc)]
+    for attr in ('val', 'name', 'fname', 'declvar', 'declinit', 'initval', 'totype',
+                 'left', 'right', 'operand', 'params', 'localvars', 'body',
+                 'stmts', 'cond', 'then', 'els'):
+        if hasattr(node, attr):
+            v = getattr(node, attr)
+            shape.append(type_shape(v) if attr == 'totype' else full_shape(v, location))
+    return tuple(shape)
+
+def coord(c):
+    return None if c is None else (c.filename, c.line, c.column)
+
+def parse_text(text):
+    l = Lexer('s.c', text)
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    return p
+
+def parse_file(path):
+    with open(path, 'r') as f:
+        l = Lexer('t1.c', f.read())
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    return p
+
+def test_round_trip():
+    p = parse_file(T1)
+    data = dump_ast(p.ast, p.location)
+    ast, locations = load_ast(data)
+    assert len(ast) == len(p.ast)
+    location = lambda i: coord(p.location(i))
+    loaded = lambda i: coord(locations.location(i))
+    assert full_shape(ast, loaded) == full_shape(p.ast, location)
+    # the encoding is stable
+    assert dump_ast(ast, locations.location) == data
+
+def test_shared_nodes():
+    p = parse_text('int f(int a, int b){ int c = 1; }')
+    ast, locations = load_ast(dump_ast(p.ast, p.location))
+    f = ast[0]
+    assert len(f.params) == 2
+    # a local declaration and the function locals share the variable node
+    decl = f.body.stmts[0]
+    assert decl.declvar is f.localvars[0]
+    # and types are shared exactly as in the parsed tree
+    orig = p.ast[0]
+    assert (f.params[0].ty is f.params[1].ty) == (orig.params[0].ty is orig.params[1].ty)
+    assert (f.ty.ret_type is f.params[0].ty) == (orig.ty.ret_type is orig.params[0].ty)
+
+def test_bad_data():
+    try:
+        load_ast(b'XXXX' + bytes(64))
+        assert False
+    except ValueError:
+        pass
+
+def test_frontend_cache():
+    with tempfile.TemporaryDirectory() as d:
+        cache = DiskCache(d)
+        ast, location = pcc.frontend(T1, cache)
+        assert len(os.listdir(d)) == 1
+        cached, cached_location = pcc.frontend(T1, cache)
+        assert full_shape(cached, lambda i: coord(cached_location(i))) == \
+            full_shape(ast, lambda i: coord(location(i)))
+        plain, plain_location = pcc.frontend(T1)
+        assert full_shape(plain, lambda i: coord(plain_location(i))) == \
+            full_shape(ast, lambda i: coord(location(i)))
@@ -0,0 +1,271 @@
+import sys
+import os
+import time
+import tempfile
+sys.path.append("..")
+from cpp import Preprocessor, FileCache, spelling
+from lex import TokenKind
+from parse import Parser
+from astc import *
+from utils.diskcache import DiskCache
+import pcc
+
+def write(d, name, text):
+    path = os.path.join(d, name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+def run(d, text, **kw):
+    pp = Preprocessor(**kw)
+    tokens = list(pp.preprocess(write(d, 'main.c', text)))
+    assert tokens[-1].kind == TokenKind.TEOF
+    return ' '.join(spelling(t) for t in tokens[:-1]), pp
+
+def expect_error(d, text, message):
+    try:
+        run(d, text)
+        assert False
+    except Exception as e:
+        assert message in str(e), str(e)
+
+def test_macros():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define N 4\n'
+                         '#define ADD(a, b) ((a) + (b))\n'
+                         '#define STR(x) #x\n'
+                         '#define CAT(a, b) a ## b\n'
+                         '#define V(...) f(__VA_ARGS__)\n'
+                         'int CAT(x, N) = ADD(N, 1);\n'
+                         'char *s = STR(a  + "b");\n'
+                         'V(1, 2) V()\n'
+                         'ADD\n')
+        assert out == ('int xN = ( ( 4 ) + ( 1 ) ) ; char * s = "a + \\"b\\"" ; '
+                       'f ( 1 , 2 ) f ( ) ADD')
+
+def test_object_paste():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define CAT a ## b\n'
+                         'int CAT;\n')
+        assert out == 'int ab ;'
+        # the hash_hash example of C11, the '##' made by pasting is no operator
+        out, pp = run(d, '#define hash_hash # ## #\n'
+                         '#define mkstr(a) # a\n'
+                         '#define in_between(a) mkstr(a)\n'
+                         '#define join(c, d) in_between(c hash_hash d)\n'
+                         'char p[] = join(x, y);\n'
+                         'hash_hash\n')
+        assert out == 'char p [ ] = "x ## y" ; ##'
+        # the pasted body is made once
+        m = pp.macros['hash_hash']
+        assert [spelling(t) for t in m.pasted] == ['##']
+        expect_error(d, '#define E ## a\nE\n', 'either end')
+
+def test_placemarkers():
+    with tempfile.TemporaryDirectory() as d:
+        # EXAMPLE 5 of C11 6.10.3.5
+        out, pp = run(d, '#define t(x,y,z) x ## y ## z\n'
+                         'int j[] = { t(1,2,3), t(,4,5), t(6,,7), t(8,9,),\n'
+                         '  t(10,,), t(,11,), t(,,12), t(,,) };\n')
+        assert out == 'int j [ ] = { 123 , 45 , 67 , 89 , 10 , 11 , 12 , } ;'
+        out, pp = run(d, '#define f(x,y) a x ## y ## b\nf(,)\n')
+        assert out == 'a b'
+        expect_error(d, '#define E(x) x ##\n', 'either end')
+
+def test_line_continuation():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define SUM(a, b) \\\n  a + \\\r\n b\nint x = SUM(1, 2);\n')
+        assert out == 'int x = 1 + 2 ;'
+        # a '#' on a line spliced to the one before starts no directive
+        for nl in ('\n', '\r\n'):
+            out, pp = run(d, 'int x = 1 \\' + nl + '#define NOT 2' + nl + 'int y = NOT;' + nl)
+            assert out == 'int x = 1 # define NOT 2 int y = NOT ;'
+
+def test_recursion_is_blocked():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define foo foo + 1\n'
+                         '#define a b\n'
+                         '#define b a\n'
+                         'foo a b\n')
+        assert out == 'foo + 1 a b'
+
+def test_conditionals():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define TWO 2\n'
+                         '#if defined(TWO) && TWO * 3 == 6 && !defined THREE\n'
+                         'yes\n'
+                         '#elif 1\n'
+                         'no\n'
+                         '#endif\n'
+                         '#if 0\n'
+                         '#if 1\n'
+                         'skipped garbage\n'
+                         '#endif\n'
+                         '#elif 0 && 1 / 0\n'
+                         'no\n'
+                         '#elif (1 ? 2 : 3) == 2\n'
+                         'elif\n'
+                         '#else\n'
+                         'no\n'
+                         '#endif\n'
+                         '#ifndef TWO\n'
+                         'no\n'
+                         '#else\n'
+                         'else\n'
+                         '#endif\n')
+        assert out == 'yes elif else'
+
+def test_errors():
+    with tempfile.TemporaryDirectory() as d:
+        expect_error(d, '#if 1\nint a;\n', 'unterminated conditional directive')
+        expect_error(d, '#endif\n', '#endif without #if')
+        expect_error(d, '#error stop here\n', '#error stop here')
+        expect_error(d, '#include "missing.h"\n', 'file not found')
+        expect_error(d, '#define F(a) a\nF(1, 2)\n', 'requires 1 arguments')
+        expect_error(d, '#if 1 / 0\n#endif\n', 'division by zero')
+
+def test_includes():
+    with tempfile.TemporaryDirectory() as d:
+        os.mkdir(os.path.join(d, 'inc'))
+        write(os.path.join(d, 'inc'), 'sys.h', 'int sys;\n')
+        write(d, 'local.h', '#include <sys.h>\nint local;\n')
+        out, pp = run(d, '#include "local.h"\n#define H <sys.h>\n#include H\nint main;\n',
+                      include_paths=[os.path.join(d, 'inc')])
+        assert out == 'int sys ; int local ; int sys ; int main ;'
+        assert [os.path.basename(p) for p in pp.dependencies] == ['local.h', 'sys.h']
+
+def test_header_guards():
+    with tempfile.TemporaryDirectory() as d:
+        guarded = write(d, 'g.h', '/* guard */\n#ifndef G_H\n#define G_H\nint g;\n#endif\n')
+        once = write(d, 'o.h', '#pragma once\nint o;\n')
+        plain = write(d, 'p.h', '#ifndef P_H\n#define P_H\n#endif\nint p;\n')
+        files = FileCache()
+        assert files.get(guarded).guard == 'G_H'
+        assert files.get(once).once
+        assert files.get(plain).guard is None
+        text = '#include "g.h"\n#include "o.h"\n' * 3 + '#include "p.h"\n' * 2
+        hits = files.hits
+        out, pp = run(d, text)
+        assert out == 'int g ; int o ; int p ; int p ;'
+        # the repeated guarded includes never reach the file cache
+        assert files.hits - hits == 4
+
+def test_header_lexed_once():
+    with tempfile.TemporaryDirectory() as d:
+        write(d, 'h.h', '#define ONE 1\n')
+        files = FileCache()
+        misses = files.misses
+        run(d, '#include "h.h"\nONE\n')
+        run(d, '#include "h.h"\nONE\n')
+        # main.c is rewritten between the runs, h.h is lexed once
+        assert files.misses - misses == 3
+        path = write(d, 'h.h', '#define ONE 1\n#define TWO 2\n')
+        os.utime(path, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+        out, pp = run(d, '#include "h.h"\nONE TWO\n')
+        assert out == '1 2'
+
+def test_parse_preprocessed():
+    with tempfile.TemporaryDirectory() as d:
+        write(d, 'h.h', '#ifndef H\n#define H\n#define INIT 2 | 3 * 6\n#endif\n')
+        path = write(d, 'main.c', '#include "h.h"\n#include "h.h"\nint a = INIT;\nint f(){ int b = INIT; }\n')
+        p = Parser(Preprocessor().preprocess(path))
+        p.parse()
+        assert [type(n).__name__ for n in p.ast] == ['DeclNode', 'FuncNode']
+        c = p.location(p.ast[0].sourceloc)
+        assert (os.path.basename(c.filename), c.line) == ('main.c', 3)
+
+def init_value(decl):
+    node = decl.declinit[0].initval
+    while isinstance(node, UnaryNode):
+        node = node.operand # conversion to the declared type
+    return node.val
+
+def test_frontend_header_change():
+    with tempfile.TemporaryDirectory() as d:
+        header = write(d, 'h.h', '#define V 1\n')
+        path = write(d, 'main.c', '#include "h.h"\nint a = V;\n')
+        cache = DiskCache(os.path.join(d, 'cache'))
+        ast, location = pcc.frontend(path, cache)
+        assert init_value(ast[0]) == 1
+        ast, location = pcc.frontend(path, cache)
+        assert init_value(ast[0]) == 1
+        write(d, 'h.h', '#define V 22\n')
+        ast, location = pcc.frontend(path, cache)
+        assert init_value(ast[0]) == 22
+
+def test_hidesets():
+    with tempfile.TemporaryDirectory() as d:
+        # the example of the C standard, 6.10.3.5
+        out, pp = run(d, '#define x 3\n'
+                         '#define f(a) f(x * (a))\n'
+                         '#undef x\n'
+                         '#define x 2\n'
+                         '#define g f\n'
+                         '#define z z[0]\n'
+                         '#define h g(~\n'
+                         '#define m(a) a(w)\n'
+                         '#define w 0,1\n'
+                         '#define t(a) a\n'
+                         'f(y+1) + f(f(z)) % t(t(g)(0) + t)(1);\n'
+                         'g(x+(3,4)-w) | h 5) & m\n'
+                         '(f)^m(m);\n')
+        assert out == ('f ( 2 * ( y + 1 ) ) + f ( 2 * ( f ( 2 * ( z [ 0 ] ) ) ) ) % f ( 2 * ( 0 ) ) + t ( 1 ) ; '
+                       'f ( 2 * ( 2 + ( 3 , 4 ) - 0 , 1 ) ) | f ( 2 * ( ~ 5 ) ) & f ( 2 * ( 0 , 1 ) ) ^ m ( 0 , 1 ) ;')
+        # f is in the hideset of the g from its own body
+        out, pp = run(d, '#define f(a) a*g\n#define g f\nf(2)(9)\n')
+        assert out == '2 * f ( 9 )'
+
+def test_memo():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define N 1 + M\n'
+                         '#define M 3\n'
+                         'N N N\n'
+                         '#undef M\n'
+                         '#define M 4\n'
+                         'N __LINE__\n'
+                         '#define L __LINE__\n'
+                         'L L\n')
+        assert out == '1 + 3 1 + 3 1 + 3 1 + 4 6 8 8'
+        # M changed after the N entry was made, L depends on its site
+        assert (pp.stats.memo_hits, pp.stats.memo_misses) == (2, 4)
+        # an unbalanced macro body may take tokens after the expansion
+        out, pp = run(d, '#define F(a) [a]\n#define G F(\nG 1) G 2)\n')
+        assert out == '[ 1 ] [ 2 ]'
+        assert pp.stats.memo_hits == 0
+
+def test_stats():
+    with tempfile.TemporaryDirectory() as d:
+        out, pp = run(d, '#define ONE 1\n#define INC(a) a + ONE\nINC(2)\nINC(INC(3))\n')
+        assert out == '2 + 1 3 + 1 + 1'
+        stats = pp.stats
+        assert stats.expansions == {'INC': 3, 'ONE': 3}
+        assert sorted(stats.sites.values()) == [1, 1]
+        assert stats.time >= 0 and stats.report()[0].startswith('6 expansions')
+
+def test_inactive_not_lexed():
+    with tempfile.TemporaryDirectory() as d:
+        text = ('#if 0\n'
+                'don\'t ` lex @ this\n'
+                'char *c = "/*"; // /* no comment\n'
+                '#ifdef NESTED\n'
+                '# else\n'
+                '#endif\n'
+                '/*\n'
+                '#endif in a comment\n'
+                '*/\n'
+                'char *s = "#endif";\n'
+                '#elif 1 /* a comment over\n'
+                '   two lines */\n'
+                'int a;\n'
+                '#else\n'
+                'more ` garbage\n'
+                '#endif\n'
+                'int b = __LINE__;\n')
+        out, pp = run(d, text)
+        assert out == 'int a ; int b = 17 ;'
+        f = FileCache().get(os.path.join(d, 'main.c'))
+        assert f.directive_names == ['if', 'ifdef', 'else', 'endif', 'elif', 'else', 'endif']
+        # the lines of the taken branch, the #if, #elif and #else run and the text after
+        assert [n for n, r in enumerate(f.ranges) if not r is None] == [0, 1, 9, 10, 11, 14]
+        expect_error(d, '#if 0\n#else\nint a;\n#else\n#endif\n', '#else after #else')
+        expect_error(d, 'int a;\n#if 0\nint b;\n', 'line:2 unterminated conditional directive')
@@ -0,0 +1,75 @@
+import sys
+import io
+sys.path.append("..")
+from astc import NodeFactory, VarNode, NodeKind
+from ctype import TypeMaker
+from gen import Emit
+from test_gen import compile, lines, assemble, PROGRAM
+
+tm = TypeMaker()
+nf = NodeFactory(None)
+
+def glob(name, ty, values, length=None):
+    '''
+    DeclNode of a global of type ty, an array of length elements when
+    length is given
+    '''
+    var = VarNode(name)
+    var.ty = ty if length is None else tm.make_array_type(ty, length)
+    var.kind = NodeKind.AST_GVAR
+    return nf.decl_node(var, [nf.init_node(nf.val_node(ty, v), ty) for v in values])
+
+def emit(decls):
+    out = io.StringIO()
+    Emit(out).emit(decls)
+    return lines(out.getvalue())
+
+def test_sections():
+    asm = lines(compile(PROGRAM))
+    bss = asm.index('.bss')
+    assert asm[bss:bss + 5] == ['.bss', '.globl zero', '.align 4', 'zero:', '.zero 4']
+    # the largest alignment first
+    data = [l[:-1] for l in asm[asm.index('.data'):bss] if l.endswith(':')]
+    assert data == ['big', 'd', 'us', 'c']
+    assemble('\n'.join(asm) + '\n')
+
+def test_zero_globals():
+    asm = emit([glob('a', tm.type_int(), [0, 0], 100), glob('b', tm.type_double(), [0.0]),
+                glob('n', tm.type_double(), [-0.0])])
+    assert asm.index('.bss') > asm.index('n:')
+    assert asm[asm.index('a:') + 1] == '.zero 400' and asm[asm.index('b:') + 1] == '.zero 8'
+    assert asm[asm.index('n:') + 1] == '.quad 9223372036854775808'
+
+def test_packed():
+    values = [1, 2] + [0] * 20 + [3, 0, 4] + list(range(1, 21))
+    asm = emit([glob('a', tm.type_int(), values, 100)])
+    i = asm.index('a:')
+    assert asm[i + 1:i + 6] == ['.long 1, 2', '.zero 80', '.long 3, 0, 4, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13',
+                                '.long 14, 15, 16, 17, 18, 19, 20', '.zero 220']
+    # short trailing zeros run into the elements the initializer leaves out
+    asm = emit([glob('b', tm.type_char(), [1, 0, 0], 8), glob('c', tm.type_char(), [1, 0, 0], 20)])
+    assert asm[asm.index('b:') + 1:asm.index('b:') + 3] == ['.byte 1, 0, 0', '.zero 5']
+    assert asm[asm.index('c:') + 1:asm.index('c:') + 3] == ['.byte 1', '.zero 19']
+    assemble('\n'.join(asm) + '\n')
+
+def test_excess():
+    try:
+        emit([glob('a', tm.type_int(), [1, 2, 3], 2)])
+        assert False
+    except Exception as e:
+        assert 'excess elements' in str(e)
+
+def sparse(n):
+    '''
+    an int array of n elements, zero but for every 1000th one
+    '''
+    values = [0] * n
+    for i in range(0, n, 1000):
+        values[i] = i
+    return glob('t', tm.type_int(), values, n)
+
+def test_linear():
+    # the timing is in bench_data.py
+    small = len(emit([sparse(20000)]))
+    big = len(emit([sparse(80000)]))
+    assert big < 4 * small + 10 and big < 1000
@@ -0,0 +1,117 @@
+import sys
+import os
+import io
+import tempfile
+sys.path.append("..")
+from astcache import load_ast
+from test_cpp import write, init_value
+import pcc
+from pch import build_pch, save_pch
+
+def sources(d, count):
+    write(d, 'common.h', '#define SCALE 3\n')
+    paths = []
+    for i in range(count):
+        text = '#include "common.h"\nint v{0} = {0};\nint s{0} = SCALE;\n'.format(i)
+        if i % 3 == 1:
+            text = '#warning unit {0}\n'.format(i) + text
+        paths.append(write(d, 'unit{}.c'.format(i), text))
+    return paths
+
+def run(argv):
+    out = io.StringIO()
+    status = pcc.main(argv, out)
+    return status, out.getvalue().splitlines()
+
+def test_parallel_build():
+    with tempfile.TemporaryDirectory() as d:
+        paths = sources(d, 8)
+        bad = write(d, 'bad.c', 'int a = ;\n')
+        out_dir = os.path.join(d, 'out')
+        status, lines = run(['-j', '3', '-o', out_dir] + paths[:4] + [bad] + paths[4:])
+        assert status == 1
+        # diagnostics in the order of the files, whatever worker compiled them
+        assert [l.split('#warning ')[-1] for l in lines if '#warning' in l] == ['unit 1', 'unit 4', 'unit 7']
+        assert [n for n, l in enumerate(lines) if 'error:' in l] == [1]
+        assert lines[1].startswith(bad + ': error:')
+        assert lines[-1] == '8 rebuilt, 0 reused, 1 failed'
+        for i, path in enumerate(paths):
+            with open(pcc.output_path(path, out_dir), 'rb') as f:
+                ast, locations = load_ast(f.read())
+            assert (init_value(ast[0]), init_value(ast[1])) == (i, 3)
+        assert not os.path.exists(pcc.output_path(bad, out_dir))
+
+def test_serial_matches_parallel():
+    with tempfile.TemporaryDirectory() as d:
+        paths = sources(d, 4)
+        outputs = []
+        for jobs in ('1', '2'):
+            status, lines = run(['-j', jobs, '-B', '-DSCALE=5'] + paths)
+            assert status == 0 and lines[-1] == '4 rebuilt, 0 reused, 0 failed'
+            data = []
+            for path in paths:
+                with open(pcc.output_path(path), 'rb') as f:
+                    data.append(f.read())
+            outputs.append(data)
+        assert outputs[0] == outputs[1]
+
+def test_incremental_build():
+    with tempfile.TemporaryDirectory() as d:
+        paths = sources(d, 6)
+        write(d, 'other.h', 'int other;\n')
+        paths.append(write(d, 'other.c', '#include "other.h"\n'))
+        status, lines = run(['-j', '2'] + paths)
+        assert lines[-1] == '7 rebuilt, 0 reused, 0 failed'
+        status, lines = run(['-j', '2'] + paths)
+        # nothing is compiled, so no #warning either
+        assert lines == ['0 rebuilt, 7 reused, 0 failed']
+        write(d, 'other.h', 'int other;\nint more;\n')
+        write(d, 'unit2.c', 'int changed;\n')
+        assert run(paths)[1][-1] == '2 rebuilt, 5 reused, 0 failed'
+        # the options and the compiler version are in the manifest too
+        assert run(['-DEXTRA'] + paths)[1][-1] == '7 rebuilt, 0 reused, 0 failed'
+        pcc.COMPILER_VERSION, version = '9.9.9', pcc.COMPILER_VERSION
+        try:
+            assert run(['-DEXTRA', '-j', '1'] + paths)[1][-1] == '7 rebuilt, 0 reused, 0 failed'
+        finally:
+            pcc.COMPILER_VERSION = version
+        assert run(['-DEXTRA'] + paths)[1][-1] == '7 rebuilt, 0 reused, 0 failed'
+        os.remove(pcc.output_path(paths[0]))
+        assert run(['-DEXTRA'] + paths)[1][-1] == '1 rebuilt, 6 reused, 0 failed'
+        assert run(['-DEXTRA', '-B'] + paths)[1][-1] == '7 rebuilt, 0 reused, 0 failed'
+
+def test_stale_pch():
+    with tempfile.TemporaryDirectory() as d:
+        header = write(d, 'pro.h', '#ifndef PRO_H\n#define PRO_H\n#define N 1\n#endif\n')
+        pch_path = os.path.join(d, 'pro.pch')
+        save_pch(build_pch(header, pcc.COMPILER_VERSION), pch_path)
+        unit = write(d, 'u.c', 'int u = N;\n')
+        assert run(['--pch', pch_path, unit])[1] == ['1 rebuilt, 0 reused, 0 failed']
+        assert run(['--pch', pch_path, unit])[1] == ['0 rebuilt, 1 reused, 0 failed']
+        write(d, 'pro.h', '#ifndef PRO_H\n#define PRO_H\n#define N 2\n#endif\n')
+        for argv in ([], ['-B']):
+            status, lines = run(argv + ['--pch', pch_path, unit])
+            assert status == 1 and lines[0] == pch_path + ': error: precompiled header is out of date, build it again'
+            assert lines[-1] == '0 rebuilt, 0 reused, 1 failed'
+        save_pch(build_pch(header, pcc.COMPILER_VERSION), pch_path)
+        assert run(['--pch', pch_path, unit])[1] == ['1 rebuilt, 0 reused, 0 failed']
+        with open(pcc.output_path(unit), 'rb') as f:
+            ast, locations = load_ast(f.read())
+        assert init_value(ast[-1]) == 2
+
+def test_assembly():
+    with tempfile.TemporaryDirectory() as d:
+        unit = write(d, 'f.c', 'int g = 3;\nint f(int a){ int b = 2; if (1 < 3) { int c = 4; } }\n')
+        asm = pcc.output_path(unit, suffix='.s')
+        texts = []
+        for level in ([], ['-O0'], ['-O2']):
+            status, lines = run(['-S', '-B'] + level + [unit])
+            assert status == 0 and lines == ['1 rebuilt, 0 reused, 0 failed']
+            with open(asm) as f:
+                texts.append(f.read())
+            assert '.globl f' in texts[-1] and 'g:' in texts[-1]
+        assert texts[0] != texts[2]
+        assert not os.path.exists(pcc.output_path(unit))
+        assert run(['-S', '-O2', unit])[1] == ['0 rebuilt, 1 reused, 0 failed']
+        # the level is in the manifest
+        assert run(['-S', '-O1', unit])[1] == ['1 rebuilt, 0 reused, 0 failed']
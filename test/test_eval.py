@@ -0,0 +1,61 @@
+import sys
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from astc import *
+from ctype import TypeMaker
+from eval import Eval
+from csymbol import SymbolManager
+
+def parse(text, fold=True):
+    lexer = Lexer('eval.c', text)
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=fold)
+    p.parse()
+    return p.ast
+
+def init_node(text, fold=True):
+    return parse(text, fold)[0].declinit[0].initval
+
+def test_arith():
+    ev = Eval()
+    assert ev.arith(NodeKind.OP_ADD, 2 ** 31 - 1, 1, 32, False) == -2 ** 31
+    assert ev.arith(NodeKind.OP_SUB, 0, 1, 32, True) == 2 ** 32 - 1
+    assert ev.arith(NodeKind.OP_DIV, -7, 2, 32, False) == -3
+    assert ev.arith(NodeKind.OP_MOD, -7, 2, 32, False) == -1
+    assert ev.arith(NodeKind.OP_DIV, 1, 0, 32, False) is None
+    assert ev.arith(NodeKind.OP_SAR, -8, 1, 32, False) == -4
+    assert ev.arith(NodeKind.OP_SAR, -8, 1, 32, True) == (2 ** 32 - 8) >> 1
+    assert ev.arith(NodeKind.OP_SAL, 1, 31, 32, False) == -2 ** 31
+    assert ev.arith(NodeKind.OP_SAL, 1, 32, 32, False) is None
+    # -1 < 0u is false, both are converted to unsigned
+    tm = TypeMaker()
+    bits, usig = ev.common(tm.type_int(), tm.type_uint())
+    assert ev.arith(NodeKind.OP_L, -1, 0, bits, usig) == 0
+    assert ev.wrap_type(300, tm.type_uchar()) == 44
+    assert ev.wrap_type(2, tm.type_bool()) == 1
+
+def test_fold_in_parser():
+    node = init_node('int a = 2|3*6;')
+    assert type(node) == ValueNode and node.val == 18 and node.kind == NodeKind.AST_LITERAL
+    assert init_node('int a = 1 << 4 >> 2;').val == 4
+    assert init_node('int a = 2147483647 + 1;').val == -2 ** 31
+    assert init_node('int a = 0 && 1 / 0;').val == 0
+    assert init_node('int a = 1 || 1 / 0;').val == 1
+    assert init_node('int a = !5 - -3;').val == 3
+    # not a constant, the division stays
+    node = init_node('int a = 1 / 0;')
+    assert node.kind == NodeKind.AST_CONV and node.operand.kind == NodeKind.OP_DIV
+    # without folding the tree is kept as it is, Eval still computes it
+    node = init_node('int a = 2|3*6;', fold=False)
+    assert node.kind == NodeKind.AST_CONV and node.operand.kind == NodeKind.OP_BITOR
+    assert Eval().value(node) == 18
+
+def count(nodes):
+    return sum(1 for n in iter_nodes(nodes))
+
+def test_fewer_nodes():
+    text = ''.join('int t{0} = {0} * 4 + 1 << 2 | 3;\n'.format(i) for i in range(20))
+    folded, plain = parse(text), parse(text, False)
+    assert [n.declinit[0].initval.val for n in folded] == [((i * 4 + 1) << 2) | 3 for i in range(20)]
+    assert count(folded) * 3 < count(plain)
@@ -0,0 +1,58 @@
+import sys
+import os
+import io
+sys.path.append("..")
+from gen import Emit
+from frame import FrameLayout
+from ir import Lower
+from regalloc import LinearScan, live_intervals
+from test_gen import parse, assemble, PROGRAM
+
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
+
+def offsets(func, pack=True):
+    layout = FrameLayout(func, pack)
+    return dict((v.name, layout.offsets[id(v)]) for v in list(func.params) + list(func.localvars)), layout.size
+
+def test_disjoint_blocks():
+    with open(T1) as f:
+        ast = parse(f.read())
+    main = ast[-1]
+    slots, size = offsets(main)
+    assert slots == {'b': -4, 'c': -8, 'd': -8} and size == 16
+    slots, size = offsets(main, False)
+    assert slots == {'b': -4, 'c': -8, 'd': -12} and size == 16
+
+def test_nested_blocks():
+    func = parse('int f(){ int a = 1; if (1) { long b = 2; if (2) { char c = 3; } else { int d = 4; } }'
+                 ' else if (3) { char e = 5; } else { short g = 6; } int h = 7; }')[0]
+    slots, size = offsets(func)
+    # the blocks of one if share slots, the variables of the function
+    # stay below the blocks
+    assert slots == {'a': -4, 'h': -8, 'b': -16, 'c': -17, 'd': -20, 'e': -9, 'g': -10}
+    assert size == 32
+
+def test_alignment():
+    func = parse('int f(char a, long b){ char c = 1; int d = 2; double e = 3; }')[0]
+    slots, size = offsets(func)
+    assert sorted(slots.values()) == [-22, -21, -20, -16, -8] and size == 32
+    assert slots['b'] == -8 and slots['e'] == -16 and slots['d'] == -20
+    slots, size = offsets(func, False)
+    assert slots['e'] == -32 and size == 32
+    out = io.StringIO()
+    Emit(out).emit(parse('int f(char a, long b){ char c = 1; int d = 2; double e = 3; }'))
+    assert 'movsd\t%xmm0, -16(%rbp)' in out.getvalue()
+    assemble(out.getvalue())
+
+def test_shared_spill_slots():
+    func = Lower().lower(parse(PROGRAM)[-2])
+    alloc = LinearScan(('%rsi',), ('%xmm8',)).allocate(func)
+    assert alloc.nslots < alloc.spills
+    ivs = live_intervals(func)
+    by_slot = {}
+    for r, slot in alloc.slots.items():
+        by_slot.setdefault(slot, []).append(ivs[r])
+    for shared in by_slot.values():
+        shared.sort(key=lambda iv: iv.start)
+        for x, y in zip(shared, shared[1:]):
+            assert x.end < y.start
@@ -0,0 +1,116 @@
+import sys
+import os
+import io
+import shutil
+import tempfile
+import subprocess
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from gen import Emit, AsmWriter
+
+def parse(text, fold=False):
+    lexer = Lexer('gen.c', text)
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=fold)
+    p.parse()
+    return p.ast
+
+def compile(text, fold=False):
+    out = io.StringIO()
+    Emit(out).emit(parse(text, fold))
+    return out.getvalue()
+
+def lines(asm):
+    '''
+    the stripped lines of asm, a space between the mnemonic and the operands
+    '''
+    return [l.strip().replace('\t', ' ') for l in asm.splitlines()]
+
+def assemble(asm):
+    '''
+    run the system assembler on asm when there is one
+    '''
+    cc = shutil.which('cc') or shutil.which('gcc')
+    if cc is None:
+        return
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'gen.s')
+        with open(path, 'w') as f:
+            f.write(asm)
+        subprocess.check_call([cc, '-c', path, '-o', os.path.join(d, 'gen.o')])
+
+PROGRAM = '''
+char c = -1;
+unsigned short us = 65535;
+long big = 1 << 20;
+double d = 2.5;
+int zero;
+int f1(int a, char b, long l, double x){
+  int t = 1 + 2 * 3 - 4 / 2 % 3;
+  long w = 5;
+  double y = 1.5;
+  int z = 2.75;
+  char q = 300;
+  int k = !3 && 2 || 0;
+  if (1 < 3) { int m = -4; } else if (2 >= 1) { int n = 5 == 1; }
+  int cmp = 1.5 < 2.5;
+}
+int main(){ int r = 1; }
+'''
+
+def test_globals():
+    asm = lines(compile(PROGRAM))
+    i = asm.index('c:')
+    assert asm[i - 2:i + 2] == ['.globl c', '.align 1', 'c:', '.byte -1']
+    assert asm[asm.index('us:') + 1] == '.short 65535'
+    assert asm[asm.index('big:') + 1] == '.quad 1048576'
+    assert asm[asm.index('d:') + 1] == '.quad 4612811918334230528' # 2.5
+    assert asm[asm.index('zero:') + 1] == '.zero 4'
+
+def test_functions():
+    asm = compile(PROGRAM)
+    body = lines(asm)
+    i = body.index('f1:')
+    assert body[i + 1:i + 4] == ['pushq %rbp', 'movq %rsp, %rbp', 'subq $64, %rsp']
+    # parameters are spilled from the argument registers, the slots are
+    # sorted by alignment
+    assert body[i + 4:i + 8] == ['movl %edi, -36(%rbp)', 'movb %sil, -53(%rbp)',
+                                 'movq %rdx, -8(%rbp)', 'movsd %xmm0, -16(%rbp)']
+    assert 'idivl %ecx' in body and 'movl %edx, %eax' in body
+    assert 'movsbl %al, %eax' in body # char q = 300
+    assert 'cvttss2sil %xmm0, %eax' in body # int z = 2.75
+    assert 'negl %eax' in body and 'setl %al' in body
+    assert body[-1] != 'ret' and '.section .rodata' in body
+    assemble(asm)
+
+def test_if():
+    body = lines(compile('int main(){ if (0){ int a = 1; } int b = 2; }'))
+    i = body.index('je .L1')
+    # a block's locals come after those of the function
+    assert body[i + 1:i + 4] == ['movl $1, %eax', 'movl %eax, -8(%rbp)', '.L1:']
+
+def test_buffered():
+    class Out(object):
+        def __init__(self):
+            self.writes = 0
+            self.text = []
+        def writelines(self, lines):
+            self.writes += 1
+            self.text.extend(lines)
+    text = 'int main(){' + 'int a = 1 + 2;' * 100 + '}'
+    lexer = Lexer('gen.c', text)
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    out = Out()
+    n = Emit(AsmWriter(out, 64)).emit(p.ast)
+    assert n == len(out.text) and out.writes == (n + 63) // 64
+    assert ''.join(out.text) == compile(text)
+
+def test_not_constant():
+    try:
+        compile('int a = 1 / 0;')
+        assert False
+    except Exception as e:
+        assert 'initializer element of a is not constant' in str(e)
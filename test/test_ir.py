@@ -0,0 +1,85 @@
+import sys
+import os
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+import ir
+from ir import Op, Ins
+
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
+
+def lower(text):
+    lexer = Lexer('ir.c', text)
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    funcs = ir.lower(p.ast)
+    for f in funcs:
+        ir.verify(f)
+    return funcs
+
+def test_dump():
+    with open(T1) as f:
+        main, = lower(f.read())
+    assert main.dump() == '''func main() {
+.B0:
+    %0 = const 6 int
+    %1 = const 2 int
+    %2 = div %0, %1 int
+    %b.3 = copy %2 int
+    %4 = const 1 int
+    br %4, .B1, .B2
+.B1:
+    %5 = const 7 int
+    %c.6 = copy %5 int
+    jmp .B3
+.B2:
+    %7 = const 111 int
+    %d.8 = copy %7 int
+    jmp .B3
+.B3:
+    %9 = const 0 int
+    ret %9
+}
+'''
+    assert [b.id for b in main.blocks[3].preds] == [1, 2]
+
+def test_lowering():
+    f, = lower('int f(long l, float x){ long a = 1 + 2; char b = !0 && 3 || 4 < 5; }')
+    assert f.params == [0, 1] and [f.types[r].size for r in f.params] == [8, 4]
+    ops = [ins.op for b in f.blocks for ins in b.ins]
+    assert ops[:2] == [Op.ARG, Op.ARG] and ops[-1] == Op.RET
+    assert Op.CONV in ops and ops.count(Op.BR) == 2
+    assert f.blocks[-1].ins[-1].a is None # no value outside main
+    # the result of && and || is defined on both paths
+    assert len([b for b in f.blocks if len(b.preds) == 2]) == 2
+
+def test_verify():
+    f, = lower('int main(){ int a = 1; if (1) { int b = 2; } }')
+    entry = f.blocks[0]
+    term = entry.ins.pop()
+    for broken in ([Ins(Op.JMP, None, 7)], [term, Ins(Op.JMP, None, 1)], [Ins(Op.COPY, 0, 99), term]):
+        saved = entry.ins
+        entry.ins = entry.ins + broken
+        try:
+            ir.verify(f)
+            assert False
+        except Exception as e:
+            assert str(e).startswith('ir: main .B0')
+        entry.ins = saved
+    entry.ins.append(Ins(Op.JMP, None, 2)) # successors are stale until link
+    try:
+        ir.verify(f)
+        assert False
+    except Exception as e:
+        assert 'successors out of date' in str(e)
+    f.link()
+    ir.verify(f)
+
+def test_linear():
+    body = 'int a{0} = 1 + 2 * 3; if (1 < 2) {{ int b{0} = !4 && 5; }}'
+    small, = lower('int main(){' + ''.join(body.format(i) for i in range(10)) + '}')
+    large, = lower('int main(){' + ''.join(body.format(i) for i in range(100)) + '}')
+    # every node is lowered to a fixed number of instructions
+    assert large.size() - 2 == (small.size() - 2) * 10 # ret and the 0 of main
+    assert len(large.blocks) - 1 == (len(small.blocks) - 1) * 10
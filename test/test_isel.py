@@ -0,0 +1,49 @@
+import sys
+import io
+sys.path.append("..")
+from gen import Emit
+from ir import Op
+from isel import TABLE, PATTERNS, Pattern, Selector, compile_patterns, immediates
+from test_opt import build
+
+def emit(f, selector=None):
+    out = io.StringIO()
+    e = Emit(out, level=0, selector=selector)
+    e.emit_ir(f)
+    e.w.flush()
+    lines = [l.strip().replace('\t', ' ') for l in out.getvalue().splitlines()]
+    return lines[lines.index('f:') + 3:lines.index('leave') - 1], e.selector # up to the exit label
+
+def test_table():
+    assert TABLE[(Op.ADD, 'r', 'i', 'r', 'a')].name == 'op_tied'
+    assert TABLE[(Op.ADD, 'r', 'i', 'r', 'n')].name == 'add_lea_imm'
+    assert TABLE[(Op.SUB, 'r', 'i', 'r', 'n')].name == 'op_reg'
+    assert TABLE[(Op.SUB, 'r', 'r', 'r', 'b')].name == 'op_acc'
+    assert TABLE[(Op.LT, 'r', 'i', 'j', 'n')].name == 'cmp_jump'
+    assert not (Op.MUL, 'r', 'r', 'm', 'a') in TABLE or TABLE[(Op.MUL, 'r', 'r', 'm', 'a')].name == 'op_acc'
+    # a cheaper pattern takes over its keys, the lookup stays one probe
+    table = compile_patterns(PATTERNS + [Pattern('sub_lea', (Op.SUB,), 'r', 'i', 'r', 'n', 1, ('lea{s} -{bv}({A}), {d}',))])
+    assert table[(Op.SUB, 'r', 'i', 'r', 'n')].name == 'sub_lea' and len(table) == len(TABLE)
+
+def test_add_immediate():
+    # p = p + 5 is one add with an immediate, the constant needs no register
+    f = build([[(Op.ARG, 0, 0), (Op.CONST, 1, 5), (Op.ADD, 0, 0, 1), (Op.RET, None, 0)]])
+    assert immediates(f) == {1: 5}
+    code, sel = emit(f)
+    assert code == ['addl $5, %edi', 'movl %edi, %eax']
+    assert sel.counts == {'op_tied': 1}
+
+def test_lea_and_imul():
+    f = build([[(Op.ARG, 0, 0), (Op.CONST, 1, 5), (Op.ADD, 2, 0, 1), (Op.MUL, 3, 2, 1), (Op.ADD, 2, 3, 0), (Op.RET, None, 2)]])
+    code, sel = emit(f)
+    assert code[0] == 'leal 5(%rdi), %esi'
+    assert code[1].startswith('imull $5, %esi, ')
+    assert sel.counts['add_lea_imm'] == 1 and sel.counts['mul_imm'] == 1
+
+def test_compare_branch():
+    f = build([[(Op.ARG, 0, 0), (Op.CONST, 1, 3), (Op.LT, 2, 0, 1), (Op.BR, None, 2, 1, 2)],
+               [(Op.RET, None, 0)], [(Op.RET, None, 1)]], 3)
+    code, sel = emit(f)
+    # the branch tests the flags of the compare, no setcc
+    assert code[:2] == ['cmpl $3, %edi', 'jge .L3']
+    assert not any(l.startswith('set') for l in code) and sel.counts == {'cmp_jump': 1}
@@ -1,6 +1,12 @@
 import sys
+import io
+import os
+import tempfile
 sys.path.append("..")
-from lex import Lexer
+from lex import Lexer, ScanLexer, RegexLexer, TokenBuffer, lex_cached
+from utils.diskcache import DiskCache
+
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
 
 def filename(path):
     index = str(path).rfind('/') + 1
@@ -11,9 +17,173 @@ def read_file(path):
     with open(path, 'r') as f:
         return f.read()
 
+def token_tuple(t):
+    return (t.kind, t.filename, t.line, t.column, t.value)
+
+def test_iter_tokens_chunked():
+    lexer = Lexer(filename(T1), read_file(T1))
+    lexer.lex()
+    expected = [token_tuple(t) for t in lexer.tokens]
+    for size in (1, 3, 7, 4096):
+        with open(T1, 'r') as f:
+            stream = Lexer(filename(T1), f, chunk_size=size)
+            assert [token_tuple(t) for t in stream.iter_tokens()] == expected
+            assert len(stream.tokens) == 0
+
+SAMPLE = '''/* block **/ int $x_1 = a<<=b>>=c...d..e.f+++g--->h-=i;
+// line comment
+x<<y<=z>>w>=v*=u==t!=s&&r&=q||p|=o^=n/=m%l+k-j*i/h.5 1.25 'c' "str ing" ? : ~ [ ] { } , ;
+/*/ still comment */ '\'' ""
+last'''
+
+def lex_all(engine, text, **kw):
+    lexer = engine('s.c', text, **kw)
+    lexer.lex()
+    return [token_tuple(t) for t in lexer.tokens]
+
+def test_engines_agree():
+    for text in (read_file(T1), SAMPLE, '', '\n', 'a', 'a // tail', '1.5\n\n'):
+        assert lex_all(RegexLexer, text) == lex_all(ScanLexer, text)
+
+def test_engines_agree_chunked():
+    expected = lex_all(ScanLexer, SAMPLE)
+    for size in (1, 2, 5):
+        assert lex_all(RegexLexer, io.StringIO(SAMPLE), chunk_size=size) == expected
+        assert lex_all(ScanLexer, io.StringIO(SAMPLE), chunk_size=size) == expected
+
+def test_errors():
+    for text in ('"abc', "'ab'", '/* abc', '1.2.3', 'a @ b'):
+        for engine in (RegexLexer, ScanLexer):
+            try:
+                engine('s.c', text).lex()
+            except Exception:
+                continue
+            assert False, (engine, text)
+    for engine in (RegexLexer, ScanLexer):
+        try:
+            engine('s.c', '#define N 1\n').lex()
+            assert False, engine
+        except Exception as e:
+            assert 'cpp.Preprocessor' in str(e)
+
+def test_token_buffer():
+    lexer = Lexer('s.c', SAMPLE)
+    lexer.lex()
+    buf = lexer.tokens
+    tokens = list(Lexer('s.c', SAMPLE).iter_tokens())
+    assert len(buf) == len(tokens)
+    assert [token_tuple(t) for t in buf] == [token_tuple(t) for t in tokens]
+    for i, t in enumerate(tokens):
+        assert buf.kind(i) == t.kind and buf.value(i) == t.value
+    assert token_tuple(buf[-1]) == token_tuple(tokens[-1])
+    assert len(buf.strings) < len(buf)
+
+def test_bytes_and_mmap():
+    expected = lex_all(RegexLexer, SAMPLE)
+    data = SAMPLE.encode('utf-8')
+    assert lex_all(RegexLexer, data) == expected
+    assert lex_all(RegexLexer, io.BytesIO(data), chunk_size=3) == expected
+    lexer = RegexLexer.from_file(T1, 's.c')
+    lexer.lex()
+    assert [token_tuple(t) for t in lexer.tokens] == lex_all(RegexLexer, read_file(T1))
+    assert lexer._mapped is None
+
+def test_bytes_utf8_ident():
+    tokens = lex_all(RegexLexer, 'int caf\u00e9 = 1;'.encode('utf-8'))
+    assert tokens[1][4] == 'caf\u00e9'
+
+def test_bytes_utf8_char():
+    def same(tokens):
+        # columns of bytes sources count bytes, the rest is the same
+        return [(kind, line, value) for kind, name, line, column, value in tokens]
+    text = "char c = '\u00e9'; int d = '\u20ac' + 'x'; char *s = \"\u00e9t\u00e9\";"
+    expected = same(lex_all(RegexLexer, text))
+    assert expected[3][2] == '\u00e9' and expected[8][2] == '\u20ac'
+    data = text.encode('utf-8')
+    assert same(lex_all(RegexLexer, data)) == expected
+    assert same(lex_all(RegexLexer, io.BytesIO(data), chunk_size=1)) == expected
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'u.c')
+        with open(path, 'wb') as f:
+            f.write(data)
+        lexer = RegexLexer.from_file(path, 's.c')
+        lexer.lex()
+        assert same(token_tuple(t) for t in lexer.tokens) == expected
+
+def buffer_columns(buf):
+    return (buf.filename, list(buf.kinds), list(buf.lines), list(buf.columns),
+            list(buf.offsets), [buf.value(i) for i in range(len(buf))])
+
+def test_token_buffer_bytes():
+    lexer = Lexer('s.c', SAMPLE + '"\u00e9\\0" ""')
+    lexer.lex()
+    loaded = TokenBuffer.from_bytes(lexer.tokens.to_bytes())
+    assert buffer_columns(loaded) == buffer_columns(lexer.tokens)
+    assert loaded.strings == lexer.tokens.strings
+
+def test_lex_cached():
+    with tempfile.TemporaryDirectory() as d:
+        cache = DiskCache(d)
+        miss = lex_cached('s.c', SAMPLE, cache)
+        assert len(os.listdir(d)) == 1
+        hit = lex_cached('t.c', SAMPLE, cache)
+        assert hit.filename == 't.c'
+        assert buffer_columns(hit)[1:] == buffer_columns(miss)[1:]
+        # a damaged entry is lexed again
+        path = os.path.join(d, os.listdir(d)[0])
+        with open(path, 'wb') as f:
+            f.write(b'junk')
+        assert buffer_columns(lex_cached('s.c', SAMPLE, cache)) == buffer_columns(miss)
+        # so is one cut short at a column boundary
+        with open(path, 'rb') as f:
+            data = f.read()
+        for cut in (4, 8 * len(miss)):
+            try:
+                TokenBuffer.from_bytes(data[:-cut])
+                assert False
+            except ValueError:
+                pass
+            with open(path, 'wb') as f:
+                f.write(data[:-cut])
+            assert buffer_columns(lex_cached('s.c', SAMPLE, cache)) == buffer_columns(miss)
+
+def test_disk_cache_lru():
+    with tempfile.TemporaryDirectory() as d:
+        cache = DiskCache(d, max_bytes=250)
+        for key in ('a', 'b'):
+            cache.put(key, b'x' * 100)
+            os.utime(os.path.join(d, key + '.bin'), ns=(0, {'a': 1, 'b': 2}[key] * 10 ** 9))
+        assert cache.get('a') == b'x' * 100 # 'a' is now the most recent
+        cache.put('c', b'x' * 100)
+        assert cache.get('b') is None
+        assert cache.get('a') is not None and cache.get('c') is not None
+
+def test_disk_cache_counts_puts():
+    with tempfile.TemporaryDirectory() as d:
+        cache = DiskCache(d, max_bytes=1000)
+        listings = []
+        evict = cache.evict
+        def counted():
+            listings.append(1)
+            evict()
+        cache.evict = counted
+        for i in range(9):
+            cache.put(str(i), b'x' * 100)
+        cache.put('0', b'x' * 50) # a replaced entry counts its new size
+        # the directory is listed at the first put only
+        assert len(listings) == 1 and cache._total == 850
+        cache.put('a', b'x' * 100)
+        cache.put('b', b'x' * 100)
+        assert len(listings) == 2 and cache._total <= 1000
+        assert sum(os.path.getsize(os.path.join(d, n)) for n in os.listdir(d)) == cache._total
+
+def test_iter_tokens_lazy():
+    stream = Lexer('s.c', io.StringIO('int a;' * 1000)).iter_tokens()
+    assert next(stream).value == 'K_INT'
+    assert next(stream).value == 'a'
+
 if __name__ == '__main__':
     path = './t1.c'
     lexer = Lexer(filename(path), read_file(path))
     lexer.lex()
     lexer.see_tokens()
-
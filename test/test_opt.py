@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.append("..")
+from lex import Lexer
+from parse import Parser
+from ctype import TypeMaker
+import ir
+import opt
+from ir import Op, Ins, Func
+
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
+
+def lower(text):
+    lexer = Lexer('opt.c', text)
+    lexer.lex()
+    p = Parser(lexer.tokens, fold=False)
+    p.parse()
+    return ir.lower(p.ast)
+
+def ops(f):
+    return [ins.op for b in f.blocks for ins in b.ins]
+
+def build(blocks, nregs=4, nparams=1):
+    '''
+    a function of int registers %0 .. %nregs-1, the first nparams are
+    the parameters
+    '''
+    f = Func('f')
+    for i in range(nregs):
+        f.new_reg(TypeMaker().type_int(), 'p' if i < nparams else None)
+    f.params = list(range(nparams))
+    for code in blocks:
+        b = f.new_block()
+        b.ins = [Ins(*ins) for ins in code]
+    f.link()
+    ir.verify(f)
+    return f
+
+def test_levels():
+    with open(T1) as fp:
+        text = fp.read()
+    main, = lower(text)
+    size = main.size()
+    pm = opt.PassManager(0, verify=True)
+    pm.run(main)
+    assert main.size() == size and pm.report() == ['-O0']
+    for level in (1, 2):
+        main, = lower(text)
+        pm = opt.PassManager(level, verify=True)
+        pm.run(main)
+        # every local of t1.c is a dead store, the branch on 1 is gone
+        assert main.dump() == 'func main() {\n.B0:\n    %9 = const 0 int\n    ret %9\n}\n'
+        removed = sum(s.removed for s in pm.stats.values())
+        assert removed == size - 2 and pm.stats['dce'].removed > 0
+        assert len(pm.report()) == len(opt.LEVELS[level]) + 1
+
+def test_sccp():
+    main, = lower('''int main(){
+  int a = 2 * 3 + 1;
+  if (3 < 1) { int b = 1; } else { int c = 1 / 0; }
+  if (7 > 6 && 0 || !0) { int d = 5; }
+}''')
+    assert opt.propagate_constants(main)
+    ir.verify(main)
+    assert not Op.BR in ops(main)
+    # a division by zero is left for run time
+    assert Op.DIV in ops(main) and not Op.MUL in ops(main)
+    a, c, d = [ins for b in main.blocks for ins in b.ins if ins.dst in main.vars.values()]
+    assert (a.op, a.a, c.op, d.op, d.a) == (Op.CONST, 7, Op.COPY, Op.CONST, 5)
+
+def test_sccp_join():
+    # %1 is 4 on both paths into the join, %2 is 4 or 5
+    f = build([[(Op.ARG, 0, 0), (Op.BR, None, 0, 1, 2)],
+               [(Op.CONST, 1, 4), (Op.CONST, 2, 4), (Op.JMP, None, 3)],
+               [(Op.CONST, 1, 4), (Op.CONST, 2, 5), (Op.JMP, None, 3)],
+               [(Op.ADD, 3, 1, 1), (Op.ADD, 4, 2, 1), (Op.ADD, 5, 3, 4), (Op.RET, None, 5)]], 6)
+    opt.propagate_constants(f)
+    join = f.blocks[3].ins
+    assert join[0].op == Op.CONST and join[0].a == 8
+    assert join[1].op == Op.ADD
+
+def test_copies():
+    f = build([[(Op.ARG, 0, 0), (Op.COPY, 1, 0), (Op.ADD, 2, 1, 1), (Op.BR, None, 2, 1, 2)],
+               [(Op.COPY, 3, 2), (Op.JMP, None, 3)],
+               [(Op.COPY, 3, 1), (Op.JMP, None, 3)],
+               [(Op.ADD, 4, 3, 1), (Op.RET, None, 4)]], 5)
+    assert opt.propagate_copies(f)
+    assert (f.blocks[0].ins[2].a, f.blocks[0].ins[2].b) == (0, 0)
+    assert f.blocks[2].ins[0].a == 0
+    # %3 is a different copy on each path
+    assert (f.blocks[3].ins[0].a, f.blocks[3].ins[0].b) == (3, 0)
+    assert opt.eliminate_dead_code(f)
+    assert f.blocks[0].ins[1].op == Op.ADD
+    ir.verify(f)
+
+def test_dead_stores():
+    # %1 is written twice before the read, the first write is dead
+    f = build([[(Op.ARG, 0, 0), (Op.CONST, 1, 1), (Op.CONST, 1, 2), (Op.ADD, 2, 1, 0),
+                (Op.CONST, 3, 9), (Op.RET, None, 2)]], 4)
+    opt.eliminate_dead_code(f)
+    assert [(i.op, i.a) for i in f.blocks[0].ins] == [(Op.ARG, 0), (Op.CONST, 2), (Op.ADD, 1), (Op.RET, 2)]
+
+def test_simplify_cfg():
+    f = build([[(Op.ARG, 0, 0), (Op.BR, None, 0, 1, 2)],
+               [(Op.JMP, None, 3)],
+               [(Op.JMP, None, 3)],
+               [(Op.JMP, None, 4)],
+               [(Op.RET, None, 0)]], 1)
+    assert opt.simplify_cfg(f)
+    ir.verify(f)
+    assert [[i.op for i in b.ins] for b in f.blocks] == [[Op.ARG, Op.RET]]
@@ -1,8 +1,10 @@
 import sys
+import io
+import os
 from graphviz import Digraph
 import time
 sys.path.append("..")
-from lex import Lexer
+from lex import Lexer, ScanLexer, relex
 from parse import Parser
 from astc import *
 
@@ -15,6 +17,146 @@ def read_file(path):
     with open(path, 'r') as f:
         return f.read()
 
+T1 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 't1.c')
+
+def ast_shape(node):
+    '''
+    nested tuples describing the tree, used to compare two parses
+    '''
+    if isinstance(node, list):
+        return [ast_shape(n) for n in node]
+    if not isinstance(node, Node):
+        return node
+    shape = [type(node).__name__, node.kind]
+    for attr in ('val', 'name', 'fname', 'declvar', 'declinit', 'initval',
+                 'left', 'right', 'operand', 'params', 'localvars', 'body',
+                 'stmts', 'cond', 'then', 'els'):
+        if hasattr(node, attr):
+            shape.append(ast_shape(getattr(node, attr)))
+    return tuple(shape)
+
+def parse_text(text):
+    l = Lexer('s.c', text)
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    return p
+
+def test_parse_stream():
+    l = Lexer(filename(T1), read_file(T1))
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    with open(T1, 'r') as f:
+        s = Parser(Lexer(filename(T1), f, chunk_size=5).iter_tokens())
+        s.parse()
+    assert ast_shape(s.ast) == ast_shape(p.ast)
+
+def locations(p):
+    r = []
+    def visit(node):
+        if isinstance(node, list):
+            for n in node:
+                visit(n)
+        elif isinstance(node, Node):
+            loc = p.location(node.sourceloc)
+            r.append((node.kind, loc.filename, loc.line, loc.column))
+            for attr in node.__slots__:
+                visit(getattr(node, attr))
+    visit(p.ast)
+    return r
+
+def test_locations():
+    l = Lexer(filename(T1), read_file(T1))
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    s = ScanLexer(filename(T1), read_file(T1))
+    s.lex()
+    q = Parser(s.tokens)
+    q.parse()
+    r = Parser(Lexer(filename(T1), read_file(T1)).iter_tokens())
+    r.parse()
+    expected = locations(p)
+    assert all(isinstance(loc, int) for loc in (n.sourceloc for n in p.ast))
+    assert ('t1.c', 13) == expected[0][1:3]
+    assert locations(q) == expected
+    assert locations(r) == expected
+
+INCR_SRC = ''.join('int g{0} = {0};\nint f{0}(){{\n  int b = 6/2;\n  if (1){{ int c = 7; }}\n}}\n'.format(i) for i in range(20))
+
+def edit(p, text, offset, removed, inserted):
+    text, first, old_stop, new_stop = relex(p._tokens, text, offset, removed, inserted)
+    return text, p.reparse(first, old_stop, new_stop)
+
+def check_fresh(p, text):
+    q = parse_text(text)
+    assert ast_shape(p.ast) == ast_shape(q.ast)
+    assert locations(p) == locations(q)
+    assert list(p.items) == list(q.items)
+    assert list(p.item_nodes) == list(q.item_nodes)
+    l = Lexer('s.c', text)
+    l.lex()
+    for name in ('kinds', 'lines', 'columns', 'offsets'):
+        assert getattr(p._tokens, name) == getattr(l.tokens, name), name
+    assert [p._tokens.value(i) for i in range(len(l.tokens))] == [l.tokens.value(i) for i in range(len(l.tokens))]
+
+def test_incremental():
+    text = INCR_SRC
+    p = parse_text(text)
+    last = p.ast[-1]
+    # change a number inside a function body
+    offset = text.index('6/2', text.index('f7'))
+    text, parsed = edit(p, text, offset, 1, '12 + 3')
+    assert parsed == 1
+    assert p.ast[-1] is last
+    check_fresh(p, text)
+    # add a declaration and lines in the middle
+    offset = text.index('int g10')
+    text, parsed = edit(p, text, offset, 0, 'int x = 1;\n\nint y = 2;\n')
+    assert parsed <= 3
+    assert p.ast[-1] is last
+    check_fresh(p, text)
+    # remove a whole function
+    start = text.index('int f3')
+    text, parsed = edit(p, text, start, text.index('int g4') - start, '')
+    check_fresh(p, text)
+    # edit on the same line as the following tokens
+    offset = text.index('= 15;') + 2
+    text, parsed = edit(p, text, offset, 2, '1500')
+    assert parsed == 1
+    check_fresh(p, text)
+    # append at the end of the file
+    text, parsed = edit(p, text, len(text), 0, 'int z = 3;\n')
+    assert parsed == 2 # the last function is within the re-lexed tokens
+    check_fresh(p, text)
+
+def test_parse_token_list():
+    l = Lexer(filename(T1), read_file(T1))
+    l.lex()
+    p = Parser(l.tokens)
+    p.parse()
+    s = ScanLexer(filename(T1), read_file(T1))
+    s.lex()
+    q = Parser(s.tokens)
+    q.parse()
+    assert ast_shape(q.ast) == ast_shape(p.ast)
+
+def test_parse_stream_window():
+    src = ''.join('int a{0} = {0};\nint f{0}(){{ if (1) {{ int b = 2; }} }}\n'.format(i) for i in range(200))
+    p = Parser(Lexer('s.c', io.StringIO(src)).iter_tokens())
+    p.parse()
+    assert len(p.ast) == 400
+    ring = p._tokens
+    assert len(ring._window) <= Parser.KEEP_TOKENS + 2
+    # only the locations of the nodes are kept, not one per token
+    l = Lexer('s.c', src)
+    l.lex()
+    q = Parser(l.tokens)
+    q.parse()
+    assert len(ring.lines) == 0 and len(ring._pinned) < len(l.tokens) // 2
+    assert locations(p) == locations(q)
+
 def see_ast(ast):
     dot = Digraph(comment='ast')
     dot.node('root', 'root')
@@ -0,0 +1,85 @@
+import sys
+import os
+import tempfile
+sys.path.append("..")
+from cpp import FileCache
+from pch import build_pch, dump_pch, load_pch, save_pch, read_pch
+from test_astcache import full_shape, coord
+import pcc
+
+PROLOGUE = '''#ifndef PROLOGUE_H
+#define PROLOGUE_H
+#include "base.h"
+#define SCALE(x) x * BASE
+int table = SCALE(3);
+int twice(int a){ int b = BASE; }
+#endif
+'''
+
+BASE = '''#pragma once
+#define BASE 2
+int base = BASE;
+'''
+
+def setup(d, unit):
+    for name, text in (('prologue.h', PROLOGUE), ('base.h', BASE), ('unit.c', unit)):
+        with open(os.path.join(d, name), 'w') as f:
+            f.write(text)
+    return os.path.join(d, 'prologue.h')
+
+def shape(ast, location):
+    return full_shape(ast, lambda i: coord(location(i)))
+
+def symbol_names(tp):
+    names = []
+    s = tp.head
+    while not s is None:
+        names.append(s.name)
+        s = s.up
+    return names
+
+def test_unit_with_pch():
+    with tempfile.TemporaryDirectory() as d:
+        header = setup(d, '#include "prologue.h"\nint local = SCALE(BASE);\n')
+        snap = load_pch(dump_pch(build_pch(header, pcc.COMPILER_VERSION)))
+        assert sorted(snap.macros) == ['BASE', 'PROLOGUE_H', 'SCALE']
+        ast, location = pcc.frontend(os.path.join(d, 'unit.c'), pch=snap)
+        plain, plain_location = pcc.frontend(os.path.join(d, 'unit.c'))
+        assert len(ast) == 4
+        # the same tree, types and locations as including the header
+        assert shape(ast, location) == shape(plain, plain_location)
+
+def test_snapshot_state():
+    with tempfile.TemporaryDirectory() as d:
+        header = setup(d, '')
+        snap = build_pch(header, pcc.COMPILER_VERSION)
+        loaded = load_pch(dump_pch(snap))
+        assert loaded.deps == snap.deps
+        assert loaded.once == snap.once
+        assert loaded.guards == snap.guards
+        assert loaded.tables == snap.tables
+        assert list(loaded.lines) == list(snap.lines)
+        assert shape(loaded.ast, loaded.location) == shape(snap.ast, snap.location)
+        # the symbol tables are filled again, in install order
+        assert symbol_names(loaded.symbols().identifiers) == symbol_names(snap.symbols().identifiers) == ['table', 'base']
+        m = loaded.macros['SCALE']
+        assert m.params == ['x'] and [t.value for t in m.body] == ['x', '*', 'BASE']
+
+def test_freshness():
+    with tempfile.TemporaryDirectory() as d:
+        header = setup(d, '')
+        path = os.path.join(d, 'prologue.pch')
+        save_pch(build_pch(header, pcc.COMPILER_VERSION), path)
+        snap = read_pch(path)
+        assert snap.is_fresh(pcc.COMPILER_VERSION)
+        assert not snap.is_fresh('0.0.0')
+        with open(os.path.join(d, 'base.h'), 'a') as f:
+            f.write('int more;\n')
+        assert not snap.is_fresh(pcc.COMPILER_VERSION)
+
+def test_bad_data():
+    try:
+        load_pch(b'PCCA' + bytes(64))
+        assert False
+    except ValueError:
+        pass
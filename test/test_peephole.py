@@ -0,0 +1,65 @@
+import sys
+import io
+sys.path.append("..")
+from gen import Emit, AsmWriter
+from peephole import Peephole, Rule, RULES
+from test_gen import parse, compile, lines, assemble, PROGRAM
+
+def run(code, rules=None):
+    out = io.StringIO()
+    ph = Peephole(rules)
+    w = AsmWriter(out, peephole=ph)
+    for line in code:
+        if line.endswith(':'):
+            w.label(line[:-1])
+        else:
+            op, _, operands = line.partition(' ')
+            w.ins(op, *(operands.split(', ') if operands else ()))
+    w.flush()
+    return lines(out.getvalue()), ph
+
+def test_rules():
+    asm, ph = run(['movl $1, %eax', 'pushq %rax', 'popq %rax', 'pushq %rbx', 'popq %rdx',
+                   'movl %eax, -4(%rbp)', 'movl -4(%rbp), %eax', 'jmp .L1', '.L1:', 'movq %rax, %rax'])
+    assert asm == ['movl $1, %eax', 'movq %rbx, %rdx', 'movl %eax, -4(%rbp)', '.L1:']
+    assert ph.seen == 9 and ph.removed == 6
+    assert ph.fired['push_pop'] == 1 and ph.fired['store_load'] == 1 and ph.fired['jump_next'] == 1
+    # a label between them is a join, the load stays
+    asm, ph = run(['movl %eax, -4(%rbp)', '.L2:', 'movl -4(%rbp), %eax', 'jmp .L3', '.L4:'])
+    assert len(asm) == 5 and ph.removed == 0
+
+def test_cascade():
+    # removing the inner pair exposes the outer one
+    asm, ph = run(['pushq %rax', 'pushq %rcx', 'popq %rcx', 'popq %rax', 'ret'])
+    assert asm == ['ret'] and ph.fired['push_pop'] == 2
+    asm, ph = run(['pushq %rax', 'movl $2, %eax', 'movq %rax, %rcx', 'popq %rax', 'addl %ecx, %eax'])
+    assert asm == ['movl $2, %ecx', 'addl %ecx, %eax']
+    # the operand is read through %rax, it can not skip it
+    asm, ph = run(['pushq %rax', 'movl (%rax), %eax', 'movq %rax, %rcx', 'popq %rax'])
+    assert len(asm) == 4
+
+def test_extend():
+    rules = RULES + [Rule('add_zero', [('addl', '$0', '?r')], [])]
+    asm, ph = run(['movl $1, %eax', 'addl $0, %eax', 'ret'], rules)
+    assert asm == ['movl $1, %eax', 'ret'] and ph.fired['add_zero'] == 1
+
+def test_emit():
+    ast = parse(PROGRAM)
+    out = io.StringIO()
+    ph = Peephole()
+    n = Emit(out, ph).emit(ast)
+    plain = compile(PROGRAM)
+    assert n == out.getvalue().count('\n') and n == plain.count('\n') - ph.removed
+    assert 'pushq\t%rax' in plain and ph.fired['operand_to_rcx'] > 0
+    assemble(out.getvalue())
+
+def test_small_block():
+    ast = parse(PROGRAM)
+    outs = []
+    for block in (3, 10 ** 9):
+        out = io.StringIO()
+        n = Emit(AsmWriter(out, block=block, peephole=Peephole())).emit(ast)
+        assert n == out.getvalue().count('\n')
+        outs.append(out.getvalue())
+    # the blocks written while the window is full lose and repeat nothing
+    assert outs[0] == outs[1]
@@ -0,0 +1,75 @@
+import sys
+import os
+import io
+import shutil
+import tempfile
+import subprocess
+sys.path.append("..")
+from ctype import TypeMaker
+from gen import Emit
+from regalloc import LinearScan, Allocation, live_intervals
+from ir import Op, Ins, Func
+from test_gen import parse, lines, assemble, PROGRAM
+
+def emit(text, allocator=None, level=0):
+    out = io.StringIO()
+    Emit(out, level=level, allocator=allocator).emit(parse(text))
+    return out.getvalue()
+
+def test_intervals():
+    f = Func('f')
+    for i in range(4):
+        f.new_reg(TypeMaker().type_int())
+    f.params = [0]
+    entry, other = f.new_block(), f.new_block()
+    entry.ins = [Ins(Op.ARG, 0, 0), Ins(Op.CONST, 1, 2), Ins(Op.ADD, 2, 0, 1), Ins(Op.JMP, None, 1)]
+    other.ins = [Ins(Op.CONST, 3, 1), Ins(Op.ADD, 3, 3, 0), Ins(Op.RET, None, 2)]
+    f.link()
+    ivs = live_intervals(f)
+    assert [(ivs[r].start, ivs[r].end) for r in range(4)] == [(0, 5), (1, 2), (2, 6), (4, 5)]
+
+def test_no_pressure():
+    ra = LinearScan()
+    asm = emit(PROGRAM, ra)
+    assert ra.spills == {'f1': 0, 'main': 0}
+    # nothing but the frame pointer touches the stack
+    assert not '(%rbp)' in asm and not 'pushq\t%rax' in asm
+    assemble(asm)
+
+def test_spills():
+    ra = LinearScan(('%rsi', '%rbx'), ('%xmm8',))
+    asm = lines(emit(PROGRAM, ra))
+    assert ra.spills['f1'] > 0 and ra.report()[0] == '{} spills'.format(ra.spills['f1'])
+    # %rbx is callee saved
+    i = asm.index('f1:')
+    assert asm[i + 4] == 'movq %rbx, -8(%rbp)'
+    j = asm.index('leave', i)
+    assert asm[j - 1] == 'movq -8(%rbp), %rbx'
+    assemble('\n'.join(asm) + '\n')
+
+class Swap(object):
+    '''
+    the first two parameters trade their argument registers
+    '''
+    def allocate(self, func, exclude=()):
+        alloc = Allocation()
+        alloc.regs = {func.params[0]: '%rsi', func.params[1]: '%rdi', func.params[2]: '%rdx'}
+        return alloc
+
+def test_argument_cycle():
+    asm = lines(emit('int f(int a, int b, int c){ }', Swap()))
+    i = asm.index('f:')
+    assert asm[i + 3:i + 6] == ['movq %rdi, %rax', 'movl %esi, %edi', 'movl %eax, %esi']
+
+def test_run():
+    cc = shutil.which('cc') or shutil.which('gcc')
+    if cc is None:
+        return
+    text = PROGRAM.replace('int main(){ int r = 1; }', 'int main(){ int r = 1; if (3 > 2) { int s = 5 / 2; } }')
+    for level in (0, 2):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'run.s')
+            with open(path, 'w') as f:
+                f.write(emit(text, LinearScan(('%rsi', '%rbx')), level))
+            subprocess.check_call([cc, path, '-o', os.path.join(d, 'run')])
+            assert subprocess.call([os.path.join(d, 'run')]) == 0
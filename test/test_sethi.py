@@ -0,0 +1,66 @@
+import sys
+import io
+sys.path.append("..")
+from gen import Emit
+from ir import Lower, Op
+from sethi import label, right_first
+from astc import NodeKind
+from test_gen import parse, assemble
+
+# the right operand needs more registers than the left one
+HEAVY = 'int f(){ int t = 1 + 2 * 3 * 4 - 5; }'
+
+def init(ast):
+    '''
+    the initializer of the first declaration of the first function,
+    below its conversion
+    '''
+    node = ast[0].body.stmts[0].declinit[0].initval
+    return node.operand if node.kind == NodeKind.AST_CONV else node
+
+def emit(ast, **options):
+    out = io.StringIO()
+    Emit(out, **options).emit(ast)
+    return out.getvalue()
+
+def depth(asm):
+    '''
+    deepest stack of the temporaries of the stack machine
+    '''
+    d = top = 0
+    for line in asm.splitlines():
+        op = line.split()[0] if line.strip() else ''
+        if op == 'pushq' and not '%rbp' in line:
+            d += 1
+        elif op == 'popq' and not '%rbp' in line:
+            d -= 1
+        top = max(top, d)
+    return top
+
+def test_label():
+    node = init(parse('int f(){ int t = 1 + 2 * 3 * 4; }'))
+    needs = label(node, {})
+    assert needs[id(node)] == 2
+    assert needs[id(node.left)] == 1 and needs[id(node.right)] == 2
+    assert right_first(node, needs)
+    node = init(parse('int f(){ int t = 1 * 2 + 3 * 4; }'))
+    assert label(node, {})[id(node)] == 3
+
+def test_sequenced():
+    node = init(parse('int f(){ int t = 1 && 2 * 3 * 4; }'))
+    assert not right_first(node, {})
+
+def test_stack_depth():
+    ast = parse(HEAVY)
+    ordered, plain = emit(ast), emit(ast, reorder=False)
+    assert depth(ordered) < depth(plain)
+    assemble(ordered)
+
+def test_ir_order():
+    node = parse(HEAVY)[0]
+    f = Lower().lower(node)
+    ops = [ins.op for ins in f.blocks[0].ins if ins.op != Op.CONST]
+    # the right subtree is computed before the add that reads it
+    assert ops[:3] == [Op.MUL, Op.MUL, Op.ADD]
+    f = Lower(reorder=False).lower(node)
+    assert f.blocks[0].ins[0].op == Op.CONST and f.blocks[0].ins[0].a == 1
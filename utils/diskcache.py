@@ -0,0 +1,108 @@
+'''
+Copyright 2018 JackLiang.
+
+size bounded lru cache directory
+'''
+import os
+import hashlib
+import tempfile
+
+def content_key(data, *salts):
+    '''
+    cache key of data, salts are the versions the cached form depends on
+    '''
+    h = hashlib.sha256()
+    for salt in salts:
+        h.update(str(salt).encode('utf-8'))
+        h.update(b'\0')
+    if isinstance(data, str):
+        h.update(b's')
+        data = data.encode('utf-8', 'surrogatepass')
+    else:
+        h.update(b'b')
+    h.update(data)
+    return h.hexdigest()
+
+class DiskCache(object):
+    '''
+    one file per key, the file mtime is the last use.
+    when the directory grows over max_bytes the least recently used are removed.
+    the size is counted as entries are stored, the directory is only listed
+    when the count crosses max_bytes. entries other processes store are
+    seen at that listing
+    '''
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, suffix='.bin'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._total = None # bytes in the directory, listed at the first put
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        if self._total is None:
+            self.evict()
+        path = self._path(key)
+        try:
+            old = os.stat(path).st_size
+        except OSError:
+            old = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._total += len(data) - old
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''
+        list the directory and remove the least recently used entries
+        until it fits max_bytes
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+        self._total = total
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._total = total
+            if total <= self.max_bytes:
+                break
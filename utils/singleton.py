@@ -12,8 +12,9 @@ class Singleton(object):
         pass
 
     def __new__(cls, *args, **kwargs):
-        if not hasattr(Singleton, "_instance"):
+        # one instance per subclass
+        if not "_instance" in cls.__dict__:
             with Singleton._instance_lock:
-                if not hasattr(Singleton, "_instance"):
-                    Singleton._instance = object.__new__(cls)  
-        return Singleton._instance
+                if not "_instance" in cls.__dict__:
+                    cls._instance = object.__new__(cls)
+        return cls._instance